@@ -7,6 +7,18 @@ from slicer.ScriptedLoadableModule import *
 from slicer.util import VTKObservationMixin
 import logging
 import numpy as np
+from vtk.util import numpy_support
+
+from CurveComparisonLibs.CurveComparisonBatch import CurveComparisonBatch
+from CurveComparisonLibs.CurveComparisonMetrics import NUMBER_OF_ISO_REGIONS, computeCurveMetrics
+from CurveComparisonLibs.CurveComparisonResults import CurveComparisonResults
+from CurveComparisonLibs.CurveComparisonRunner import CurveComparisonRunner
+from CurveComparisonLibs.CurveComparisonSearch import CurveComparisonSearch
+from CurveComparisonLibs.CurveComparisonSweep import CurveComparisonSweep
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationPathSolver import NeuroSegmentParcellationPathSolver
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationPointLocator import NeuroSegmentParcellationPointLocator
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationTransforms import arrayFromPoints
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationWorldSurfaceCache import NeuroSegmentParcellationWorldSurfaceCache
 
 class CurveComparison(ScriptedLoadableModule, VTKObservationMixin):
 
@@ -15,7 +27,7 @@ class CurveComparison(ScriptedLoadableModule, VTKObservationMixin):
     VTKObservationMixin.__init__(self)
     self.parent.title = "Curve Comparison"
     self.parent.categories = [""]
-    self.parent.dependencies = []
+    self.parent.dependencies = ["NeuroSegmentParcellation"]
     self.parent.contributors = [""]
     self.parent.helpText = """"""
     self.parent.helpText += self.getDefaultModuleDocumentationLink()
@@ -27,6 +39,8 @@ class CurveComparisonWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     ScriptedLoadableModuleWidget.__init__(self, parent)
     VTKObservationMixin.__init__(self)
     self.logic = None
+    self.runner = None
+    self.runnerTableNode = None
 
   def setup(self):
     ScriptedLoadableModuleWidget.setup(self)
@@ -40,110 +54,256 @@ class CurveComparisonWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     self.ui.computeButton.connect('clicked(bool)', self.onComputeButtonClicked)
     self.ui.outputTableNodeSelector.connect('currentNodeChanged(vtkMRMLNode*)', self.updateComputeButton)
     self.ui.inputCurveNodeSelector.connect('currentNodeChanged(vtkMRMLNode*)', self.updateComputeButton)
+    self.ui.adaptiveSearchCheckBox.connect('toggled(bool)', self.updateSearchWidgets)
+    self.ui.cancelButton.connect('clicked(bool)', self.onCancelButtonClicked)
+    self.ui.progressBar.visible = False
+    self.ui.cancelButton.visible = False
     self.updateComputeButton()
 
+    self.updateTimer = qt.QTimer()
+    self.updateTimer.setInterval(100)
+    self.updateTimer.connect('timeout()', self.onUpdateTimer)
+
     self.logic = CurveComparisonLogic()
+    for columnName in self.logic.OBJECTIVE_METRICS.keys():
+      self.ui.objectiveComboBox.addItem(columnName)
+    self.updateSearchWidgets()
+
+  def updateSearchWidgets(self):
+    adaptiveSearch = self.ui.adaptiveSearchCheckBox.checked
+    self.ui.evaluationBudgetSpinBox.enabled = adaptiveSearch
+    self.ui.objectiveComboBox.enabled = adaptiveSearch
 
   def updateComputeButton(self):
     currentTableNode = self.ui.outputTableNodeSelector.currentNode()
     currentCurveNode = self.ui.inputCurveNodeSelector.currentNode()
     self.ui.computeButton.enabled = (not currentTableNode is None and not currentCurveNode is None and
-      not currentCurveNode.GetShortestDistanceSurfaceNode() is None and currentCurveNode.GetNumberOfControlPoints() >= 2)
+      not currentCurveNode.GetShortestDistanceSurfaceNode() is None and currentCurveNode.GetNumberOfControlPoints() >= 2
+      and self.runner is None)
+
+  def cleanup(self):
+    if self.runner is not None:
+      self.runner.cancel()
+    self.updateTimer.stop()
 
   def onComputeButtonClicked(self):
+    if self.ui.backgroundCheckBox.checked:
+      self.startBackgroundComputation()
+      return
+
     try:
       qt.QApplication.setOverrideCursor(qt.Qt.WaitCursor)
       slicer.app.pauseRender()
       inputCurveNode = self.ui.inputCurveNodeSelector.currentNode()
       outputTableNode = self.ui.outputTableNodeSelector.currentNode()
-      self.logic.runCurveOptimization(inputCurveNode, outputTableNode)
+      searchMode = self.logic.EXHAUSTIVE_SEARCH
+      if self.ui.adaptiveSearchCheckBox.checked:
+        searchMode = self.logic.ADAPTIVE_SEARCH
+      self.logic.runCurveOptimization(inputCurveNode, outputTableNode, self.ui.parallelSweepCheckBox.checked,
+        searchMode=searchMode, numberOfEvaluations=self.ui.evaluationBudgetSpinBox.value,
+        objectiveColumnName=self.ui.objectiveComboBox.currentText, numberOfISORegions=self.ui.isoRegionsSpinBox.value)
+      self.updateBestWeights(outputTableNode)
+    finally:
+      slicer.app.resumeRender()
+      qt.QApplication.restoreOverrideCursor()
+
+  def startBackgroundComputation(self):
+    inputCurveNode = self.ui.inputCurveNodeSelector.currentNode()
+    outputTableNode = self.ui.outputTableNodeSelector.currentNode()
+    searchMode = self.logic.EXHAUSTIVE_SEARCH
+    if self.ui.adaptiveSearchCheckBox.checked:
+      searchMode = self.logic.ADAPTIVE_SEARCH
+    self.runner = self.logic.startCurveOptimization(inputCurveNode, outputTableNode, searchMode=searchMode,
+      numberOfEvaluations=self.ui.evaluationBudgetSpinBox.value,
+      objectiveColumnName=self.ui.objectiveComboBox.currentText, numberOfISORegions=self.ui.isoRegionsSpinBox.value)
+    if self.runner is None:
+      slicer.util.errorDisplay("Could not start the background computation")
+      return
+
+    self.runnerTableNode = outputTableNode
+    self.ui.progressBar.maximum = self.runner.numberOfEvaluations
+    self.ui.progressBar.value = 0
+    self.ui.progressBar.visible = True
+    self.ui.cancelButton.visible = True
+    self.ui.cancelButton.enabled = True
+    self.updateComputeButton()
+    self.updateTimer.start()
+
+  def onCancelButtonClicked(self):
+    if self.runner is None:
+      return
+    self.runner.cancel()
+    self.ui.cancelButton.enabled = False
+
+  def onUpdateTimer(self):
+    if self.runner is None:
+      self.updateTimer.stop()
+      return
+
+    running = self.runner.isRunning()
+    self.logic.updateCurveOptimization(self.runner, self.runnerTableNode)
+    self.ui.progressBar.value = min(self.runner.numberOfCompletedEvaluations, self.ui.progressBar.maximum)
+    if running:
+      return
+
+    self.updateTimer.stop()
+    self.logic.finishCurveOptimization(self.runner, self.runnerTableNode)
+    self.updateBestWeights(self.runnerTableNode)
+    if self.runner.errorMessage:
+      slicer.util.errorDisplay("Curve optimization failed: " + self.runner.errorMessage)
+    self.runner = None
+    self.runnerTableNode = None
+    self.ui.progressBar.visible = False
+    self.ui.cancelButton.visible = False
+    self.updateComputeButton()
 
-      weight, distance = self.logic.getLowestAverageDistanceWeight(outputTableNode)
-      self.ui.lowestAverageLineEdit.text = str(weight)
+  def updateBestWeights(self, outputTableNode):
+    weight, distance = self.logic.getLowestAverageDistanceWeight(outputTableNode)
+    self.ui.lowestAverageLineEdit.text = str(weight)
 
-      weight, distance = self.logic.getLowestMaximumDistanceWeight(outputTableNode)
-      self.ui.lowestMaxLineEdit.text = str(weight)
+    weight, distance = self.logic.getLowestMaximumDistanceWeight(outputTableNode)
+    self.ui.lowestMaxLineEdit.text = str(weight)
 
-      weight, overlap = self.logic.getHightestOverlapPercentWeight(outputTableNode)
-      self.ui.hightestOverlapLineEdit.text = str(weight)
+    weight, overlap = self.logic.getHightestOverlapPercentWeight(outputTableNode)
+    self.ui.hightestOverlapLineEdit.text = str(weight)
 
-      weight, overlap = self.logic.getHightestISOOverlapWeight(outputTableNode)
-      self.ui.hightestISOOverlapLineEdit.text = str(weight)
+    weight, overlap = self.logic.getHightestISOOverlapWeight(outputTableNode)
+    self.ui.hightestISOOverlapLineEdit.text = str(weight)
 
-      optimizerCurve = slicer.mrmlScene.GetFirstNodeByName("CurveComparisonPreview")
-      import json
-      weight = json.loads(weight)
+    optimizerCurve = slicer.mrmlScene.GetFirstNodeByName("CurveComparisonPreview")
+    if optimizerCurve is not None and weight is not None:
       self.logic.setCurveNodeWeights(optimizerCurve, weight)
-    finally:
-      slicer.app.resumeRender()
-      qt.QApplication.restoreOverrideCursor()
 
 class CurveComparisonLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
 
-  WEIGHTS_COLUMN_NAME = "Weights"
+  # Weight columns, in the same order as the weights [d, c, h, dc, dh, ch, dch, p]
+  WEIGHT_COLUMN_NAMES = [
+    "Distance weight",
+    "Curvature weight",
+    "Sulcal height weight",
+    "Distance curvature weight",
+    "Distance sulcal height weight",
+    "Curvature sulcal height weight",
+    "Distance curvature sulcal height weight",
+    "Direction weight",
+    ]
   AVERAGE_DISTANCE_COLUMN_NAME = "Average distance (mm)"
   MAX_DISTANCE_COLUMN_NAME = "Max distance (mm)"
   OVERLAP_PERCENT_COLUMN_NAME = "Overlap percent (%)"
   ISO_OVERLAP_COLUMN_NAME = "ISO overlap"
+  HAUSDORFF_DISTANCE_COLUMN_NAME = "Hausdorff distance (mm)"
+  MEAN_SYMMETRIC_DISTANCE_COLUMN_NAME = "Mean symmetric distance (mm)"
+  TOLERANCE_OVERLAP_COLUMN_NAME = "Tolerance overlap (%)"
+  GEODESIC_DEVIATION_COLUMN_NAME = "Geodesic deviation (mm)"
+
+  # Metric columns, in the same order as CurveComparisonResults.METRIC_NAMES
+  METRIC_COLUMN_NAMES = [
+    AVERAGE_DISTANCE_COLUMN_NAME,
+    MAX_DISTANCE_COLUMN_NAME,
+    OVERLAP_PERCENT_COLUMN_NAME,
+    ISO_OVERLAP_COLUMN_NAME,
+    HAUSDORFF_DISTANCE_COLUMN_NAME,
+    MEAN_SYMMETRIC_DISTANCE_COLUMN_NAME,
+    TOLERANCE_OVERLAP_COLUMN_NAME,
+    GEODESIC_DEVIATION_COLUMN_NAME,
+    ]
+
+  PARETO_OPTIMAL_COLUMN_NAME = "Pareto optimal"
+  RANKING_SCORE_COLUMN_NAME = "Ranking score"
+  RANK_COLUMN_NAME = "Rank"
+
+  EXHAUSTIVE_SEARCH = "Exhaustive"
+  ADAPTIVE_SEARCH = "Adaptive"
+
+  # Metric name and whether the metric should be minimized, for each column that can be used as a search objective
+  OBJECTIVE_METRICS = {
+    AVERAGE_DISTANCE_COLUMN_NAME: ("averageDistance", True),
+    MAX_DISTANCE_COLUMN_NAME: ("maxDistance", True),
+    OVERLAP_PERCENT_COLUMN_NAME: ("overlapPercent", False),
+    ISO_OVERLAP_COLUMN_NAME: ("isoOverlap", False),
+    HAUSDORFF_DISTANCE_COLUMN_NAME: ("hausdorffDistance", True),
+    MEAN_SYMMETRIC_DISTANCE_COLUMN_NAME: ("meanSymmetricDistance", True),
+    TOLERANCE_OVERLAP_COLUMN_NAME: ("toleranceOverlap", False),
+    GEODESIC_DEVIATION_COLUMN_NAME: ("geodesicDeviation", True),
+    }
 
   def __init__(self):
     ScriptedLoadableModuleLogic.__init__(self)
     VTKObservationMixin.__init__(self)
+    self.worldSurfaceCache = NeuroSegmentParcellationWorldSurfaceCache.getSharedCache()
 
-  def runCurveOptimization(self, inputCurveNode, outputTableNode):
+  def runCurveOptimization(self, inputCurveNode, outputTableNode, parallel=False, numberOfWorkers=None,
+      searchMode=EXHAUSTIVE_SEARCH, numberOfEvaluations=100, objectiveColumnName=AVERAGE_DISTANCE_COLUMN_NAME,
+      numberOfISORegions=NUMBER_OF_ISO_REGIONS):
     """
     :param inputCurveNode: User placed curve node to be optimized
+    :param outputTableNode: Table node that the results are written to
+    :param parallel: If True, the weights are evaluated by a pool of worker threads on a copy of the surface graph,
+      instead of computing each path using the "CurveComparisonPreview" node.
+    :param numberOfWorkers: Number of worker threads used by the parallel sweep. Uses the number of CPUs by default.
+    :param searchMode: EXHAUSTIVE_SEARCH evaluates the 255 binary weight vectors.
+      ADAPTIVE_SEARCH explores continuous weights in [0, 1] using coordinate descent.
+    :param numberOfEvaluations: Maximum number of weights evaluated by the adaptive search
+    :param objectiveColumnName: Column optimized by the adaptive search. One of the columns in OBJECTIVE_METRICS.
+    :param numberOfISORegions: Number of rings around the input curve that are used to compute the ISO overlap
+    :return: CurveComparisonResults containing the metrics of all evaluated weights
     """
-    metrics = []
-
-    inputCurvePolyData = vtk.vtkPolyData()
-    inputCurvePolyData.SetPoints(inputCurveNode.GetCurvePointsWorld())
-
-    inputPointLocator = vtk.vtkPointLocator()
-    inputPointLocator.SetDataSet(inputCurvePolyData)
-    inputPointLocator.BuildLocator()
+    inputCurvePoints_World = arrayFromPoints(inputCurveNode.GetCurvePointsWorld())
+    inputPointLocator = NeuroSegmentParcellationPointLocator(inputCurvePoints_World)
 
-    transformFilter = vtk.vtkTransformPolyDataFilter()
-    transformFilter.SetInputData(inputCurveNode.GetShortestDistanceSurfaceNode().GetPolyData())
-    modelToWorldTransform = vtk.vtkGeneralTransform()
-    slicer.vtkMRMLTransformNode.GetTransformBetweenNodes(inputCurveNode.GetShortestDistanceSurfaceNode().GetParentTransformNode(), None, modelToWorldTransform);
-    transformFilter.SetTransform(modelToWorldTransform)
-    transformFilter.Update()
+    worldSurface = self.getWorldSurface(inputCurveNode.GetShortestDistanceSurfaceNode())
+    inputPolyDataLocator = worldSurface["locator"]
 
-    inputPolyDataLocator = vtk.vtkPointLocator()
-    inputPolyDataLocator.SetDataSet(transformFilter.GetOutput())
-    inputPolyDataLocator.BuildLocator()
+    self.createISORegionOverlay(inputCurveNode, numberOfISORegions)
 
-    self.createISORegionOverlay(inputCurveNode)
+    results = CurveComparisonResults()
+    optimizerCurve = self.createOptimizerCurve(inputCurveNode)
 
-    weightArray = vtk.vtkStringArray()
-    weightArray.SetName(self.WEIGHTS_COLUMN_NAME)
+    if parallel and not NeuroSegmentParcellationPathSolver.isAvailable():
+      logging.warning("runCurveOptimization: Parallel sweep requires scipy. Evaluating weights sequentially.")
+      parallel = False
 
-    averageDistanceArray = vtk.vtkDoubleArray()
-    averageDistanceArray.SetName(self.AVERAGE_DISTANCE_COLUMN_NAME)
-
-    maxDistanceArray = vtk.vtkDoubleArray()
-    maxDistanceArray.SetName(self.MAX_DISTANCE_COLUMN_NAME)
-
-    overlapPercentArray = vtk.vtkDoubleArray()
-    overlapPercentArray.SetName(self.OVERLAP_PERCENT_COLUMN_NAME)
-
-    isoOverlapArray = vtk.vtkDoubleArray()
-    isoOverlapArray.SetName(self.ISO_OVERLAP_COLUMN_NAME)
-
-    table = vtk.vtkTable()
-    table.AddColumn(weightArray)
-    table.AddColumn(averageDistanceArray)
-    table.AddColumn(maxDistanceArray)
-    table.AddColumn(overlapPercentArray)
-    table.AddColumn(isoOverlapArray)
-    outputTableNode.SetAndObserveTable(table)
+    if parallel:
+      sweep = self.createCurveComparisonSweep(inputCurveNode, inputPointLocator, numberOfISORegions)
+    else:
+      geodesicDistances = self.getReferenceGeodesicDistances(inputCurveNode, inputPointLocator)
 
+    def evaluateBatch(weightsList):
+      if parallel:
+        metricsList = sweep.run(weightsList, numberOfWorkers)
+      else:
+        metricsList = []
+        for weights in weightsList:
+          metricsList.append(self.evaluateWeights(inputCurveNode, optimizerCurve, weights, inputPointLocator, inputPolyDataLocator,
+            numberOfISORegions, geodesicDistances))
+      for weights, metrics in zip(weightsList, metricsList):
+        results.addResult(weights, metrics)
+      return metricsList
+
+    if searchMode == self.ADAPTIVE_SEARCH:
+      metricName, minimizeObjective = self.OBJECTIVE_METRICS[objectiveColumnName]
+      search = CurveComparisonSearch(evaluateBatch, metricName, minimizeObjective)
+      search.run(numberOfEvaluations)
+    else:
+      evaluateBatch([self.binaryArray(i, 8) for i in range(1, pow(2, 8))])
+    outputTableNode.SetAndObserveTable(results.toTable(self.WEIGHT_COLUMN_NAMES, self.METRIC_COLUMN_NAMES))
+    self.updateRankingColumns(outputTableNode, results)
+    return results
+
+  def createOptimizerCurve(self, inputCurveNode):
+    """
+    Create or update the "CurveComparisonPreview" curve between the first and last control points of the input curve.
+    The penalties and cost function are copied from the input curve, so that the preview curve uses the same path cost
+    as the paths computed by CurveComparisonSweep.
+    """
     optimizerCurve = slicer.mrmlScene.GetFirstNodeByName("CurveComparisonPreview")
     if optimizerCurve is None:
       optimizerCurve = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFreeSurferCurveNode", "CurveComparisonPreview")
     optimizerCurve.SetAndObserveShortestDistanceSurfaceNode(inputCurveNode.GetShortestDistanceSurfaceNode())
     optimizerCurve.SetCurveTypeToShortestDistanceOnSurface()
+    self.setCurveNodePenalties(optimizerCurve, NeuroSegmentParcellationPathSolver.getCurveNodePenalties(inputCurveNode))
+    optimizerCurve.SetSurfaceCostFunctionType(inputCurveNode.GetSurfaceCostFunctionType())
+    optimizerCurve.SetSurfaceDistanceWeightingFunction(inputCurveNode.GetSurfaceDistanceWeightingFunction())
 
     numberOfControlPoints = inputCurveNode.GetNumberOfControlPoints()
     startPoint_World = [0,0,0]
@@ -155,11 +315,97 @@ class CurveComparisonLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
     points.InsertNextPoint(startPoint_World)
     points.InsertNextPoint(endPoint_World)
     optimizerCurve.SetControlPointPositionsWorld(points)
+    return optimizerCurve
 
-    for i in range(1, pow(2, 8)):
-      weights = self.binaryArray(i, 8)
-      self.evaluateWeights(inputCurveNode, optimizerCurve, weights, inputPointLocator, inputPolyDataLocator, outputTableNode)
+  def createCurveComparisonSweep(self, inputCurveNode, inputPointLocator, numberOfISORegions=NUMBER_OF_ISO_REGIONS):
+    """
+    Create a CurveComparisonSweep between the first and last control points of the input curve, on the world space surface.
+    The ISO region overlay should already be created.
+    """
+    worldSurface = self.getWorldSurface(inputCurveNode.GetShortestDistanceSurfaceNode())
+    surfaceGraph = worldSurface["surfaceGraph"]
+
+    startPoint_World = [0,0,0]
+    inputCurveNode.GetNthControlPointPositionWorld(0, startPoint_World)
+    endPoint_World = [0,0,0]
+    inputCurveNode.GetNthControlPointPositionWorld(inputCurveNode.GetNumberOfControlPoints()-1, endPoint_World)
+    startPointId, endPointId = worldSurface["locator"].findClosestPoints([startPoint_World, endPoint_World])[0]
+
+    isoRegionsArray = inputCurveNode.GetShortestDistanceSurfaceNode().GetPolyData().GetPointData().GetArray("ISO-Regions")
+    isoRegions = numpy_support.vtk_to_numpy(isoRegionsArray) if isoRegionsArray else None
+    costFunctionType, distanceWeightingFunction = NeuroSegmentParcellationPathSolver.getCurveNodeCostFunction(
+      inputCurveNode, surfaceGraph)
+    return CurveComparisonSweep(surfaceGraph, startPointId, endPointId,
+      NeuroSegmentParcellationPathSolver.getCurveNodePenalties(inputCurveNode),
+      inputPointLocator, worldSurface["locator"], isoRegions, numberOfISORegions,
+      costFunctionType, distanceWeightingFunction, self.getReferenceGeodesicDistances(inputCurveNode, inputPointLocator),
+      NeuroSegmentParcellationPathSolver.getCurveNodeSearchMode(inputCurveNode))
+
+  def getReferenceGeodesicDistances(self, inputCurveNode, inputCurveLocator):
+    """
+    Compute the distance along the world space surface from each surface point to the closest point of the input curve.
+    :return: NumPy array containing the distance of each surface point, or None if it could not be computed
+    """
+    worldSurface = self.getWorldSurface(inputCurveNode.GetShortestDistanceSurfaceNode())
+    inputCurvePointIds, _ = worldSurface["locator"].findClosestPoints(inputCurveLocator.points)
+    return worldSurface["surfaceGraph"].getGeodesicDistances(inputCurvePointIds)
+
+  def startCurveOptimization(self, inputCurveNode, outputTableNode, numberOfWorkers=None, searchMode=EXHAUSTIVE_SEARCH,
+      numberOfEvaluations=100, objectiveColumnName=AVERAGE_DISTANCE_COLUMN_NAME, numberOfISORegions=NUMBER_OF_ISO_REGIONS):
+    """
+    Start the curve optimization on a background thread, using a pool of worker threads on a copy of the surface graph.
+    The output table is cleared. The results should be added to the table from the main thread by calling
+    updateCurveOptimization until the returned runner is no longer running, followed by finishCurveOptimization.
+    See runCurveOptimization for a description of the parameters.
+    :return: CurveComparisonRunner, or None if the optimization could not be started
+    """
+    if not NeuroSegmentParcellationPathSolver.isAvailable():
+      logging.error("startCurveOptimization: Background optimization requires scipy")
+      return None
+
+    inputPointLocator = NeuroSegmentParcellationPointLocator(arrayFromPoints(inputCurveNode.GetCurvePointsWorld()))
+    self.createISORegionOverlay(inputCurveNode, numberOfISORegions)
+    sweep = self.createCurveComparisonSweep(inputCurveNode, inputPointLocator, numberOfISORegions)
+    outputTableNode.SetAndObserveTable(CurveComparisonResults().toTable(self.WEIGHT_COLUMN_NAMES, self.METRIC_COLUMN_NAMES))
+
+    runner = CurveComparisonRunner(sweep, numberOfWorkers)
+    if searchMode == self.ADAPTIVE_SEARCH:
+      metricName, minimizeObjective = self.OBJECTIVE_METRICS[objectiveColumnName]
+      runner.startAdaptive(numberOfEvaluations, metricName, minimizeObjective)
+    else:
+      runner.startExhaustive([self.binaryArray(i, 8) for i in range(1, pow(2, 8))])
+    return runner
+
+  def updateCurveOptimization(self, runner, outputTableNode):
+    """
+    Add the results completed by the runner since the last update to the output table.
+    :return: Number of rows that were added
+    """
+    newResults = runner.getNewResults()
+    if len(newResults) == 0:
+      return 0
+
+    table = outputTableNode.GetTable()
+    columnNames = self.WEIGHT_COLUMN_NAMES + self.METRIC_COLUMN_NAMES
+    columns = [table.GetColumnByName(columnName) for columnName in columnNames]
+    for weights, metrics in newResults:
+      values = list(weights) + [metrics[metricName] for metricName in CurveComparisonResults.METRIC_NAMES]
+      for column, value in zip(columns, values):
+        column.InsertNextValue(value)
     table.Modified()
+    return len(newResults)
+
+  def finishCurveOptimization(self, runner, outputTableNode):
+    """
+    Add the remaining results to the output table, and update the ranking columns.
+    If the optimization was cancelled, the table contains the results that were completed before cancelling.
+    :return: CurveComparisonResults containing the metrics of all evaluated weights
+    """
+    runner.wait()
+    runner.getNewResults()
+    outputTableNode.SetAndObserveTable(runner.results.toTable(self.WEIGHT_COLUMN_NAMES, self.METRIC_COLUMN_NAMES))
+    self.updateRankingColumns(outputTableNode, runner.results)
+    return runner.results
 
   def setCurveNodeWeights(self, freeSurferCurveNode, weights):
     freeSurferCurveNode.SetDistanceWeight(weights[0])
@@ -171,64 +417,124 @@ class CurveComparisonLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
     freeSurferCurveNode.SetDistanceCurvatureSulcalHeightWeight(weights[6])
     freeSurferCurveNode.SetDirectionWeight(weights[7])
 
-  def getLowestAverageDistanceWeight(self, tableNode):
-    weightsArray = tableNode.GetTable().GetColumnByName(self.WEIGHTS_COLUMN_NAME)
-    averageDistanceArray = tableNode.GetTable().GetColumnByName(self.AVERAGE_DISTANCE_COLUMN_NAME)
+  def setCurveNodePenalties(self, freeSurferCurveNode, penalties):
+    freeSurferCurveNode.SetCurvaturePenalty(penalties[0])
+    freeSurferCurveNode.SetSulcalHeightPenalty(penalties[1])
+    freeSurferCurveNode.SetDistanceCurvaturePenalty(penalties[2])
+    freeSurferCurveNode.SetDistanceSulcalHeightPenalty(penalties[3])
+    freeSurferCurveNode.SetCurvatureSulcalHeightPenalty(penalties[4])
+    freeSurferCurveNode.SetDistanceCurvatureSulcalHeightPenalty(penalties[5])
 
-    lowestAverageDistanceIndex = -1
-    lowestAverageDistance = vtk.VTK_DOUBLE_MAX
-    for i in range(weightsArray.GetNumberOfValues()):
-      average = averageDistanceArray.GetValue(i)
-      if average < lowestAverageDistance:
-        lowestAverageDistance = average
-        lowestAverageDistanceIndex = i
+  def runBatchOptimization(self, manifestFileName, resultsFileName, numberOfWorkers=None, useProcesses=False,
+      numberOfISORegions=NUMBER_OF_ISO_REGIONS):
+    """
+    Evaluate the weights for all reference curves of a cohort, without using the scene.
+    Worker processes should only be used when running outside of the Slicer application
+    (ex. python -m CurveComparisonLibs.CurveComparisonBatch manifest.json results.csv).
+    See CurveComparisonBatch for the manifest format.
+    :return: Cohort summary (see CurveComparisonBatch.getSummary)
+    """
+    batch = CurveComparisonBatch(manifestFileName, resultsFileName, numberOfISORegions=numberOfISORegions)
+    return batch.run(numberOfWorkers, useProcesses)
+
+  def getResults(self, tableNode):
+    """
+    :return: CurveComparisonResults read from the columns of the output table, or None if the table is not valid
+    """
+    if tableNode is None:
+      return None
+    return CurveComparisonResults.fromTable(tableNode.GetTable(), self.WEIGHT_COLUMN_NAMES, self.METRIC_COLUMN_NAMES)
 
-    weight = weightsArray.GetValue(lowestAverageDistanceIndex)
-    return weight, lowestAverageDistance
+  def exportResults(self, tableNode, fileName):
+    """
+    Save the results in the output table to a compressed NumPy (.npz) or CSV (.csv) file.
+    """
+    results = self.getResults(tableNode)
+    if results is None:
+      logging.error("exportResults: Invalid results table")
+      return False
+    results.save(fileName)
+    return True
+
+  def getBestWeights(self, tableNode, columnName):
+    """
+    :param columnName: One of the metric columns in OBJECTIVE_METRICS
+    :return: Tuple of the weights with the best value of the metric, and the value
+    """
+    results = self.getResults(tableNode)
+    if results is None:
+      return None, None
+    metricName, minimize = self.OBJECTIVE_METRICS[columnName]
+    return results.getBestWeights(metricName, minimize)
+
+  def getMetricWeights(self, columnWeights):
+    """
+    Convert a dictionary of {metricColumnName: importance} to a dictionary of {metricName: importance}.
+    """
+    if columnWeights is None:
+      return None
+    return {self.OBJECTIVE_METRICS[columnName][0]: weight for columnName, weight in columnWeights.items()}
+
+  def updateRankingColumns(self, tableNode, results=None, columnWeights=None):
+    """
+    Add or update the Pareto optimal, ranking score and rank columns of the output table.
+    :param results: CurveComparisonResults of the table. Read from the table if not specified.
+    :param columnWeights: Optional dictionary containing the importance of each metric column in the ranking score
+    """
+    if results is None:
+      results = self.getResults(tableNode)
+    if results is None:
+      return
+
+    table = tableNode.GetTable()
+    columns = [
+      (self.PARETO_OPTIMAL_COLUMN_NAME, results.getParetoMask().astype(np.int32), vtk.VTK_INT),
+      (self.RANKING_SCORE_COLUMN_NAME, results.getRankingScores(self.getMetricWeights(columnWeights)), vtk.VTK_DOUBLE),
+      (self.RANK_COLUMN_NAME, results.getRanks(self.getMetricWeights(columnWeights)).astype(np.int32), vtk.VTK_INT),
+      ]
+    for columnName, values, arrayType in columns:
+      table.RemoveColumnByName(columnName)
+      array = numpy_support.numpy_to_vtk(values, deep=True, array_type=arrayType)
+      array.SetName(columnName)
+      table.AddColumn(array)
+    table.Modified()
+
+  def getParetoOptimalWeights(self, tableNode):
+    """
+    :return: List of the weights that are not dominated by any other weights, considering all metric columns
+    """
+    results = self.getResults(tableNode)
+    if results is None:
+      return []
+    return results.getWeights()[results.getParetoMask()].tolist()
+
+  def getRankedWeights(self, tableNode, columnWeights=None):
+    """
+    :param columnWeights: Optional dictionary containing the importance of each metric column
+    :return: List of (weights, ranking score) sorted from best to worst
+    """
+    results = self.getResults(tableNode)
+    if results is None:
+      return []
+    scores = results.getRankingScores(self.getMetricWeights(columnWeights))
+    order = np.argsort(scores, kind="stable")
+    weights = results.getWeights()
+    return [(weights[i].tolist(), float(scores[i])) for i in order]
+
+  def getLowestAverageDistanceWeight(self, tableNode):
+    return self.getBestWeights(tableNode, self.AVERAGE_DISTANCE_COLUMN_NAME)
 
   def getLowestMaximumDistanceWeight(self, tableNode):
-    weightsArray = tableNode.GetTable().GetColumnByName(self.WEIGHTS_COLUMN_NAME)
-    maxDistanceArray = tableNode.GetTable().GetColumnByName(self.MAX_DISTANCE_COLUMN_NAME)
-
-    lowestMaxDistanceIndex = -1
-    lowestMaxDistance = vtk.VTK_DOUBLE_MAX
-    for i in range(weightsArray.GetNumberOfValues()):
-      maxDistance = maxDistanceArray.GetValue(i)
-      if maxDistance < lowestMaxDistance:
-        lowestMaxDistance = maxDistance
-        lowestMaxDistanceIndex = i
-    weight = weightsArray.GetValue(lowestMaxDistanceIndex)
-    return weight, lowestMaxDistanceIndex
+    return self.getBestWeights(tableNode, self.MAX_DISTANCE_COLUMN_NAME)
 
   def getHightestOverlapPercentWeight(self, tableNode):
-    weightsArray = tableNode.GetTable().GetColumnByName(self.WEIGHTS_COLUMN_NAME)
-    overlapPercentArray = tableNode.GetTable().GetColumnByName(self.OVERLAP_PERCENT_COLUMN_NAME)
-
-    highestOverlapPercentIndex = -1
-    highestOverlapPercent = vtk.VTK_DOUBLE_MIN
-    for i in range(weightsArray.GetNumberOfValues()):
-      overlapPercent = overlapPercentArray.GetValue(i)
-      if overlapPercent > highestOverlapPercent:
-        highestOverlapPercent = overlapPercent
-        highestOverlapPercentIndex = i
-    weight = weightsArray.GetValue(highestOverlapPercentIndex)
-    return weight, highestOverlapPercent
+    return self.getBestWeights(tableNode, self.OVERLAP_PERCENT_COLUMN_NAME)
 
   def getHightestISOOverlapWeight(self, tableNode):
-    weightsArray = tableNode.GetTable().GetColumnByName(self.WEIGHTS_COLUMN_NAME)
-    isoOverlapArray = tableNode.GetTable().GetColumnByName(self.ISO_OVERLAP_COLUMN_NAME)
-
-    highestISOOverlapIndex = -1
-    highestISOOverlap = vtk.VTK_DOUBLE_MIN
-    for i in range(weightsArray.GetNumberOfValues()):
-      isoOverlap = isoOverlapArray.GetValue(i)
-      if isoOverlap > highestISOOverlap:
-        highestISOOverlap = isoOverlap
-        highestISOOverlapIndex = i
-    weight = weightsArray.GetValue(highestISOOverlapIndex)
-    return weight, highestISOOverlap
-
-  def evaluateWeights(self, inputCurveNode, optimizerCurveNode, weights, inputCurveLocator, inputPolyDataLocator, outputTableNode):
+    return self.getBestWeights(tableNode, self.ISO_OVERLAP_COLUMN_NAME)
+
+  def evaluateWeights(self, inputCurveNode, optimizerCurveNode, weights, inputCurveLocator, inputPolyDataLocator,
+      numberOfISORegions=NUMBER_OF_ISO_REGIONS, geodesicDistances=None):
     # [d,   c,   h,  dc,  dh,  ch, dch,   p]
     self.setCurveNodeWeights(optimizerCurveNode, weights)
 
@@ -236,90 +542,46 @@ class CurveComparisonLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
     isoRegionsArrayName = "ISO-Regions"
     pointData = polyData.GetPointData()
     isoRegionsArray = pointData.GetArray(isoRegionsArrayName)
+    isoRegions = None
+    if isoRegionsArray is not None:
+      isoRegions = numpy_support.vtk_to_numpy(isoRegionsArray)
+
+    optimizerPoints_World = arrayFromPoints(optimizerCurveNode.GetCurvePointsWorld())
+    metrics = computeCurveMetrics(optimizerPoints_World, inputCurveLocator, inputPolyDataLocator, isoRegions, numberOfISORegions,
+      geodesicDistances=geodesicDistances)
+    return metrics
 
-    isoRegionSum = {}
-
-    optimizerPoints_World = optimizerCurveNode.GetCurvePointsWorld()
-    averageDistance2 = 0.0
-    maxDistance2 = 0.0
-    overlapPercent = 0.0
-    for i in range(optimizerPoints_World.GetNumberOfPoints()):
-      optimizerPoint_World = optimizerPoints_World.GetPoint(i)
-      closestInputPointID = inputCurveLocator.FindClosestPoint(optimizerPoint_World)
-      closestPoint_World = inputCurveNode.GetCurvePointsWorld().GetPoint(closestInputPointID)
-      distance2 = vtk.vtkMath.Distance2BetweenPoints(optimizerPoint_World, closestPoint_World)
-      averageDistance2 += (distance2/optimizerPoints_World.GetNumberOfPoints())
-      if distance2 > maxDistance2:
-        maxDistance2 = distance2
-      if distance2 == 0.0:
-        overlapPercent += 1.0 / optimizerPoints_World.GetNumberOfPoints()
-
-      polyDataPointID = inputPolyDataLocator.FindClosestPoint(optimizerPoint_World)
-      isoRegion = isoRegionsArray.GetValue(polyDataPointID)
-      if isoRegion >= 0:
-        isoRegion = max(1, isoRegion)
-        isoRegionSum[isoRegion] = isoRegionSum.get(isoRegion, 0) + 1
-
-    import math
-
-    weightsArray = outputTableNode.GetTable().GetColumnByName(self.WEIGHTS_COLUMN_NAME)
-    weightsArray.InsertNextValue(str(weights))
-
-    averageDistance = math.sqrt(averageDistance2)
-    averageDistanceArray = outputTableNode.GetTable().GetColumnByName(self.AVERAGE_DISTANCE_COLUMN_NAME)
-    averageDistanceArray.InsertNextTuple1(averageDistance)
-
-    maxDistance = math.sqrt(maxDistance2)
-    maxDistanceArray = outputTableNode.GetTable().GetColumnByName(self.MAX_DISTANCE_COLUMN_NAME)
-    maxDistanceArray.InsertNextTuple1(math.sqrt(maxDistance2))
-
-    overlapPercentArray = outputTableNode.GetTable().GetColumnByName(self.OVERLAP_PERCENT_COLUMN_NAME)
-    overlapPercentArray.InsertNextTuple1(overlapPercent)
-
-    isoOverlap = 0.0
-    for isoRegion in range(1, 7):
-      regionSum = isoRegionSum.get(isoRegion, 0)
-      fr = regionSum / optimizerPoints_World.GetNumberOfPoints()
-      penalty = 1/6
-      subtotal = (1 - (fr * (1 + (penalty * (isoRegion - 1)))))
-      isoOverlap += subtotal
-    isoOverlap /= 6
-
-    # isoOverlap = 0.0
-    # for isoRegion in range(1, 7):
-    #   regionSum = isoRegionSum.get(isoRegion, 0)
-    #   fr = regionSum / optimizerPoints_World.GetNumberOfPoints()
-    #   fr = fr / isoRegion
-    #   isoOverlap += fr
-
-    isoOverlapArray = outputTableNode.GetTable().GetColumnByName(self.ISO_OVERLAP_COLUMN_NAME)
-    isoOverlapArray.InsertNextTuple1(isoOverlap)
-
-    #logging.info("{0}: Average distance: {1}, Max distance: {2}, Overlap percent: {3}, ISO Overlap: {4}".format(
-    #  str(weights), str(averageDistance), str(maxDistance), str(overlapPercent), str(isoOverlap)))
-
-  def createISORegionOverlay(self, curveNode):
+  def getWorldSurface(self, surfaceNode):
+    """
+    Return the surface of the model node in world coordinates, with its point locator and surface graph.
+    The world surface is shared with the NeuroSegmentParcellation module (see NeuroSegmentParcellationWorldSurfaceCache),
+    and is cached until the surface points, polygons, scalars or parent transforms are modified.
+    :return: Dictionary containing "polyData", "points", "locator" (NeuroSegmentParcellationPointLocator)
+      and "surfaceGraph" (NeuroSegmentParcellationSurfaceGraph)
+    """
+    def createWorldSurface(polyData):
+      locator = self.worldSurfaceCache.getWorldPointLocator(surfaceNode)
+      return {
+        "polyData": polyData,
+        "points": locator.points,
+        "locator": locator,
+        "surfaceGraph": self.worldSurfaceCache.getSurfaceGraph(surfaceNode),
+        }
+    return self.worldSurfaceCache.getItem(surfaceNode, "CurveComparisonWorldSurface", createWorldSurface)
+
+  def createISORegionOverlay(self, curveNode, numberOfRings=NUMBER_OF_ISO_REGIONS):
     """
     :param curve: The curve that the overlay will be created from (vtkMRMLMarkupsCurveNode)
+    :param numberOfRings: Number of rings of neighbors around the curve that are labeled
     """
     polyData = curveNode.GetShortestDistanceSurfaceNode().GetPolyData()
     if polyData is None:
       #TODO
       return
 
-    transformFilter = vtk.vtkTransformPolyDataFilter()
-    transformFilter.SetInputData(polyData)
-    modelToWorldTransform = vtk.vtkGeneralTransform()
-    slicer.vtkMRMLTransformNode.GetTransformBetweenNodes(curveNode.GetShortestDistanceSurfaceNode().GetParentTransformNode(), None, modelToWorldTransform);
-    transformFilter.SetTransform(modelToWorldTransform)
-    transformFilter.Update()
-    polyData = transformFilter.GetOutput()
-
-    pointLocator = vtk.vtkPointLocator()
-    pointLocator.SetDataSet(transformFilter.GetOutput())
-    pointLocator.BuildLocator()
-
-    curvePoints = curveNode.GetCurvePointsWorld()
+    worldSurface = self.getWorldSurface(curveNode.GetShortestDistanceSurfaceNode())
+    curvePointIds, _ = worldSurface["locator"].findClosestPoints(arrayFromPoints(curveNode.GetCurvePointsWorld()))
+    ringIndices = worldSurface["surfaceGraph"].getRingIndices(curvePointIds, numberOfRings)
 
     isoRegionsArrayName = "ISO-Regions"
     pointData = polyData.GetPointData()
@@ -328,46 +590,106 @@ class CurveComparisonLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
       isoRegionsArray = vtk.vtkIdTypeArray()
       isoRegionsArray.SetName(isoRegionsArrayName)
     isoRegionsArray.SetNumberOfValues(polyData.GetNumberOfPoints())
-    isoRegionsArray.Fill(-1)
+    numpy_support.vtk_to_numpy(isoRegionsArray)[:] = ringIndices
+    isoRegionsArray.Modified()
     curveNode.GetShortestDistanceSurfaceNode().AddPointScalars(isoRegionsArray)
 
-    visitedPoints = []
-    previousISORegion = []
-    for regionIndex in range(7):
-      currentISORegion = []
-      if regionIndex == 0:
-        for i in range(curvePoints.GetNumberOfPoints()):
-          curvePoint_World = curvePoints.GetPoint(i)
-          currentISORegion.append(pointLocator.FindClosestPoint(curvePoint_World))
-      else:
-        currentISORegion = self.getAdjacentPoints(polyData, previousISORegion)
-
-      for isoPointID in currentISORegion:
-        if isoPointID in visitedPoints:
-          continue
-        isoRegionsArray.SetValue(isoPointID, regionIndex)
-
-      visitedPoints += currentISORegion
-      previousISORegion = currentISORegion
-
-  def getAdjacentPoints(self, inputPolydata, inputPointIDs):
-    pointIDs = []
-    cellIdList = vtk.vtkIdList()
-    pointIdList = vtk.vtkIdList()
-    for pointID in inputPointIDs:
-      inputPolydata.GetPointCells(pointID, cellIdList)
-      for cellIndex in range(cellIdList.GetNumberOfIds()):
-        inputPolydata.GetCellPoints(cellIdList.GetId(cellIndex), pointIdList)
-        for pointIndex in range(pointIdList.GetNumberOfIds()):
-          pointID = pointIdList.GetId(pointIndex)
-          if pointID in inputPointIDs or pointID in pointIDs:
-            continue
-          pointIDs.append(pointID)
-    return pointIDs
-
   def binaryArray(self, num, m):
     """
     Convert a positive integer num into an m-bit bit vector
     From: https://stackoverflow.com/a/47521145
     """
     return (np.array(list(np.binary_repr(num).zfill(m))).astype(np.int8)).tolist()
+
+class CurveComparisonTest(ScriptedLoadableModuleTest):
+  """
+  This is the test case for your scripted module.
+  """
+
+  def setUp(self):
+    """ Do whatever is needed to reset the state - typically a scene clear will be enough.
+    """
+    slicer.mrmlScene.Clear()
+
+  def runTest(self):
+    """Run as few or as many tests as needed here.
+    """
+    self.setUp()
+    self.curveComparisonSweep1()
+
+  def setupSurface(self, radius):
+    """
+    Create a sphere model with "curv" and "sulc" point scalars that have both positive and negative values.
+    """
+    sphereSource = vtk.vtkSphereSource()
+    sphereSource.SetRadius(radius)
+    sphereSource.SetPhiResolution(75)
+    sphereSource.SetThetaResolution(75)
+    sphereSource.Update()
+    polyData = sphereSource.GetOutput()
+
+    points = numpy_support.vtk_to_numpy(polyData.GetPoints().GetData()) / radius
+    for arrayName, values in [("curv", np.sin(3.0 * points[:,0]) * points[:,2]), ("sulc", np.cos(2.0 * points[:,1]) - 0.5)]:
+      array = numpy_support.numpy_to_vtk(values.astype(np.float32), deep=True)
+      array.SetName(arrayName)
+      polyData.GetPointData().AddArray(array)
+
+    modelNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode")
+    modelNode.SetAndObservePolyData(polyData)
+    modelNode.CreateDefaultDisplayNodes()
+    return modelNode
+
+  def setCurveNodeCostFunction(self, curveNode, distanceWeightingFunction):
+    """
+    Set the cost function of the curve in the same way as NeuroSegmentParcellationLogic.updateInputMarkupSurfaceCostFunction.
+    """
+    curveNode.SetAttribute("DistanceWeightingFunction", distanceWeightingFunction)
+    if not distanceWeightingFunction:
+      curveNode.SetSurfaceCostFunctionType(curveNode.GetSurfaceCostFunctionTypeFromString("distance"))
+      return
+
+    pointData = curveNode.GetShortestDistanceSurfaceNode().GetPolyData().GetPointData()
+    for arrayName in ["sulc", "curv"]:
+      scalarRange = pointData.GetArray(arrayName).GetRange()
+      distanceWeightingFunction = distanceWeightingFunction.replace(arrayName + "Min", str(scalarRange[0]))
+      distanceWeightingFunction = distanceWeightingFunction.replace(arrayName + "Max", str(scalarRange[1]))
+    curveNode.SetSurfaceCostFunctionType(curveNode.GetSurfaceCostFunctionTypeFromString("inverseSquared"))
+    curveNode.SetSurfaceDistanceWeightingFunction(distanceWeightingFunction)
+
+  def curveComparisonSweep1(self):
+    """
+    Check that the paths evaluated by CurveComparisonSweep are the same as the paths of the "CurveComparisonPreview"
+    curve node, for weights and penalties that use all of the cost terms, with both cost functions.
+    """
+    if not NeuroSegmentParcellationPathSolver.isAvailable():
+      logging.warning("curveComparisonSweep1: scipy is not available. Skipping test.")
+      return
+
+    surfaceNode = self.setupSurface(50.0)
+    inputCurveNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFreeSurferCurveNode", "InputCurve")
+    inputCurveNode.SetAndObserveShortestDistanceSurfaceNode(surfaceNode)
+    inputCurveNode.SetCurveTypeToShortestDistanceOnSurface()
+    inputCurveNode.AddControlPoint(vtk.vtkVector3d(-24.256452560424805, -24.25225257873535, 36.426605224609375))
+    inputCurveNode.AddControlPoint(vtk.vtkVector3d(24.005630493164062, 29.707569122314453, 32.274898529052734))
+
+    logic = CurveComparisonLogic()
+    logic.setCurveNodePenalties(inputCurveNode, [5.0, 2.0, 3.0, 1.5, 4.0, 2.5])
+
+    weightsList = [
+      [1.0, 1.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0],
+      [1.0, 0.0, 1.0, 1.0, 0.0, 0.0, 1.0, 0.0],
+      [0.5, 1.0, 1.0, 0.0, 0.0, 1.0, 0.0, 1.0],
+      [1.0, 0.25, 0.75, 0.5, 0.5, 0.25, 0.75, 0.5],
+      ]
+    for distanceWeightingFunction in ["", "1 + (sulc - sulcMin) / (sulcMax - sulcMin)"]:
+      self.setCurveNodeCostFunction(inputCurveNode, distanceWeightingFunction)
+      inputPointLocator = NeuroSegmentParcellationPointLocator(arrayFromPoints(inputCurveNode.GetCurvePointsWorld()))
+      logic.createISORegionOverlay(inputCurveNode)
+      sweep = logic.createCurveComparisonSweep(inputCurveNode, inputPointLocator)
+      optimizerCurve = logic.createOptimizerCurve(inputCurveNode)
+      for weights in weightsList:
+        logic.setCurveNodeWeights(optimizerCurve, weights)
+        curvePoints = arrayFromPoints(optimizerCurve.GetCurvePointsWorld())
+        pathPoints = sweep.surfaceGraph.points[sweep.findPath(weights)]
+        self.assertEqual(pathPoints.shape, curvePoints.shape, "weights: " + str(weights))
+        self.assertTrue(np.allclose(pathPoints, curvePoints, atol=1e-3), "weights: " + str(weights))
@@ -0,0 +1,375 @@
+import os
+import csv
+import json
+import logging
+import concurrent.futures
+import numpy as np
+
+from CurveComparisonLibs.CurveComparisonMetrics import NUMBER_OF_ISO_REGIONS
+from CurveComparisonLibs.CurveComparisonResults import CurveComparisonResults
+from CurveComparisonLibs.CurveComparisonSweep import CurveComparisonSweep
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationPathSolver import NeuroSegmentParcellationPathSolver
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationPointLocator import NeuroSegmentParcellationPointLocator
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationSurfaceGraph import NeuroSegmentParcellationSurfaceGraph
+
+# Surface graphs loaded by the current process, keyed by the subject surface, curv and sulc file names
+_surfaceGraphs = {}
+# Path solvers of the reference curves, keyed by the same keys as the surface graphs
+_referencePathSolvers = {}
+
+def loadSurface(fileName):
+  """
+  Load the points and polygons of a surface.
+  VTK readable files (.vtk, .vtp, .ply, .stl, .obj) are read using VTK. Other files are read as FreeSurfer surfaces
+  using nibabel.
+  :return: Tuple of (points, connectivity, offsets) NumPy arrays
+  """
+  extension = os.path.splitext(fileName)[1].lower()
+  if extension in [".vtk", ".vtp", ".ply", ".stl", ".obj"]:
+    import vtk
+    from vtk.util import numpy_support
+    readers = {
+      ".vtk": vtk.vtkPolyDataReader,
+      ".vtp": vtk.vtkXMLPolyDataReader,
+      ".ply": vtk.vtkPLYReader,
+      ".stl": vtk.vtkSTLReader,
+      ".obj": vtk.vtkOBJReader,
+      }
+    reader = readers[extension]()
+    reader.SetFileName(fileName)
+    reader.Update()
+    polyData = reader.GetOutput()
+    points = numpy_support.vtk_to_numpy(polyData.GetPoints().GetData()).astype(np.float64)
+    connectivity, offsets = NeuroSegmentParcellationSurfaceGraph.getPolygonConnectivity(polyData)
+    return points, connectivity, offsets
+
+  import nibabel.freesurfer
+  points, triangles = nibabel.freesurfer.read_geometry(fileName)
+  connectivity = np.asarray(triangles, dtype=np.int64).ravel()
+  offsets = np.arange(0, len(connectivity)+1, 3, dtype=np.int64)
+  return np.asarray(points, dtype=np.float64), connectivity, offsets
+
+def loadScalars(fileName):
+  """
+  Load per-vertex scalars from a NumPy (.npy) file, or from a FreeSurfer morphometry file (ex. lh.curv, lh.sulc).
+  """
+  if fileName is None:
+    return None
+  if os.path.splitext(fileName)[1].lower() == ".npy":
+    return np.load(fileName)
+  import nibabel.freesurfer
+  return nibabel.freesurfer.read_morph_data(fileName)
+
+def loadCurvePoints(fileName):
+  """
+  Load the control points of a reference curve.
+  Supports Slicer markups files (.json), NumPy files (.npy) and comma separated coordinates (.csv, .txt).
+  :return: (N, 3) NumPy array
+  """
+  extension = os.path.splitext(fileName)[1].lower()
+  if extension == ".json":
+    with open(fileName) as markupsFile:
+      markups = json.load(markupsFile)
+    controlPoints = markups["markups"][0]["controlPoints"]
+    return np.array([controlPoint["position"] for controlPoint in controlPoints], dtype=np.float64)
+  if extension == ".npy":
+    return np.load(fileName).astype(np.float64).reshape(-1, 3)
+  return np.loadtxt(fileName, delimiter=",", ndmin=2).astype(np.float64).reshape(-1, 3)
+
+def getSurfaceKey(subject):
+  return (subject["surface"], subject.get("curv"), subject.get("sulc"))
+
+def getSurfaceGraph(subject):
+  """
+  Return the surface graph of the subject. The graph is only loaded once by each process.
+  """
+  key = getSurfaceKey(subject)
+  surfaceGraph = _surfaceGraphs.get(key)
+  if surfaceGraph is None:
+    points, connectivity, offsets = loadSurface(subject["surface"])
+    surfaceGraph = NeuroSegmentParcellationSurfaceGraph(points, connectivity, offsets,
+      loadScalars(subject.get("curv")), loadScalars(subject.get("sulc")))
+    _surfaceGraphs.clear()
+    _referencePathSolvers.clear()
+    _surfaceGraphs[key] = surfaceGraph
+  return surfaceGraph
+
+def getReferencePathSolver(subject):
+  """
+  Return the path solver used to compute the reference curves of the subject.
+  The solver is shared by all curves of the subject that are evaluated by the process. Curves of a parcellation
+  often share control points (ex. at the junctions of sulci), so the shortest path trees from these control points
+  are only computed once.
+  """
+  surfaceGraph = getSurfaceGraph(subject)
+  key = getSurfaceKey(subject)
+  pathSolver = _referencePathSolvers.get(key)
+  if pathSolver is None:
+    pathSolver = NeuroSegmentParcellationPathSolver(surfaceGraph)
+    _referencePathSolvers[key] = pathSolver
+  return pathSolver
+
+def evaluateCurve(subject, curveName, weightsList, referenceWeights=None, penalties=None,
+    numberOfISORegions=NUMBER_OF_ISO_REGIONS, searchMode=NeuroSegmentParcellationPathSolver.DIJKSTRA_SEARCH):
+  """
+  Evaluate all of the weights for one reference curve of a subject.
+  The reference curve is the path through its control points on the surface, computed using the reference weights.
+  The optimizer paths connect the first and last control points.
+  :param searchMode: Search mode used to compute the reference curve and the optimizer paths
+    (see NeuroSegmentParcellationPathSolver.SEARCH_MODES)
+  :return: Tuple of (subject name, curve name, list of metric dictionaries)
+  """
+  surfaceGraph = getSurfaceGraph(subject)
+  if referenceWeights is None:
+    referenceWeights = [1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+  if penalties is None:
+    penalties = [10.0, 10.0, 10.0, 10.0, 10.0, 10.0]
+
+  surfaceLocator = NeuroSegmentParcellationPointLocator(surfaceGraph.points)
+  controlPointIds, _ = surfaceLocator.findClosestPoints(loadCurvePoints(subject["curves"][curveName]))
+  referenceSolver = getReferencePathSolver(subject)
+  referenceSolver.setWeights(referenceWeights)
+  referenceSolver.setPenalties(penalties)
+  referenceSolver.setSearchMode(searchMode)
+  referencePointIds = referenceSolver.findCurvePath(controlPointIds)
+
+  inputCurveLocator = NeuroSegmentParcellationPointLocator(surfaceGraph.points[referencePointIds])
+  isoRegions = surfaceGraph.getRingIndices(referencePointIds, numberOfISORegions)
+  geodesicDistances = surfaceGraph.getGeodesicDistances(referencePointIds)
+  sweep = CurveComparisonSweep(surfaceGraph, controlPointIds[0], controlPointIds[-1], penalties,
+    inputCurveLocator, surfaceLocator, isoRegions, numberOfISORegions, geodesicDistances=geodesicDistances,
+    searchMode=searchMode)
+  metricsList = [sweep.evaluateWeights(weights) for weights in weightsList]
+  return subject["name"], curveName, metricsList
+
+class CurveComparisonBatch(object):
+  """
+  Headless curve weight optimization across a cohort of subjects.
+
+  The manifest is a JSON file with the following format:
+    {
+      "subjects": [
+        {
+          "name": "Subject1",
+          "surface": "Subject1/surf/lh.orig",
+          "curv": "Subject1/surf/lh.curv",
+          "sulc": "Subject1/surf/lh.sulc",
+          "curves": {"CentralSulcus": "Subject1/curves/CentralSulcus.mrk.json", ...},
+          "searchModes": {"CentralSulcus": "AStar", ...}
+        },
+        ...
+      ]
+    }
+  Relative paths are relative to the manifest file. Curves must be in the coordinate system of the surface.
+  The optional "searchModes" select the path search mode of each curve (see NeuroSegmentParcellationPathSolver.SEARCH_MODES).
+  Curves that are not listed use the search mode of the batch.
+
+  Each curve is evaluated by a worker process, and the metrics of all weights for a curve are appended to the
+  results CSV file as soon as the curve is completed. Curves that are already in the results file are skipped,
+  so an interrupted run can be resumed by running the batch again with the same results file.
+
+  Outside of Slicer, the batch is run as a module, with the CurveComparison and NeuroSegmentParcellation module
+  directories on the Python path:
+    PYTHONPATH=CurveComparison:NeuroSegmentParcellation python -m CurveComparisonLibs.CurveComparisonBatch manifest.json results.csv
+  """
+
+  SUBJECT_COLUMN_NAME = "subject"
+  CURVE_COLUMN_NAME = "curve"
+
+  def __init__(self, manifestFileName, resultsFileName, weightsList=None, numberOfISORegions=NUMBER_OF_ISO_REGIONS,
+      searchMode=NeuroSegmentParcellationPathSolver.DIJKSTRA_SEARCH):
+    """
+    :param manifestFileName: JSON file describing the subjects
+    :param resultsFileName: CSV file that the results of each curve are appended to
+    :param weightsList: Weights [d, c, h, dc, dh, ch, dch, p] to evaluate. Uses the 255 binary weights by default.
+    :param numberOfISORegions: Number of rings around the reference curves that are used to compute the ISO overlap
+    :param searchMode: Path search mode of the curves that do not have a search mode in the manifest
+    """
+    self.manifestFileName = manifestFileName
+    self.resultsFileName = resultsFileName
+    if weightsList is None:
+      weightsList = [[float(bit) for bit in np.binary_repr(i, 8)] for i in range(1, pow(2, 8))]
+    self.weightsList = [[float(weight) for weight in weights] for weights in weightsList]
+    self.numberOfISORegions = numberOfISORegions
+    self.searchMode = searchMode
+    self.subjects = self.readManifest(manifestFileName)
+
+  @staticmethod
+  def readManifest(manifestFileName):
+    """
+    Read the subjects from the manifest, converting relative paths to absolute paths.
+    """
+    with open(manifestFileName) as manifestFile:
+      manifest = json.load(manifestFile)
+    manifestDirectory = os.path.dirname(os.path.abspath(manifestFileName))
+
+    def getPath(fileName):
+      if fileName is None:
+        return None
+      return os.path.join(manifestDirectory, fileName)
+
+    subjects = []
+    for subject in manifest.get("subjects", []):
+      subject = dict(subject)
+      subject["surface"] = getPath(subject["surface"])
+      subject["curv"] = getPath(subject.get("curv"))
+      subject["sulc"] = getPath(subject.get("sulc"))
+      subject["curves"] = {curveName: getPath(fileName) for curveName, fileName in subject.get("curves", {}).items()}
+      subject["searchModes"] = dict(subject.get("searchModes", {}))
+      subjects.append(subject)
+    return subjects
+
+  def getColumnNames(self):
+    return ([self.SUBJECT_COLUMN_NAME, self.CURVE_COLUMN_NAME] + CurveComparisonResults.WEIGHT_NAMES +
+      CurveComparisonResults.METRIC_NAMES)
+
+  def readCompletedCurves(self):
+    """
+    Find the curves that have results for all weights in the results file.
+    The file is always rewritten with only the rows of the completed curves, so that rows of incomplete curves and
+    partially written rows (ex. if the previous run was interrupted while writing) are removed before new results
+    are appended.
+    :return: Set of (subject name, curve name)
+    """
+    if not os.path.exists(self.resultsFileName):
+      return set()
+
+    with open(self.resultsFileName, newline="") as resultsFile:
+      lines = resultsFile.read().splitlines(True)
+    if len(lines) > 0 and not lines[-1].endswith("\n"):
+      # The last row was only partially written
+      lines = lines[:-1]
+    rows = [row for row in csv.reader(lines) if len(row) == len(self.getColumnNames())]
+    if len(rows) == 0 or rows[0] != self.getColumnNames():
+      logging.warning("CurveComparisonBatch: Results file has unexpected columns. Starting from the beginning.")
+      os.remove(self.resultsFileName)
+      return set()
+
+    rowCounts = {}
+    for row in rows[1:]:
+      key = (row[0], row[1])
+      rowCounts[key] = rowCounts.get(key, 0) + 1
+    completedCurves = {key for key, count in rowCounts.items() if count == len(self.weightsList)}
+
+    with open(self.resultsFileName, "w", newline="") as resultsFile:
+      writer = csv.writer(resultsFile)
+      writer.writerow(rows[0])
+      writer.writerows([row for row in rows[1:] if (row[0], row[1]) in completedCurves])
+      resultsFile.flush()
+      os.fsync(resultsFile.fileno())
+    return completedCurves
+
+  def writeCurveResults(self, subjectName, curveName, metricsList):
+    """
+    Append the metrics of all weights of a curve to the results file.
+    """
+    writeHeader = not os.path.exists(self.resultsFileName)
+    with open(self.resultsFileName, "a", newline="") as resultsFile:
+      writer = csv.writer(resultsFile)
+      if writeHeader:
+        writer.writerow(self.getColumnNames())
+      for weights, metrics in zip(self.weightsList, metricsList):
+        writer.writerow([subjectName, curveName] + weights +
+          [metrics[metricName] for metricName in CurveComparisonResults.METRIC_NAMES])
+      resultsFile.flush()
+      os.fsync(resultsFile.fileno())
+
+  def run(self, numberOfWorkers=None, useProcesses=True):
+    """
+    Evaluate all curves that are not already in the results file.
+    :param numberOfWorkers: Number of worker processes. Uses the number of CPUs by default.
+    :param useProcesses: Use worker processes instead of threads.
+    :return: Cohort summary (see getSummary)
+    """
+    completedCurves = self.readCompletedCurves()
+    tasks = []
+    for subject in self.subjects:
+      for curveName in subject["curves"].keys():
+        if (subject["name"], curveName) not in completedCurves:
+          tasks.append((subject, curveName))
+    logging.info("CurveComparisonBatch: %d curves completed, %d curves remaining", len(completedCurves), len(tasks))
+
+    if len(tasks) > 0:
+      if numberOfWorkers is None:
+        numberOfWorkers = os.cpu_count() or 1
+      numberOfWorkers = max(1, min(numberOfWorkers, len(tasks)))
+      if useProcesses:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=numberOfWorkers)
+      else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=numberOfWorkers)
+
+      with executor:
+        futures = [executor.submit(evaluateCurve, subject, curveName, self.weightsList,
+          subject.get("referenceWeights"), subject.get("penalties"), self.numberOfISORegions,
+          subject["searchModes"].get(curveName, self.searchMode))
+          for subject, curveName in tasks]
+        for future in concurrent.futures.as_completed(futures):
+          try:
+            subjectName, curveName, metricsList = future.result()
+          except Exception as e:
+            logging.error("CurveComparisonBatch: Could not evaluate curve: " + str(e))
+            continue
+          self.writeCurveResults(subjectName, curveName, metricsList)
+          logging.info("CurveComparisonBatch: Completed %s %s", subjectName, curveName)
+
+    return self.getSummary()
+
+  def getSummary(self, metricWeights=None):
+    """
+    Average the metrics of each weight vector over all completed curves.
+    :param metricWeights: Optional dictionary containing the importance of each metric in the ranking score
+    :return: Dictionary containing the number of curves, the mean metrics of each weight vector
+      (CurveComparisonResults), the best weights for each metric, and the best ranked weights.
+    """
+    summary = {
+      "numberOfCurves": 0,
+      "results": CurveComparisonResults(),
+      "bestWeights": {},
+      "bestRankedWeights": None,
+      }
+    if not os.path.exists(self.resultsFileName):
+      return summary
+
+    with open(self.resultsFileName, newline="") as resultsFile:
+      rows = [row for row in csv.reader(resultsFile) if len(row) == len(self.getColumnNames())][1:]
+    if len(rows) == 0:
+      return summary
+
+    values = np.array([row[2:] for row in rows], dtype=np.float64)
+    numberOfWeights = len(CurveComparisonResults.WEIGHT_NAMES)
+    uniqueWeights, inverse = np.unique(values[:, :numberOfWeights], axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    counts = np.bincount(inverse, minlength=len(uniqueWeights))
+    meanMetrics = {}
+    for i, metricName in enumerate(CurveComparisonResults.METRIC_NAMES):
+      meanMetrics[metricName] = np.bincount(inverse, weights=values[:, numberOfWeights+i],
+        minlength=len(uniqueWeights)) / counts
+    results = CurveComparisonResults(uniqueWeights, meanMetrics)
+
+    summary["numberOfCurves"] = len(set((row[0], row[1]) for row in rows))
+    summary["results"] = results
+    for metricName, minimize in zip(results.METRIC_NAMES, results.METRIC_MINIMIZE):
+      summary["bestWeights"][metricName] = results.getBestWeights(metricName, minimize)
+    ranks = results.getRanks(metricWeights)
+    summary["bestRankedWeights"] = uniqueWeights[np.argmin(ranks)].tolist()
+    return summary
+
+if __name__ == "__main__":
+  import argparse
+
+  parser = argparse.ArgumentParser(description="Evaluate curve weights for all reference curves of a cohort.")
+  parser.add_argument("manifest", help="JSON manifest of the subjects")
+  parser.add_argument("results", help="CSV file that the results are appended to")
+  parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+  parser.add_argument("--iso-regions", type=int, default=NUMBER_OF_ISO_REGIONS, help="Number of ISO regions")
+  parser.add_argument("--search-mode", choices=NeuroSegmentParcellationPathSolver.SEARCH_MODES,
+    default=NeuroSegmentParcellationPathSolver.DIJKSTRA_SEARCH, help="Path search mode of the curves that do not have one in the manifest")
+  args = parser.parse_args()
+  logging.basicConfig(level=logging.INFO)
+
+  batch = CurveComparisonBatch(args.manifest, args.results, numberOfISORegions=args.iso_regions, searchMode=args.search_mode)
+  summary = batch.run(args.workers)
+  print("Number of curves: %d" % summary["numberOfCurves"])
+  for metricName, (weights, value) in summary["bestWeights"].items():
+    print("Best mean %s: %s (%s)" % (metricName, str(value), str(weights)))
+  print("Best ranked weights: " + str(summary["bestRankedWeights"]))
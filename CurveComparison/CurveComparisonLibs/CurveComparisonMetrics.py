@@ -0,0 +1,142 @@
+import numpy as np
+
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationPointLocator import NeuroSegmentParcellationPointLocator
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationTransforms import arrayFromPoints
+
+NUMBER_OF_ISO_REGIONS = 6
+# Maximum distance (mm) between an optimizer curve point and the reference curve for the point to be counted as overlapping
+OVERLAP_TOLERANCE = 0.5
+# Maximum number of points of each polyline used to compute the Frechet distance
+MAXIMUM_FRECHET_DISTANCE_POINTS = 200
+
+def computeISOOverlap(isoRegionValues, numberOfPoints, numberOfISORegions=NUMBER_OF_ISO_REGIONS):
+  """
+  Compute the ISO overlap score from the ISO region of each curve point.
+  Points outside of the overlay (region < 0) are ignored, and points on the curve (region 0) are counted as region 1.
+  :param isoRegionValues: ISO region of the closest surface point to each curve point
+  :param numberOfPoints: Number of points in the curve
+  :param numberOfISORegions: Number of rings in the ISO region overlay
+  """
+  isoRegionValues = np.asarray(isoRegionValues, dtype=np.int64)
+  isoRegionValues = isoRegionValues[isoRegionValues >= 0]
+  isoRegionValues = np.maximum(isoRegionValues, 1)
+  isoRegionSum = np.bincount(isoRegionValues, minlength=numberOfISORegions+1)[1:numberOfISORegions+1]
+
+  isoRegions = np.arange(1, numberOfISORegions+1)
+  fr = isoRegionSum / numberOfPoints
+  penalty = 1/numberOfISORegions
+  subtotals = (1 - (fr * (1 + (penalty * (isoRegions - 1)))))
+  return float(np.sum(subtotals) / numberOfISORegions)
+
+def resamplePolyline(points, numberOfPoints):
+  """
+  Resample a polyline to points that are evenly spaced along its length.
+  :param points: (N, 3) NumPy array
+  :param numberOfPoints: Number of points in the resampled polyline. Polylines with fewer points are not resampled.
+  :return: (min(N, numberOfPoints), 3) NumPy array
+  """
+  if len(points) <= numberOfPoints:
+    return points
+  segmentLengths = np.sqrt(np.sum((points[1:] - points[:-1])**2, axis=1))
+  lengths = np.concatenate([[0.0], np.cumsum(segmentLengths)])
+  if lengths[-1] == 0.0:
+    return points[:numberOfPoints]
+  sampleLengths = np.linspace(0.0, lengths[-1], numberOfPoints)
+  return np.stack([np.interp(sampleLengths, lengths, points[:, axis]) for axis in range(3)], axis=1)
+
+def computeFrechetDistance(pointsA, pointsB, maximumNumberOfPoints=MAXIMUM_FRECHET_DISTANCE_POINTS):
+  """
+  Compute the discrete Frechet distance between two polylines.
+  The coupling table is filled one anti-diagonal at a time, so only two diagonals are kept in memory.
+  The time is proportional to the product of the number of points, so polylines with more than maximumNumberOfPoints
+  points are resampled first. The result then approximates the Frechet distance within the resampled point spacing.
+  The metric is not part of computeCurveMetrics, since it is too slow to be computed for every weight of a sweep.
+  :param pointsA: (N, 3) NumPy array
+  :param pointsB: (M, 3) NumPy array
+  :param maximumNumberOfPoints: Maximum number of points of each polyline, or None to use all of the points
+  """
+  pointsA = np.asarray(pointsA, dtype=np.float64).reshape(-1, 3)
+  pointsB = np.asarray(pointsB, dtype=np.float64).reshape(-1, 3)
+  if maximumNumberOfPoints is not None:
+    pointsA = resamplePolyline(pointsA, maximumNumberOfPoints)
+    pointsB = resamplePolyline(pointsB, maximumNumberOfPoints)
+  numberOfPointsA = len(pointsA)
+  numberOfPointsB = len(pointsB)
+  if numberOfPointsA == 0 or numberOfPointsB == 0:
+    return 0.0
+
+  # Coupling distance of each point in A on the previous two anti-diagonals (i + j == k - 1 and k - 2)
+  previousDiagonal = np.full(numberOfPointsA, np.inf)
+  secondPreviousDiagonal = np.full(numberOfPointsA, np.inf)
+  for k in range(numberOfPointsA + numberOfPointsB - 1):
+    i = np.arange(max(0, k - numberOfPointsB + 1), min(k, numberOfPointsA - 1) + 1)
+    j = k - i
+    distances = np.sqrt(np.sum((pointsA[i] - pointsB[j])**2, axis=1))
+    diagonal = np.full(numberOfPointsA, np.inf)
+    if k == 0:
+      diagonal[0] = distances[0]
+    else:
+      iPrevious = np.maximum(i - 1, 0)
+      previousA = np.where(i > 0, previousDiagonal[iPrevious], np.inf)
+      previousB = np.where(j > 0, previousDiagonal[i], np.inf)
+      previousAB = np.where((i > 0) & (j > 0), secondPreviousDiagonal[iPrevious], np.inf)
+      diagonal[i] = np.maximum(distances, np.minimum(np.minimum(previousA, previousB), previousAB))
+    secondPreviousDiagonal = previousDiagonal
+    previousDiagonal = diagonal
+  return float(previousDiagonal[numberOfPointsA - 1])
+
+def computeCurveMetrics(optimizerPoints, inputCurveLocator, surfaceLocator=None, isoRegions=None,
+    numberOfISORegions=NUMBER_OF_ISO_REGIONS, optimizerPointIds=None, geodesicDistances=None,
+    overlapTolerance=OVERLAP_TOLERANCE):
+  """
+  Compute the similarity metrics between an optimizer curve and the reference curve.
+  :param optimizerPoints: (N, 3) NumPy array of the optimizer curve points in world coordinates
+  :param inputCurveLocator: NeuroSegmentParcellationPointLocator built from the reference curve points
+  :param surfaceLocator: NeuroSegmentParcellationPointLocator built from the world space surface points
+  :param isoRegions: NumPy array containing the ISO region of each surface point
+  :param numberOfISORegions: Number of rings in the ISO region overlay
+  :param optimizerPointIds: Surface point id of each optimizer curve point. Found using surfaceLocator if not specified.
+  :param geodesicDistances: NumPy array containing the distance along the surface from each surface point to the reference curve
+  :param overlapTolerance: Maximum distance from the reference curve for a point to be counted by "toleranceOverlap"
+  :return: Dictionary containing "averageDistance", "maxDistance", "overlapPercent", "isoOverlap", "hausdorffDistance",
+    "meanSymmetricDistance", "toleranceOverlap" and "geodesicDeviation"
+  """
+  metrics = {
+    "averageDistance": 0.0,
+    "maxDistance": 0.0,
+    "overlapPercent": 0.0,
+    "isoOverlap": 1.0,
+    "hausdorffDistance": 0.0,
+    "meanSymmetricDistance": 0.0,
+    "toleranceOverlap": 0.0,
+    "geodesicDeviation": 0.0,
+    }
+
+  optimizerPoints = np.asarray(optimizerPoints, dtype=np.float64).reshape(-1, 3)
+  numberOfPoints = len(optimizerPoints)
+  if numberOfPoints == 0:
+    return metrics
+
+  _, distances2 = inputCurveLocator.findClosestPoints(optimizerPoints)
+  metrics["averageDistance"] = float(np.sqrt(np.mean(distances2)))
+  metrics["maxDistance"] = float(np.sqrt(np.max(distances2)))
+  metrics["overlapPercent"] = float(np.count_nonzero(distances2 == 0.0) / numberOfPoints)
+  metrics["toleranceOverlap"] = float(np.count_nonzero(distances2 <= overlapTolerance**2) / numberOfPoints)
+
+  # Distance from each reference curve point to the optimizer curve
+  inputCurvePoints = inputCurveLocator.points
+  _, reverseDistances2 = NeuroSegmentParcellationPointLocator(optimizerPoints).findClosestPoints(inputCurvePoints)
+  distances = np.sqrt(distances2)
+  reverseDistances = np.sqrt(reverseDistances2)
+  metrics["hausdorffDistance"] = float(max(np.max(distances), np.max(reverseDistances, initial=0.0)))
+  metrics["meanSymmetricDistance"] = float((np.sum(distances) + np.sum(reverseDistances)) / (len(distances) + len(reverseDistances)))
+
+  if optimizerPointIds is None and surfaceLocator is not None and (isoRegions is not None or geodesicDistances is not None):
+    optimizerPointIds, _ = surfaceLocator.findClosestPoints(optimizerPoints)
+
+  if optimizerPointIds is not None and isoRegions is not None:
+    metrics["isoOverlap"] = computeISOOverlap(isoRegions[optimizerPointIds], numberOfPoints, numberOfISORegions)
+
+  if optimizerPointIds is not None and geodesicDistances is not None:
+    metrics["geodesicDeviation"] = float(np.mean(geodesicDistances[optimizerPointIds]))
+  return metrics
@@ -0,0 +1,213 @@
+import os
+import vtk
+import numpy as np
+from vtk.util import numpy_support
+
+class CurveComparisonResults(object):
+  """
+  Numeric results of a curve optimization: one row for each evaluated weight vector [d, c, h, dc, dh, ch, dch, p],
+  with the metrics computed by computeCurveMetrics.
+  Rows are appended during the optimization, and converted to typed columns when the results are queried or exported.
+  """
+
+  WEIGHT_NAMES = ["d", "c", "h", "dc", "dh", "ch", "dch", "p"]
+  METRIC_NAMES = ["averageDistance", "maxDistance", "overlapPercent", "isoOverlap", "hausdorffDistance",
+    "meanSymmetricDistance", "toleranceOverlap", "geodesicDeviation"]
+  # Whether a lower value is better, for each metric in METRIC_NAMES
+  METRIC_MINIMIZE = [True, True, False, False, True, True, False, True]
+
+  # Number of rows that are compared against all other rows at once when computing the Pareto front
+  PARETO_BLOCK_SIZE = 1024
+
+  def __init__(self, weights=None, metrics=None):
+    """
+    :param weights: Optional (N, 8) array of weights
+    :param metrics: Optional dictionary containing an (N,) array for each metric name
+    """
+    self.weightRows = []
+    self.metricRows = []
+    self.weightsArray = np.zeros((0, len(self.WEIGHT_NAMES)))
+    self.metricsArray = np.zeros((0, len(self.METRIC_NAMES)))
+    if weights is not None:
+      self.weightsArray = np.asarray(weights, dtype=np.float64).reshape(-1, len(self.WEIGHT_NAMES))
+      self.metricsArray = np.zeros((len(self.weightsArray), len(self.METRIC_NAMES)))
+      for i, metricName in enumerate(self.METRIC_NAMES):
+        if metrics is not None and metricName in metrics:
+          self.metricsArray[:, i] = metrics[metricName]
+
+  def __len__(self):
+    return len(self.weightsArray) + len(self.weightRows)
+
+  def addResult(self, weights, metrics):
+    """
+    Append the metrics computed for a weight vector.
+    """
+    self.weightRows.append([float(weight) for weight in weights])
+    self.metricRows.append([float(metrics[metricName]) for metricName in self.METRIC_NAMES])
+
+  def update(self):
+    """
+    Move the appended rows to the result arrays.
+    """
+    if len(self.weightRows) == 0:
+      return
+    self.weightsArray = np.concatenate([self.weightsArray, np.array(self.weightRows, dtype=np.float64)])
+    self.metricsArray = np.concatenate([self.metricsArray, np.array(self.metricRows, dtype=np.float64)])
+    self.weightRows = []
+    self.metricRows = []
+
+  def getWeights(self):
+    """
+    :return: (N, 8) array of the evaluated weights
+    """
+    self.update()
+    return self.weightsArray
+
+  def getMetric(self, metricName):
+    """
+    :return: (N,) array of the specified metric for each row
+    """
+    self.update()
+    return self.metricsArray[:, self.METRIC_NAMES.index(metricName)]
+
+  def getBestIndex(self, metricName, minimize=True):
+    """
+    :return: Index of the row with the lowest (or highest) value of the metric, or -1 if there are no valid rows
+    """
+    values = self.getMetric(metricName)
+    if len(values) == 0 or np.all(np.isnan(values)):
+      return -1
+    return int(np.nanargmin(values) if minimize else np.nanargmax(values))
+
+  def getBestWeights(self, metricName, minimize=True):
+    """
+    :return: Tuple of the weights with the lowest (or highest) value of the metric, and the value.
+      (None, None) if there are no results.
+    """
+    index = self.getBestIndex(metricName, minimize)
+    if index < 0:
+      return None, None
+    return self.getWeights()[index].tolist(), float(self.getMetric(metricName)[index])
+
+  def getObjectiveArray(self, metricNames=None):
+    """
+    :param metricNames: Metrics that are included. All metrics by default.
+    :return: (N, M) array of the metric values, negated for metrics that are maximized, so that lower is always better
+    """
+    if metricNames is None:
+      metricNames = self.METRIC_NAMES
+    self.update()
+    columns = [self.METRIC_NAMES.index(metricName) for metricName in metricNames]
+    signs = np.array([1.0 if self.METRIC_MINIMIZE[column] else -1.0 for column in columns])
+    return self.metricsArray[:, columns] * signs
+
+  def getParetoMask(self, metricNames=None):
+    """
+    Find the non-dominated rows. A row is dominated if another row is at least as good for every metric,
+    and better for at least one metric.
+    :param metricNames: Metrics that are compared. All metrics by default.
+    :return: (N,) boolean array that is True for the rows on the Pareto front
+    """
+    objectives = self.getObjectiveArray(metricNames)
+    numberOfRows = len(objectives)
+    dominated = np.zeros(numberOfRows, dtype=bool)
+    for start in range(0, numberOfRows, self.PARETO_BLOCK_SIZE):
+      block = objectives[start:start+self.PARETO_BLOCK_SIZE, np.newaxis, :]
+      notWorse = np.all(objectives[np.newaxis, :, :] <= block, axis=2)
+      better = np.any(objectives[np.newaxis, :, :] < block, axis=2)
+      dominated[start:start+self.PARETO_BLOCK_SIZE] = np.any(notWorse & better, axis=1)
+    return ~dominated
+
+  def getRankingScores(self, metricWeights=None):
+    """
+    Compute a weighted score for each row. Each metric is normalized to [0, 1] over all rows, with 0 being the best value.
+    :param metricWeights: Dictionary containing the importance of each metric. All metrics are weighted equally by default.
+    :return: (N,) array of scores. Lower is better.
+    """
+    objectives = self.getObjectiveArray()
+    if len(objectives) == 0:
+      return np.zeros(0)
+    if metricWeights is None:
+      metricWeights = {}
+    importance = np.array([float(metricWeights.get(metricName, 1.0)) for metricName in self.METRIC_NAMES])
+
+    minimum = np.min(objectives, axis=0)
+    valueRange = np.max(objectives, axis=0) - minimum
+    valueRange[valueRange == 0.0] = 1.0
+    normalizedObjectives = (objectives - minimum) / valueRange
+    importanceSum = np.sum(importance)
+    if importanceSum <= 0.0:
+      importanceSum = 1.0
+    return np.dot(normalizedObjectives, importance) / importanceSum
+
+  def getRanks(self, metricWeights=None):
+    """
+    :return: (N,) array containing the rank of each row by ranking score, starting from 1 for the best row
+    """
+    scores = self.getRankingScores(metricWeights)
+    ranks = np.empty(len(scores), dtype=np.int64)
+    ranks[np.argsort(scores, kind="stable")] = np.arange(1, len(scores)+1)
+    return ranks
+
+  def toTable(self, weightColumnNames, metricColumnNames):
+    """
+    Create a vtkTable with one numeric column for each weight and metric.
+    :param weightColumnNames: Names of the weight columns, in the same order as WEIGHT_NAMES
+    :param metricColumnNames: Names of the metric columns, in the same order as METRIC_NAMES
+    """
+    self.update()
+    table = vtk.vtkTable()
+    columns = list(zip(weightColumnNames, self.weightsArray.T)) + list(zip(metricColumnNames, self.metricsArray.T))
+    for columnName, values in columns:
+      array = numpy_support.numpy_to_vtk(np.ascontiguousarray(values), deep=True, array_type=vtk.VTK_DOUBLE)
+      array.SetName(columnName)
+      table.AddColumn(array)
+    return table
+
+  @classmethod
+  def fromTable(cls, table, weightColumnNames, metricColumnNames):
+    """
+    Read the results from a vtkTable created by toTable.
+    :return: CurveComparisonResults, or None if the table does not contain the columns
+    """
+    if table is None:
+      return None
+    columns = []
+    for columnName in list(weightColumnNames) + list(metricColumnNames):
+      array = table.GetColumnByName(columnName)
+      if array is None or not array.IsA("vtkDataArray"):
+        return None
+      columns.append(numpy_support.vtk_to_numpy(array).astype(np.float64))
+
+    numberOfWeights = len(cls.WEIGHT_NAMES)
+    weights = np.stack(columns[:numberOfWeights], axis=1)
+    metrics = dict(zip(cls.METRIC_NAMES, columns[numberOfWeights:]))
+    return cls(weights, metrics)
+
+  def save(self, fileName):
+    """
+    Save the results to a compressed NumPy (.npz) or CSV (.csv) file, depending on the file extension.
+    """
+    self.update()
+    if os.path.splitext(fileName)[1].lower() == ".csv":
+      header = ",".join(self.WEIGHT_NAMES + self.METRIC_NAMES)
+      np.savetxt(fileName, np.concatenate([self.weightsArray, self.metricsArray], axis=1), delimiter=",",
+        fmt="%.10g", header=header, comments="")
+    else:
+      np.savez_compressed(fileName, weights=self.weightsArray,
+        **{metricName: self.metricsArray[:, i] for i, metricName in enumerate(self.METRIC_NAMES)})
+
+  @classmethod
+  def load(cls, fileName):
+    """
+    Load results saved using save.
+    """
+    if os.path.splitext(fileName)[1].lower() == ".csv":
+      values = np.loadtxt(fileName, delimiter=",", skiprows=1, ndmin=2)
+      numberOfWeights = len(cls.WEIGHT_NAMES)
+      metrics = {metricName: values[:, numberOfWeights+i] for i, metricName in enumerate(cls.METRIC_NAMES)}
+      return cls(values[:, :numberOfWeights], metrics)
+
+    with np.load(fileName) as data:
+      metrics = {metricName: data[metricName] for metricName in cls.METRIC_NAMES if metricName in data}
+      return cls(data["weights"], metrics)
@@ -0,0 +1,104 @@
+import queue
+import logging
+import threading
+
+from CurveComparisonLibs.CurveComparisonResults import CurveComparisonResults
+from CurveComparisonLibs.CurveComparisonSearch import CurveComparisonSearch
+
+class CurveComparisonRunner(object):
+  """
+  Run the weight evaluation of a CurveComparisonSweep on a background thread.
+  Each result is queued as soon as it is completed. The main thread should periodically call getNewResults to
+  apply the results (ex. add them to the output table), since the scene must not be modified from the background thread.
+  Cancelling stops the evaluation after the evaluations that are already running, and keeps all completed results.
+  """
+
+  def __init__(self, sweep, numberOfWorkers=None, useProcesses=False):
+    """
+    :param sweep: CurveComparisonSweep used to evaluate the weights
+    :param numberOfWorkers: Number of worker threads or processes used by the sweep
+    :param useProcesses: Use worker processes instead of threads
+    """
+    self.sweep = sweep
+    self.numberOfWorkers = numberOfWorkers
+    self.useProcesses = useProcesses
+    self.results = CurveComparisonResults()
+    self.resultQueue = queue.Queue()
+    self.cancelEvent = threading.Event()
+    self.thread = None
+    self.search = None
+    self.numberOfEvaluations = 0
+    self.numberOfCompletedEvaluations = 0
+    self.errorMessage = None
+
+  def evaluateBatch(self, weightsList):
+    """
+    Evaluate the weights, queueing each result as it is completed.
+    :return: List of metrics for each weight vector, or None for weights that were not evaluated
+    """
+    if self.cancelEvent.is_set():
+      return [None] * len(weightsList)
+
+    def onResult(index, metrics):
+      self.resultQueue.put((weightsList[index], metrics))
+
+    return self.sweep.run(weightsList, self.numberOfWorkers, self.useProcesses, onResult, self.cancelEvent)
+
+  def startExhaustive(self, weightsList):
+    """
+    Start evaluating all of the weights on a background thread.
+    """
+    self.numberOfEvaluations = len(weightsList)
+    self.start(lambda: self.evaluateBatch(weightsList))
+
+  def startAdaptive(self, numberOfEvaluations, objectiveName, minimizeObjective=True):
+    """
+    Start an adaptive search (see CurveComparisonSearch) on a background thread.
+    """
+    self.numberOfEvaluations = numberOfEvaluations
+    self.search = CurveComparisonSearch(self.evaluateBatch, objectiveName, minimizeObjective)
+    self.start(lambda: self.search.run(numberOfEvaluations))
+
+  def start(self, runFunction):
+    def run():
+      try:
+        runFunction()
+      except Exception as e:
+        # The error is shown by the widget when the runner is finished (see errorMessage)
+        self.errorMessage = str(e)
+        logging.exception("CurveComparisonRunner: Evaluation failed: " + str(e))
+
+    self.thread = threading.Thread(target=run)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def cancel(self):
+    self.cancelEvent.set()
+    if self.search is not None:
+      self.search.stop()
+
+  def isCancelled(self):
+    return self.cancelEvent.is_set()
+
+  def isRunning(self):
+    return self.thread is not None and self.thread.is_alive()
+
+  def wait(self):
+    if self.thread is not None:
+      self.thread.join()
+
+  def getNewResults(self):
+    """
+    Return the results that were completed since the last call. Should be called from the main thread.
+    :return: List of (weights, metrics)
+    """
+    newResults = []
+    while True:
+      try:
+        weights, metrics = self.resultQueue.get_nowait()
+      except queue.Empty:
+        break
+      self.results.addResult(weights, metrics)
+      newResults.append((weights, metrics))
+    self.numberOfCompletedEvaluations += len(newResults)
+    return newResults
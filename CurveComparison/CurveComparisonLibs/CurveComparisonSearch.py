@@ -0,0 +1,115 @@
+import logging
+
+class CurveComparisonSearch(object):
+  """
+  Adaptive search for the curve weights [d, c, h, dc, dh, ch, dch, p] within the continuous range [0, 1].
+
+  Uses coordinate descent with successive step halving: each coordinate is moved up and down by the current step size,
+  and the step is halved whenever no move improves the objective. The candidates for a coordinate are evaluated as
+  a single batch so that they can be computed in parallel.
+  """
+
+  NUMBER_OF_WEIGHTS = 8
+
+  def __init__(self, evaluateBatchFunction, objectiveName, minimizeObjective=True):
+    """
+    :param evaluateBatchFunction: Function that takes a list of weight vectors and returns a list of metric dictionaries
+    :param objectiveName: Key of the metric that is optimized (ex. "averageDistance", "isoOverlap")
+    :param minimizeObjective: If True, the objective is minimized. Otherwise it is maximized.
+    """
+    self.evaluateBatchFunction = evaluateBatchFunction
+    self.objectiveName = objectiveName
+    self.minimizeObjective = minimizeObjective
+    self.initialStepSize = 0.5
+    self.minimumStepSize = 1.0/64.0
+    self.evaluatedWeights = {}
+    self.stopped = False
+
+  def stop(self):
+    """
+    Stop the search after the current batch of evaluations.
+    """
+    self.stopped = True
+
+  def isBetter(self, metrics, bestMetrics):
+    if bestMetrics is None:
+      return True
+    if self.minimizeObjective:
+      return metrics[self.objectiveName] < bestMetrics[self.objectiveName]
+    return metrics[self.objectiveName] > bestMetrics[self.objectiveName]
+
+  def getWeightsKey(self, weights):
+    return tuple(round(weight, 6) for weight in weights)
+
+  def evaluate(self, weightsList, numberOfEvaluations):
+    """
+    Evaluate the weights that have not been evaluated yet, up to the remaining evaluation budget.
+    :return: List of (weights, metrics) for all of the weights that were evaluated, or previously evaluated.
+    """
+    newWeights = []
+    for weights in weightsList:
+      key = self.getWeightsKey(weights)
+      if key in self.evaluatedWeights or sum(weights) == 0.0:
+        continue
+      if any(self.getWeightsKey(other) == key for other in newWeights):
+        continue
+      newWeights.append(weights)
+    newWeights = newWeights[:max(0, numberOfEvaluations - len(self.evaluatedWeights))]
+
+    if len(newWeights) > 0:
+      metricsList = self.evaluateBatchFunction(newWeights)
+      for weights, metrics in zip(newWeights, metricsList):
+        if metrics is None:
+          # Evaluation was cancelled
+          continue
+        self.evaluatedWeights[self.getWeightsKey(weights)] = (weights, metrics)
+
+    results = []
+    for weights in weightsList:
+      key = self.getWeightsKey(weights)
+      if key in self.evaluatedWeights:
+        results.append(self.evaluatedWeights[key])
+    return results
+
+  def run(self, numberOfEvaluations, initialWeights=None):
+    """
+    Run the search until the evaluation budget is used, or until the minimum step size is reached.
+    :param numberOfEvaluations: Maximum number of weight vectors that are evaluated
+    :param initialWeights: Starting weights. Distance only by default.
+    :return: Tuple of the best weights and their metrics
+    """
+    if initialWeights is None:
+      initialWeights = [1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    currentWeights = [float(weight) for weight in initialWeights]
+
+    results = self.evaluate([currentWeights], numberOfEvaluations)
+    if len(results) == 0:
+      return None, None
+    currentWeights, currentMetrics = results[0]
+
+    stepSize = self.initialStepSize
+    while len(self.evaluatedWeights) < numberOfEvaluations and stepSize >= self.minimumStepSize and not self.stopped:
+      improved = False
+      for coordinate in range(self.NUMBER_OF_WEIGHTS):
+        candidates = []
+        for step in [stepSize, -stepSize]:
+          candidate = currentWeights[:]
+          candidate[coordinate] = min(1.0, max(0.0, candidate[coordinate] + step))
+          if candidate[coordinate] != currentWeights[coordinate]:
+            candidates.append(candidate)
+
+        for weights, metrics in self.evaluate(candidates, numberOfEvaluations):
+          if self.isBetter(metrics, currentMetrics):
+            currentWeights = weights
+            currentMetrics = metrics
+            improved = True
+
+        if len(self.evaluatedWeights) >= numberOfEvaluations or self.stopped:
+          break
+
+      if not improved:
+        stepSize /= 2.0
+
+    logging.debug("CurveComparisonSearch: Evaluated %d weights, best %s: %s", len(self.evaluatedWeights),
+      self.objectiveName, str(currentMetrics[self.objectiveName]))
+    return currentWeights, currentMetrics
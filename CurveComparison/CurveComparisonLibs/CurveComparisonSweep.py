@@ -0,0 +1,150 @@
+import os
+import logging
+import threading
+import concurrent.futures
+
+from CurveComparisonLibs.CurveComparisonMetrics import NUMBER_OF_ISO_REGIONS, computeCurveMetrics
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationPathSolver import NeuroSegmentParcellationPathSolver
+
+# Sweep used by the worker processes. Set once per process by initializeWorkerProcess.
+_workerProcessSweep = None
+
+def initializeWorkerProcess(sweep):
+  global _workerProcessSweep
+  _workerProcessSweep = sweep
+
+def evaluateWeightsInWorkerProcess(weights):
+  return _workerProcessSweep.evaluateWeights(weights)
+
+class CurveComparisonSweep(object):
+  """
+  Evaluate many weight vectors for a single reference curve using a pool of workers.
+  All workers share a read-only surface graph. Each worker creates its own path solver the first time it is used.
+  """
+
+  def __init__(self, surfaceGraph, startPointId, endPointId, penalties, inputCurveLocator, surfaceLocator=None, isoRegions=None,
+      numberOfISORegions=NUMBER_OF_ISO_REGIONS, costFunctionType=NeuroSegmentParcellationPathSolver.DISTANCE_COST_FUNCTION,
+      distanceWeightingFunction="", geodesicDistances=None, searchMode=NeuroSegmentParcellationPathSolver.DIJKSTRA_SEARCH):
+    """
+    :param surfaceGraph: NeuroSegmentParcellationSurfaceGraph in world coordinates
+    :param startPointId: Surface vertex id of the first control point of the reference curve
+    :param endPointId: Surface vertex id of the last control point of the reference curve
+    :param penalties: Penalties [c, h, dc, dh, ch, dch]
+    :param inputCurveLocator: NeuroSegmentParcellationPointLocator built from the reference curve points
+    :param surfaceLocator: NeuroSegmentParcellationPointLocator built from the world space surface points
+    :param isoRegions: NumPy array containing the ISO region of each surface point
+    :param numberOfISORegions: Number of rings in the ISO region overlay
+    :param costFunctionType: Cost function type used by the path solvers (see NeuroSegmentParcellationPathSolver)
+    :param distanceWeightingFunction: Distance weighting function used by the inverse squared cost function
+    :param geodesicDistances: NumPy array containing the distance along the surface from each surface point to the reference curve
+    :param searchMode: Search mode used by the path solvers (see NeuroSegmentParcellationPathSolver.SEARCH_MODES)
+    """
+    self.surfaceGraph = surfaceGraph
+    self.startPointId = startPointId
+    self.endPointId = endPointId
+    self.penalties = penalties
+    self.inputCurveLocator = inputCurveLocator
+    self.surfaceLocator = surfaceLocator
+    self.isoRegions = isoRegions
+    self.numberOfISORegions = numberOfISORegions
+    self.costFunctionType = costFunctionType
+    self.distanceWeightingFunction = distanceWeightingFunction
+    self.geodesicDistances = geodesicDistances
+    self.searchMode = searchMode
+    self.workerState = threading.local()
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    del state["workerState"]
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.workerState = threading.local()
+
+  def getPathSolver(self):
+    pathSolver = getattr(self.workerState, "pathSolver", None)
+    if pathSolver is None:
+      pathSolver = NeuroSegmentParcellationPathSolver(self.surfaceGraph)
+      # Each weight vector of the sweep is only evaluated once, so the shortest path trees would never be reused
+      pathSolver.setMaximumNumberOfPathTrees(0)
+      pathSolver.setCostFunctionType(self.costFunctionType)
+      pathSolver.setDistanceWeightingFunction(self.distanceWeightingFunction)
+      pathSolver.setSearchMode(self.searchMode)
+      self.workerState.pathSolver = pathSolver
+    return pathSolver
+
+  def findPath(self, weights):
+    """
+    :return: NumPy array of the surface vertex ids along the path for the specified weights
+    """
+    return self.getPathSolver().findPath(self.startPointId, self.endPointId, weights, self.penalties)
+
+  def evaluateWeights(self, weights):
+    """
+    Compute the path for the specified weights and compare it to the reference curve.
+    :return: Dictionary of metrics (see computeCurveMetrics)
+    """
+    pathPointIds = self.findPath(weights)
+    pathPoints = self.surfaceGraph.points[pathPointIds]
+    return computeCurveMetrics(pathPoints, self.inputCurveLocator, self.surfaceLocator, self.isoRegions, self.numberOfISORegions,
+      pathPointIds, self.geodesicDistances)
+
+  def run(self, weightsList, numberOfWorkers=None, useProcesses=False, resultCallback=None, cancelEvent=None):
+    """
+    Evaluate all weight vectors.
+    :param weightsList: List of weight vectors [d, c, h, dc, dh, ch, dch, p]
+    :param numberOfWorkers: Number of worker threads or processes. Uses the number of CPUs by default.
+    :param useProcesses: Use worker processes instead of threads. Processes should only be used when running
+      outside of the Slicer application, since they must be able to start a new Python interpreter.
+    :param resultCallback: Optional function called on the calling thread as each result completes,
+      with the index of the weights and the metrics.
+    :param cancelEvent: Optional threading.Event. When it is set, the weights that have not started are skipped.
+      The results of the evaluations that were already running are still returned and passed to resultCallback.
+    :return: List of metrics, in the same order as weightsList. None for weights that were skipped.
+      If an evaluation fails, the running evaluations are completed and the first error is raised.
+    """
+    if numberOfWorkers is None:
+      numberOfWorkers = os.cpu_count() or 1
+    numberOfWorkers = max(1, min(numberOfWorkers, len(weightsList)))
+
+    # Build the shared edge feature matrix once, before it is used by the workers
+    self.surfaceGraph.getEdgeFeatures(self.penalties)
+
+    if useProcesses:
+      executor = concurrent.futures.ProcessPoolExecutor(max_workers=numberOfWorkers,
+        initializer=initializeWorkerProcess, initargs=(self,))
+      evaluateFunction = evaluateWeightsInWorkerProcess
+    else:
+      executor = concurrent.futures.ThreadPoolExecutor(max_workers=numberOfWorkers)
+      evaluateFunction = self.evaluateWeights
+
+    results = [None] * len(weightsList)
+    with executor:
+      futures = {}
+      for index, weights in enumerate(weightsList):
+        futures[executor.submit(evaluateFunction, weights)] = index
+      # When the sweep is cancelled or an evaluation fails, the weights that have not started are skipped.
+      # The evaluations that are already running are still collected, so that their results are not lost.
+      stopping = False
+      error = None
+      for future in concurrent.futures.as_completed(futures):
+        if future.cancelled():
+          continue
+        index = futures[future]
+        try:
+          results[index] = future.result()
+        except Exception as e:
+          if error is None:
+            error = e
+        else:
+          if resultCallback:
+            resultCallback(index, results[index])
+        if not stopping and (error is not None or (cancelEvent is not None and cancelEvent.is_set())):
+          for pendingFuture in futures:
+            pendingFuture.cancel()
+          stopping = True
+    if error is not None:
+      raise error
+    logging.debug("CurveComparisonSweep: Evaluated %d weights using %d workers", len(weightsList), numberOfWorkers)
+    return results
@@ -701,7 +701,7 @@ class NeuroSegmentParcellationWidget(ScriptedLoadableModuleWidget, VTKObservatio
       logging.error("onComputeClicked: Could not find tool node with output ID: " + id)
       return
     self.logic.runDynamicModelerTool(toolNode)
-    self.logic.exportOutputToSurfaceLabel(self.parameterNode)
+    self.logic.exportOutputToSurfaceLabel(self.parameterNode, incremental=True)
     self.updateGUIFromParameterNode()
 
   def onDeleteClicked(self, id):
@@ -840,7 +840,7 @@ class NeuroSegmentParcellationWidget(ScriptedLoadableModuleWidget, VTKObservatio
     importOverlay = self.ui.importOverlayComboBox.currentText
     destinationNode = self.ui.destinationModelComboBox.currentNode()
     self.logic.convertOverlayToModelNode(self.logic.getOrigModelNode(self.parameterNode), importOverlay, destinationNode)
-    self.logic.exportOutputToSurfaceLabel(self.parameterNode)
+    self.logic.exportOutputToSurfaceLabel(self.parameterNode, incremental=True)
 
   def onPlaneCheckBox(self, checked):
     if self.parameterNode is None:
@@ -870,16 +870,44 @@ class NeuroSegmentParcellationTest(ScriptedLoadableModuleTest):
 
     self.meshParseTool1()
 
-  def setupSphere(self, radius):
+    self.setUp()
+    self.pathSolver1()
+
+    self.setUp()
+    self.observerRegistry1()
+
+    self.setUp()
+    self.surfaceCorrespondence1()
+
+    self.setUp()
+    self.transformPoints1()
+
+    self.setUp()
+    self.worldSurfaceCache1()
+
+  def setupSphere(self, radius, addScalars=False):
+    """
+    :param addScalars: If True, "curv" and "sulc" point scalars with both positive and negative values are added
+    """
+    import numpy as np
+    from vtk.util import numpy_support
 
     sphereSource = vtk.vtkSphereSource()
     sphereSource.SetRadius(radius)
     sphereSource.SetPhiResolution(75)
     sphereSource.SetThetaResolution(75)
     sphereSource.Update()
+    polyData = sphereSource.GetOutput()
+
+    if addScalars:
+      points = numpy_support.vtk_to_numpy(polyData.GetPoints().GetData()) / radius
+      for arrayName, values in [("curv", np.sin(3.0 * points[:,0]) * points[:,2]), ("sulc", np.cos(2.0 * points[:,1]) - 0.5)]:
+        array = numpy_support.numpy_to_vtk(values.astype(np.float32), deep=True)
+        array.SetName(arrayName)
+        polyData.GetPointData().AddArray(array)
 
     modelNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode")
-    modelNode.SetAndObservePolyData(sphereSource.GetOutput())
+    modelNode.SetAndObservePolyData(polyData)
     modelNode.CreateDefaultDisplayNodes()
     return modelNode
 
@@ -953,3 +981,345 @@ class NeuroSegmentParcellationTest(ScriptedLoadableModuleTest):
 
     testDuration = time.time() - startTime
     logging.info("Test duration: %f", testDuration)
+
+  def pathSolver1(self):
+    """
+    Compare the paths computed by NeuroSegmentParcellationPathSolver to the paths of the curve node.
+    """
+    import numpy as np
+    from NeuroSegmentParcellationLibs.NeuroSegmentParcellationPathSolver import NeuroSegmentParcellationPathSolver
+    if not NeuroSegmentParcellationPathSolver.isAvailable():
+      logging.warning("pathSolver1: scipy is not available. Skipping test.")
+      return
+
+    logic = NeuroSegmentParcellationLogic()
+    parameterNode = logic.getParameterNode()
+
+    origModelNode = self.setupSphere(50.0)
+    logic.setOrigModelNode(parameterNode, origModelNode)
+
+    curveNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFreeSurferCurveNode")
+    curveNode.SetAndObserveShortestDistanceSurfaceNode(origModelNode)
+    curveNode.SetCurveTypeToShortestDistanceOnSurface()
+    curveNode.AddControlPoint(vtk.vtkVector3d(-24.256452560424805, -24.25225257873535, 36.426605224609375))
+    curveNode.AddControlPoint(vtk.vtkVector3d(23.89341163635254, -22.64985466003418, 37.68958282470703))
+    curveNode.AddControlPoint(vtk.vtkVector3d(24.005630493164062, 29.707569122314453, 32.274898529052734))
+
+    pointIds = logic.computeCurvePointIds(parameterNode, curveNode)
+    self.assertIsNotNone(pointIds)
+
+    surfacePoints = slicer.util.arrayFromModelPoints(origModelNode)
+    pathPoints = surfacePoints[pointIds]
+    pathLength = np.sum(np.linalg.norm(pathPoints[1:] - pathPoints[:-1], axis=1))
+
+    # Paths with equal cost may visit different vertices, so only the end points and the path length are compared
+    curvePoints = slicer.util.arrayFromMarkupsCurvePoints(curveNode)
+    self.assertTrue(np.allclose(pathPoints[0], curvePoints[0], atol=1e-3))
+    self.assertTrue(np.allclose(pathPoints[-1], curvePoints[-1], atol=1e-3))
+    self.assertAlmostEqual(pathLength, curveNode.GetCurveLengthWorld(), places=3)
+
+    # Bidirectional and A* search should find paths with the same cost as the Dijkstra search
+    benchmarkResults = logic.benchmarkPathSearchModes(parameterNode, [curveNode])[curveNode.GetName()]
+    dijkstraResults = benchmarkResults[NeuroSegmentParcellationPathSolver.DIJKSTRA_SEARCH]
+    for searchMode in NeuroSegmentParcellationPathSolver.SEARCH_MODES:
+      self.assertAlmostEqual(benchmarkResults[searchMode]["pathCost"], dijkstraResults["pathCost"], places=6)
+      self.assertEqual(benchmarkResults[searchMode]["numberOfSolves"], 2)
+      self.assertGreater(benchmarkResults[searchMode]["numberOfSettledPoints"], 0)
+      curveNode.SetAttribute(NeuroSegmentParcellationPathSolver.SEARCH_MODE_ATTRIBUTE_NAME, searchMode)
+      searchPoints = surfacePoints[logic.computeCurvePointIds(parameterNode, curveNode)]
+      self.assertAlmostEqual(np.sum(np.linalg.norm(searchPoints[1:] - searchPoints[:-1], axis=1)), pathLength, places=3)
+    curveNode.SetAttribute(NeuroSegmentParcellationPathSolver.SEARCH_MODE_ATTRIBUTE_NAME, "")
+
+    # The weighted cost terms, penalties and cost functions are only used on surfaces with curv and sulc scalars.
+    # The costs are not symmetric, so the solver should find exactly the same points as the curve node.
+    slicer.mrmlScene.RemoveNode(curveNode)
+    slicer.mrmlScene.RemoveNode(origModelNode)
+    origModelNode = self.setupSphere(50.0, addScalars=True)
+    logic.setOrigModelNode(parameterNode, origModelNode)
+    surfaceLocator = vtk.vtkPointLocator()
+    surfaceLocator.SetDataSet(origModelNode.GetPolyData())
+    surfaceLocator.BuildLocator()
+
+    curveNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFreeSurferCurveNode")
+    curveNode.SetAndObserveShortestDistanceSurfaceNode(origModelNode)
+    curveNode.SetCurveTypeToShortestDistanceOnSurface()
+    curveNode.AddControlPoint(vtk.vtkVector3d(-24.256452560424805, -24.25225257873535, 36.426605224609375))
+    curveNode.AddControlPoint(vtk.vtkVector3d(23.89341163635254, -22.64985466003418, 37.68958282470703))
+    curveNode.AddControlPoint(vtk.vtkVector3d(24.005630493164062, 29.707569122314453, 32.274898529052734))
+    curveNode.SetCurvaturePenalty(5.0)
+    curveNode.SetSulcalHeightPenalty(2.0)
+    curveNode.SetDistanceCurvaturePenalty(3.0)
+    curveNode.SetDistanceSulcalHeightPenalty(1.5)
+    curveNode.SetCurvatureSulcalHeightPenalty(4.0)
+    curveNode.SetDistanceCurvatureSulcalHeightPenalty(2.5)
+
+    sulcRange = origModelNode.GetPolyData().GetPointData().GetArray("sulc").GetRange()
+    weightsList = [
+      [1.0, 1.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0],
+      [1.0, 0.0, 1.0, 1.0, 0.0, 0.0, 1.0, 0.0],
+      [0.5, 1.0, 1.0, 0.0, 0.0, 1.0, 0.0, 1.0],
+      [1.0, 0.25, 0.75, 0.5, 0.5, 0.25, 0.75, 0.5],
+      ]
+    for costFunctionType, distanceWeightingFunction in [
+        (NeuroSegmentParcellationPathSolver.DISTANCE_COST_FUNCTION, ""),
+        (NeuroSegmentParcellationPathSolver.INVERSE_SQUARED_COST_FUNCTION, "1 + (sulc - sulcMin) / (sulcMax - sulcMin)")]:
+      # Same cost function as NeuroSegmentParcellationLogic.updateInputMarkupSurfaceCostFunction
+      curveNode.SetAttribute("DistanceWeightingFunction", distanceWeightingFunction)
+      curveNode.SetSurfaceCostFunctionType(curveNode.GetSurfaceCostFunctionTypeFromString(costFunctionType))
+      if distanceWeightingFunction:
+        curveNode.SetSurfaceDistanceWeightingFunction(distanceWeightingFunction.replace(
+          "sulcMin", str(sulcRange[0])).replace("sulcMax", str(sulcRange[1])))
+
+      for weights in weightsList:
+        curveNode.SetDistanceWeight(weights[0])
+        curveNode.SetCurvatureWeight(weights[1])
+        curveNode.SetSulcalHeightWeight(weights[2])
+        curveNode.SetDistanceCurvatureWeight(weights[3])
+        curveNode.SetDistanceSulcalHeightWeight(weights[4])
+        curveNode.SetCurvatureSulcalHeightWeight(weights[5])
+        curveNode.SetDistanceCurvatureSulcalHeightWeight(weights[6])
+        curveNode.SetDirectionWeight(weights[7])
+
+        message = costFunctionType + " " + str(weights)
+        pathSolver = logic.getCurvePathSolver(parameterNode, curveNode)
+        self.assertEqual(pathSolver.costFunctionType, costFunctionType, message)
+        curvePointIds = [surfaceLocator.FindClosestPoint(point) for point in slicer.util.arrayFromMarkupsCurvePoints(curveNode)]
+        # The control points between segments are only included once in the solver path
+        curvePointIds = [pointId for i, pointId in enumerate(curvePointIds) if i == 0 or pointId != curvePointIds[i-1]]
+        for searchMode in NeuroSegmentParcellationPathSolver.SEARCH_MODES:
+          curveNode.SetAttribute(NeuroSegmentParcellationPathSolver.SEARCH_MODE_ATTRIBUTE_NAME, searchMode)
+          self.assertEqual(logic.computeCurvePointIds(parameterNode, curveNode), curvePointIds, message + " " + searchMode)
+
+  def observerRegistry1(self):
+    """
+    Test that NeuroSegmentParcellationObserverRegistry only adds and removes the changed observers, that events are
+    ignored while blocked, and that observers of removed nodes are reported as leaked.
+    """
+    from NeuroSegmentParcellationLibs.NeuroSegmentParcellationObserverRegistry import NeuroSegmentParcellationObserverRegistry
+
+    events = []
+    def onModified(caller, eventId):
+      events.append(caller.GetID())
+
+    nodeA = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode")
+    nodeB = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode")
+    registry = NeuroSegmentParcellationObserverRegistry()
+
+    self.assertEqual(registry.update([(nodeA, vtk.vtkCommand.ModifiedEvent, onModified)]), (1, 0))
+    self.assertEqual(registry.update([
+      (nodeA, vtk.vtkCommand.ModifiedEvent, onModified),
+      (nodeB, vtk.vtkCommand.ModifiedEvent, onModified),
+      ]), (1, 0))
+    # Only the difference is added or removed
+    self.assertEqual(registry.update([
+      (nodeA, vtk.vtkCommand.ModifiedEvent, onModified),
+      (nodeB, vtk.vtkCommand.ModifiedEvent, onModified),
+      ]), (0, 0))
+    self.assertEqual(registry.update([(nodeB, vtk.vtkCommand.ModifiedEvent, onModified)]), (0, 1))
+    self.assertEqual(len(registry), 1)
+
+    nodeA.Modified()
+    nodeB.Modified()
+    self.assertEqual(events, [nodeB.GetID()])
+
+    # Events are ignored while blocked, including nested blocks
+    with registry.blockEvents():
+      with registry.blockEvents():
+        nodeB.Modified()
+      nodeB.Modified()
+    self.assertEqual(events, [nodeB.GetID()])
+    nodeB.Modified()
+    self.assertEqual(events, [nodeB.GetID(), nodeB.GetID()])
+
+    counts = registry.getObserverCounts()
+    self.assertEqual(counts["registered"], 1)
+    self.assertEqual(counts["leaked"], 0)
+    self.assertEqual(counts["added"], 2)
+    self.assertEqual(counts["removed"], 1)
+
+    # Observers of nodes that are removed from the scene are leaked until the registry is updated
+    slicer.mrmlScene.RemoveNode(nodeB)
+    self.assertEqual(registry.getObserverCounts()["leaked"], 1)
+    self.assertEqual(registry.update([]), (0, 1))
+    counts = registry.getObserverCounts()
+    self.assertEqual(counts["registered"], 0)
+    self.assertEqual(counts["leaked"], 0)
+
+    registry.update([(nodeA, vtk.vtkCommand.ModifiedEvent, onModified)])
+    registry.removeAll()
+    self.assertEqual(len(registry), 0)
+    nodeA.Modified()
+    self.assertEqual(events, [nodeB.GetID(), nodeB.GetID()])
+
+  def surfaceCorrespondence1(self):
+    """
+    Test that the points found on the orig surface are gathered from the pial surface by vertex id, and that the vertex ids
+    of a curve are reused until the curve is modified or removed.
+    """
+    import numpy as np
+    from NeuroSegmentParcellationLibs.NeuroSegmentParcellationSurfaceCorrespondence import NeuroSegmentParcellationSurfaceCorrespondence
+    from NeuroSegmentParcellationLibs.NeuroSegmentParcellationWorldSurfaceCache import NeuroSegmentParcellationWorldSurfaceCache
+
+    origModelNode = self.setupSphere(50.0)
+    pialModelNode = self.setupSphere(75.0)
+    origPoints = slicer.util.arrayFromModelPoints(origModelNode)
+    pialPoints = slicer.util.arrayFromModelPoints(pialModelNode)
+
+    correspondence = NeuroSegmentParcellationSurfaceCorrespondence(NeuroSegmentParcellationWorldSurfaceCache())
+
+    # Points that are duplicated in the surface may be found at either vertex, so only the unique points are compared
+    _, uniqueIds, counts = np.unique(origPoints, axis=0, return_index=True, return_counts=True)
+    uniqueIds = np.sort(uniqueIds[counts == 1])
+    pointIds = correspondence.findPointIds(origModelNode, origPoints[uniqueIds])
+    self.assertTrue(np.array_equal(pointIds, uniqueIds))
+    self.assertTrue(np.allclose(correspondence.getCorrespondingPoints(pialModelNode.GetPolyData(), pointIds), pialPoints[uniqueIds]))
+    self.assertEqual(len(correspondence.findPointIds(origModelNode, np.zeros((0, 3)))), 0)
+
+    # Points near the orig surface are gathered from the pial surface at the same vertex
+    nearPoints = origPoints[uniqueIds[:10]] * 1.01
+    self.assertTrue(np.allclose(
+      correspondence.getCorrespondingPoints(pialModelNode.GetPolyData(), correspondence.findPointIds(origModelNode, nearPoints)),
+      pialPoints[uniqueIds[:10]]))
+
+    # Ids that are not on the surface are rejected
+    self.assertIsNone(correspondence.getCorrespondingPoints(pialModelNode.GetPolyData(), [0, len(pialPoints)]))
+    self.assertIsNone(correspondence.getCorrespondingPoints(pialModelNode.GetPolyData(), [-1]))
+
+    # The vertex ids of a curve are only searched for when the modified time changes
+    numberOfSearches = [0]
+    def getCurvePoints():
+      numberOfSearches[0] += 1
+      return origPoints[uniqueIds[:5]]
+    curvePointIds = correspondence.getCurvePointIds("curve", 1, origModelNode, getCurvePoints)
+    self.assertTrue(np.array_equal(curvePointIds, uniqueIds[:5]))
+    self.assertIs(correspondence.getCurvePointIds("curve", 1, origModelNode, getCurvePoints), curvePointIds)
+    self.assertEqual(numberOfSearches[0], 1)
+    correspondence.getCurvePointIds("curve", 2, origModelNode, getCurvePoints)
+    self.assertEqual(numberOfSearches[0], 2)
+    correspondence.removeCurve("curve")
+    self.assertNotIn("curve", correspondence.curvePointIds)
+
+    # The logic discards the vertex ids of curves that are removed from the scene
+    logic = NeuroSegmentParcellationLogic()
+    curveNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFreeSurferCurveNode")
+    logic.surfaceCorrespondence.getCurvePointIds(curveNode.GetID(), 1, origModelNode, getCurvePoints)
+    self.assertIn(curveNode.GetID(), logic.surfaceCorrespondence.curvePointIds)
+    slicer.mrmlScene.RemoveNode(curveNode)
+    self.assertNotIn(curveNode.GetID(), logic.surfaceCorrespondence.curvePointIds)
+
+  def transformPoints1(self):
+    """
+    Test that transforming points at once gives the same result as transforming each point, through both linear
+    and non-linear parent transforms.
+    """
+    import numpy as np
+    from NeuroSegmentParcellationLibs.NeuroSegmentParcellationTransforms import transformPointsToWorld, transformPointsFromWorld
+
+    modelNode = self.setupSphere(50.0)
+    points = slicer.util.arrayFromModelPoints(modelNode)[::50].astype(np.float64)
+
+    # Without a parent transform, the points are copied
+    worldPoints = transformPointsToWorld(points, modelNode)
+    self.assertTrue(np.array_equal(worldPoints, points))
+    self.assertIsNot(worldPoints, points)
+
+    linearTransform = vtk.vtkTransform()
+    linearTransform.Translate(10.0, -20.0, 30.0)
+    linearTransform.RotateWXYZ(30.0, 1.0, 2.0, 3.0)
+    linearTransform.Scale(1.0, 1.5, 0.5)
+    linearTransformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode")
+    linearTransformNode.SetMatrixTransformToParent(linearTransform.GetMatrix())
+    modelNode.SetAndObserveTransformNodeID(linearTransformNode.GetID())
+
+    expectedWorldPoints = np.zeros(points.shape)
+    for point, expectedWorldPoint in zip(points, expectedWorldPoints):
+      worldPoint = [0.0, 0.0, 0.0]
+      modelNode.TransformPointToWorld(point.tolist(), worldPoint)
+      expectedWorldPoint[:] = worldPoint
+    linearWorldPoints = transformPointsToWorld(points, modelNode)
+    self.assertTrue(np.allclose(linearWorldPoints, expectedWorldPoints, atol=1e-6))
+    self.assertTrue(np.allclose(transformPointsFromWorld(linearWorldPoints, modelNode), points, atol=1e-6))
+
+    # A grid transform without displacement makes the transform non-linear without changing the points,
+    # so the general transform path should give the same result as the linear path
+    displacementGrid = vtk.vtkImageData()
+    displacementGrid.SetOrigin(-200.0, -200.0, -200.0)
+    displacementGrid.SetSpacing(100.0, 100.0, 100.0)
+    displacementGrid.SetDimensions(5, 5, 5)
+    displacementGrid.AllocateScalars(vtk.VTK_DOUBLE, 3)
+    displacementGrid.GetPointData().GetScalars().Fill(0.0)
+    gridTransform = slicer.vtkOrientedGridTransform()
+    gridTransform.SetDisplacementGridData(displacementGrid)
+    gridTransformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLGridTransformNode")
+    gridTransformNode.SetAndObserveTransformFromParent(gridTransform)
+    linearTransformNode.SetAndObserveTransformNodeID(gridTransformNode.GetID())
+    self.assertFalse(linearTransformNode.IsTransformToWorldLinear())
+
+    generalWorldPoints = transformPointsToWorld(points, modelNode)
+    self.assertTrue(np.allclose(generalWorldPoints, linearWorldPoints, atol=1e-3))
+    self.assertTrue(np.allclose(transformPointsFromWorld(generalWorldPoints, modelNode), points, atol=1e-3))
+    self.assertEqual(transformPointsToWorld(np.zeros((0, 3)), modelNode).shape, (0, 3))
+
+  def worldSurfaceCache1(self):
+    """
+    Test that the world surfaces and point locators of NeuroSegmentParcellationWorldSurfaceCache are reused until
+    the surface or its parent transforms are modified.
+    """
+    import numpy as np
+    from NeuroSegmentParcellationLibs.NeuroSegmentParcellationWorldSurfaceCache import NeuroSegmentParcellationWorldSurfaceCache
+
+    cache = NeuroSegmentParcellationWorldSurfaceCache()
+    modelNode = self.setupSphere(50.0)
+    modelPoints = slicer.util.arrayFromModelPoints(modelNode)
+
+    # Without a parent transform, the world locator is the model locator
+    self.assertIs(cache.getWorldPointLocator(modelNode), cache.getPointLocator(modelNode))
+
+    transformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode")
+    transform = vtk.vtkTransform()
+    transform.Translate(100.0, 0.0, 0.0)
+    transformNode.SetMatrixTransformToParent(transform.GetMatrix())
+    modelNode.SetAndObserveTransformNodeID(transformNode.GetID())
+
+    worldPolyData = cache.getWorldPolyData(modelNode)
+    self.assertIs(cache.getWorldPolyData(modelNode), worldPolyData)
+    self.assertEqual(cache.numberOfWorldSurfaceUpdates, 1)
+    self.assertTrue(np.allclose(cache.getWorldPoints(modelNode), modelPoints + [100.0, 0.0, 0.0]))
+    pointLocator = cache.getPointLocator(modelNode)
+
+    # Modifying the transform only invalidates the world surface
+    transform.Translate(0.0, 50.0, 0.0)
+    transformNode.SetMatrixTransformToParent(transform.GetMatrix())
+    self.assertIsNot(cache.getWorldPolyData(modelNode), worldPolyData)
+    self.assertEqual(cache.numberOfWorldSurfaceUpdates, 2)
+    self.assertTrue(np.allclose(cache.getWorldPoints(modelNode), modelPoints + [100.0, 50.0, 0.0]))
+    self.assertIs(cache.getPointLocator(modelNode), pointLocator)
+
+    worldPointIds, _ = cache.getWorldPointLocator(modelNode).findClosestPoints(modelPoints[:10] + [100.0, 50.0, 0.0])
+    self.assertTrue(np.allclose(modelPoints[worldPointIds], modelPoints[:10]))
+
+    # Modifying a transform further up the hierarchy also invalidates the world surface
+    parentTransformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode")
+    transformNode.SetAndObserveTransformNodeID(parentTransformNode.GetID())
+    worldPolyData = cache.getWorldPolyData(modelNode)
+    numberOfWorldSurfaceUpdates = cache.numberOfWorldSurfaceUpdates
+    parentTransform = vtk.vtkTransform()
+    parentTransform.Translate(0.0, 0.0, 25.0)
+    parentTransformNode.SetMatrixTransformToParent(parentTransform.GetMatrix())
+    self.assertIsNot(cache.getWorldPolyData(modelNode), worldPolyData)
+    self.assertEqual(cache.numberOfWorldSurfaceUpdates, numberOfWorldSurfaceUpdates + 1)
+    self.assertTrue(np.allclose(cache.getWorldPoints(modelNode), modelPoints + [100.0, 50.0, 25.0]))
+
+    # Modifying the surface points invalidates the point locator
+    modelNode.GetPolyData().GetPoints().Modified()
+    self.assertIsNot(cache.getPointLocator(modelNode), pointLocator)
+
+    # Entries of nodes that are removed from the scene are discarded when another node is added to the cache
+    modelNodeID = modelNode.GetID()
+    slicer.mrmlScene.RemoveNode(modelNode)
+    otherModelNode = self.setupSphere(25.0)
+    cache.getWorldPolyData(otherModelNode)
+    self.assertNotIn(modelNodeID, cache.entries)
+    self.assertIn(otherModelNode.GetID(), cache.entries)
+    cache.clear()
+    self.assertEqual(len(cache.entries), 0)
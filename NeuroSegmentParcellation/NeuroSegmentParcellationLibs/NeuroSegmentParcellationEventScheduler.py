@@ -0,0 +1,163 @@
+import qt
+import time
+import logging
+import collections
+
+class NeuroSegmentParcellationEventScheduler(object):
+  """
+  Coalesce and throttle the work done in response to node events.
+
+  Each event is scheduled with the name of the handler and the node that invoked it. Only the latest scheduled call for
+  each (handler, node) pair is kept.
+    - While the node is not being interacted with, the call is run immediately. If the same handler is scheduled again
+      for the same node while it is running, the call is run once more after the current call finishes,
+      instead of being run recursively.
+    - While a control point or handle of the node is being dragged (see startInteraction), the call is deferred
+      and run at most once every minimumInterval seconds.
+    - When the interaction ends (see endInteraction), all of the deferred calls of the node are run immediately,
+      so that the final state is exact.
+
+  The number of received, executed and coalesced events, and the execution time of each handler are recorded
+  in the counters (see getCounters).
+  """
+
+  # Minimum time (seconds) between two deferred calls of the same handler for the same node
+  DEFAULT_MINIMUM_INTERVAL = 0.05
+
+  def __init__(self, minimumInterval=DEFAULT_MINIMUM_INTERVAL):
+    self.minimumInterval = minimumInterval
+    # Latest scheduled call for each (handler name, node key): (function, args)
+    self.pendingCalls = collections.OrderedDict()
+    self.runningKeys = set()
+    self.lastRunTimes = {}
+    self.interactingNodeKeys = set()
+    self.counters = {}
+
+    self.timer = qt.QTimer()
+    self.timer.setSingleShot(True)
+    self.timer.connect('timeout()', self.onTimeout)
+
+  @staticmethod
+  def getNodeKey(node):
+    if node is None:
+      return None
+    if hasattr(node, "GetID") and node.GetID():
+      return node.GetID()
+    return id(node)
+
+  def getHandlerCounters(self, handlerName):
+    handlerCounters = self.counters.get(handlerName)
+    if handlerCounters is None:
+      handlerCounters = {
+        "received": 0,
+        "executed": 0,
+        "coalesced": 0,
+        "totalTime": 0.0,
+        "maximumTime": 0.0,
+        }
+      self.counters[handlerName] = handlerCounters
+    return handlerCounters
+
+  def getCounters(self):
+    """
+    :return: Dictionary containing the counters of each handler: the number of "received", "executed" and "coalesced" events,
+      and the "totalTime" and "maximumTime" (seconds) spent running the handler
+    """
+    return {handlerName: dict(handlerCounters) for handlerName, handlerCounters in self.counters.items()}
+
+  def resetCounters(self):
+    self.counters = {}
+
+  def schedule(self, handlerName, node, function, *args):
+    """
+    Schedule a call of function(*args) in response to an event of the node.
+    Replaces the call that is already scheduled for the same handler and node.
+    """
+    key = (handlerName, self.getNodeKey(node))
+    handlerCounters = self.getHandlerCounters(handlerName)
+    handlerCounters["received"] += 1
+    if key in self.pendingCalls:
+      handlerCounters["coalesced"] += 1
+    self.pendingCalls[key] = (function, args)
+
+    if key in self.runningKeys:
+      # Run again by the current call once it is finished
+      return
+    if key[1] in self.interactingNodeKeys:
+      self.scheduleTimer()
+      return
+    self.run(key)
+
+  def run(self, key):
+    """
+    Run the pending call for the key, and repeat it if the handler was scheduled again while it was running.
+    """
+    handlerCounters = self.getHandlerCounters(key[0])
+    self.runningKeys.add(key)
+    try:
+      while key in self.pendingCalls:
+        function, args = self.pendingCalls.pop(key)
+        startTime = time.time()
+        try:
+          function(*args)
+        except Exception as e:
+          import traceback
+          traceback.print_exc()
+          logging.error("NeuroSegmentParcellationEventScheduler: " + key[0] + " failed: " + str(e))
+        elapsedTime = time.time() - startTime
+        self.lastRunTimes[key] = time.time()
+        handlerCounters["executed"] += 1
+        handlerCounters["totalTime"] += elapsedTime
+        handlerCounters["maximumTime"] = max(handlerCounters["maximumTime"], elapsedTime)
+    finally:
+      self.runningKeys.discard(key)
+
+  def scheduleTimer(self):
+    """
+    Start the timer for the earliest time that one of the pending calls can be run.
+    """
+    if len(self.pendingCalls) == 0:
+      return
+    currentTime = time.time()
+    delay = min([self.lastRunTimes.get(key, 0.0) + self.minimumInterval - currentTime for key in self.pendingCalls])
+    delayMs = max(0, int(delay * 1000))
+    if self.timer.isActive() and self.timer.remainingTime() <= delayMs:
+      return
+    self.timer.start(delayMs)
+
+  def onTimeout(self):
+    currentTime = time.time()
+    for key in list(self.pendingCalls.keys()):
+      if key in self.runningKeys or key not in self.pendingCalls:
+        continue
+      if self.lastRunTimes.get(key, 0.0) + self.minimumInterval <= currentTime:
+        self.run(key)
+    self.scheduleTimer()
+
+  def startInteraction(self, node):
+    """
+    Start deferring the calls for the node until endInteraction is called.
+    """
+    nodeKey = self.getNodeKey(node)
+    if nodeKey is not None:
+      self.interactingNodeKeys.add(nodeKey)
+
+  def endInteraction(self, node):
+    """
+    Stop deferring the calls for the node, and run all of its pending calls.
+    """
+    nodeKey = self.getNodeKey(node)
+    self.interactingNodeKeys.discard(nodeKey)
+    self.flush(nodeKey)
+
+  def flush(self, nodeKey=None):
+    """
+    Run all pending calls immediately.
+    :param nodeKey: Only run the pending calls of the node with this key. All pending calls are run by default.
+    """
+    for key in list(self.pendingCalls.keys()):
+      if nodeKey is not None and key[1] != nodeKey:
+        continue
+      if key in self.runningKeys or key not in self.pendingCalls:
+        continue
+      self.run(key)
@@ -4,8 +4,18 @@ import vtk, slicer
 from slicer.ScriptedLoadableModule import *
 from slicer.util import VTKObservationMixin
 import logging
+import numpy as np
+from vtk.util import numpy_support
 
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationEventScheduler import NeuroSegmentParcellationEventScheduler
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationObserverRegistry import NeuroSegmentParcellationObserverRegistry
 from NeuroSegmentParcellationLibs.NeuroSegmentParcellationVisitor import NeuroSegmentParcellationVisitor
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationPathSolver import NeuroSegmentParcellationPathSolver
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationSurfaceCorrespondence import NeuroSegmentParcellationSurfaceCorrespondence
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationSurfaceGraph import NeuroSegmentParcellationSurfaceGraph
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationTransforms import (createPoints, getControlPointPositionsWorld,
+  transformPointsFromWorld, transformPointsToWorld)
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationWorldSurfaceCache import NeuroSegmentParcellationWorldSurfaceCache
 
 class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
   """Perform filtering
@@ -54,18 +64,49 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
 
   PLANE_INTERSECTION_VISIBILITY_NAME = "PlaneIntersectionVisibility"
 
+  MARKUP_PROJECTION_VISIBILITY_NAME = "MarkupProjectionVisibility"
+
   LABEL_OUTLINE_VISIBILITY_NAME = "LabelOutlineVisibility"
 
+  # Node references of the parameter node that are checked for changes by updateFromParameterNode
+  PARAMETER_NODE_UPDATE_REFERENCE_ROLES = [
+    INPUT_MARKUPS_REFERENCE,
+    ORIG_MODEL_REFERENCE,
+    PIAL_MODEL_REFERENCE,
+    INFLATED_MODEL_REFERENCE,
+    OUTPUT_MODEL_REFERENCE,
+    TOOL_NODE_REFERENCE,
+    ]
+  # Input models whose polydata is checked for changes by updateFromParameterNode
+  PARAMETER_NODE_UPDATE_MODEL_ROLES = [
+    ORIG_MODEL_REFERENCE,
+    PIAL_MODEL_REFERENCE,
+    INFLATED_MODEL_REFERENCE,
+    ]
+  # Suffix of the names of the model polydata in the parameter node changes (ex. "OrigModel.PolyData")
+  MODEL_POLYDATA_CHANGE_SUFFIX = ".PolyData"
+
   def __init__(self, parent=None):
     ScriptedLoadableModuleLogic.__init__(self, parent)
     VTKObservationMixin.__init__(self)
     self.isSingletonParameterNode = False
     self.queryNodeFileName = ""
 
-    self.origPointLocator = vtk.vtkPointLocator()
-    self.pialPointLocator = vtk.vtkPointLocator()
-    self.inflatedPointLocator = vtk.vtkPointLocator()
-    self.inputMarkupObservers = []
+    self.worldSurfaceCache = NeuroSegmentParcellationWorldSurfaceCache.getSharedCache()
+    self.surfaceCorrespondence = NeuroSegmentParcellationSurfaceCorrespondence(self.worldSurfaceCache)
+    self.origSurfaceGraph = None
+    self.origSurfaceGraphPolyData = None
+    self.origSurfaceGraphMTime = 0
+    self.curvePathSolvers = {}
+    # Pedigree id arrays created by initializePedigreeIds, and their modified time when they were created
+    self.pedigreeIdArrays = {}
+    # State of the previous exportOutputToSurfaceLabel, used by incremental exports
+    self.surfaceLabelExport = None
+    self.eventScheduler = NeuroSegmentParcellationEventScheduler()
+    # Node references and parameters of each parameter node when it was last handled by updateFromParameterNode
+    self.parameterNodeStates = {}
+    self.inputMarkupObservers = NeuroSegmentParcellationObserverRegistry()
+    self.inputModelObservers = NeuroSegmentParcellationObserverRegistry()
     self.parameterNode = None
     self.updatingFromMasterMarkup = False
     self.updatingFromDerivedMarkup = False
@@ -75,6 +116,7 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
 
     self.addObserver(slicer.mrmlScene, slicer.mrmlScene.EndImportEvent, self.updateParameterNodeObservers)
     self.addObserver(slicer.mrmlScene, slicer.vtkMRMLScene.NodeAddedEvent, self.onNodeAdded)
+    self.addObserver(slicer.mrmlScene, slicer.vtkMRMLScene.NodeRemovedEvent, self.onNodeRemoved)
     self.updateParameterNodeObservers()
 
   def setParameterNode(self, parameterNode):
@@ -84,6 +126,7 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
     self.parameterNode = parameterNode
     if self.parameterNode is None:
       return
+    self.parameterNodeStates.pop(parameterNode.GetID(), None)
     self.onParameterNodeModified(parameterNode)
 
   def getParameterNode(self):
@@ -104,6 +147,7 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
         if node.GetAttribute("ModuleName") == self.moduleName:
           if not self.hasObserver(node, vtk.vtkCommand.ModifiedEvent, self.onParameterNodeModified):
             self.addObserver(node, vtk.vtkCommand.ModifiedEvent, self.onParameterNodeModified)
+          self.parameterNodeStates.pop(node.GetID(), None)
           self.onParameterNodeModified(node)
     finally:
       slicer.app.resumeRender()
@@ -119,22 +163,100 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
     if not self.hasObserver(node, vtk.vtkCommand.ModifiedEvent, self.onParameterNodeModified):
       self.addObserver(node, vtk.vtkCommand.ModifiedEvent, self.onParameterNodeModified)
 
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def onNodeRemoved(self, caller, eventId, node):
+    """
+    Discard the vertex ids and path solver that were stored for a removed curve.
+    """
+    if node is None or not node.IsA("vtkMRMLMarkupsCurveNode"):
+      return
+    self.surfaceCorrespondence.removeCurve(node.GetID())
+    self.curvePathSolvers.pop(node.GetID(), None)
+
   def onParameterNodeModified(self, parameterNode, eventId=None):
     if parameterNode is None:
       return
+    self.eventScheduler.schedule("onParameterNodeModified", parameterNode, self.updateFromParameterNode, parameterNode)
+
+  def getParameterNodeState(self, parameterNode):
+    """
+    Return the node references and parameters of the parameter node that the updates in updateFromParameterNode depend on,
+    and the modified times of the input model polydata, including their points, polygons and curv/sulc arrays.
+    """
+    references = {}
+    for referenceRole in self.PARAMETER_NODE_UPDATE_REFERENCE_ROLES:
+      numberOfReferences = parameterNode.GetNumberOfNodeReferences(referenceRole)
+      references[referenceRole] = tuple(parameterNode.GetNthNodeReferenceID(referenceRole, i) for i in range(numberOfReferences))
+    parameters = {parameterName: parameterNode.GetParameter(parameterName) for parameterName in parameterNode.GetParameterNames()}
+    models = {}
+    for modelRole in self.PARAMETER_NODE_UPDATE_MODEL_ROLES:
+      modelNode = parameterNode.GetNodeReference(modelRole)
+      hasPolyData = modelNode is not None and modelNode.GetPolyData() is not None
+      models[modelRole + self.MODEL_POLYDATA_CHANGE_SUFFIX] = (NeuroSegmentParcellationWorldSurfaceCache.getGeometryKey(modelNode)
+        if hasPolyData else None)
+    return references, parameters, models
+
+  def getParameterNodeChanges(self, parameterNode):
+    """
+    Find the node reference roles and parameters that changed since the previous call for the parameter node.
+    :return: Set of changed reference roles, parameter names and model polydata names (see MODEL_POLYDATA_CHANGE_SUFFIX),
+      or None if the parameter node was not handled before
+    """
+    state = self.getParameterNodeState(parameterNode)
+    previousState = self.parameterNodeStates.get(parameterNode.GetID())
+    self.parameterNodeStates[parameterNode.GetID()] = state
+    if previousState is None:
+      return None
+
+    changes = set()
+    for previousValues, values in zip(previousState, state):
+      for name in set(previousValues.keys()) | set(values.keys()):
+        if previousValues.get(name) != values.get(name):
+          changes.add(name)
+    return changes
+
+  def updateFromParameterNode(self, parameterNode):
+    """
+    Update the nodes that depend on the parameter node.
+    Only the updates that depend on the references and parameters that changed since the previous update are run.
+    """
+    changes = self.getParameterNodeChanges(parameterNode)
+    def isModified(*names):
+      return changes is None or not changes.isdisjoint(names)
+
+    markupSliceVisibilityNames = [self.MARKUP_SLICE_VISIBILITY_PARAMETER_PREFIX + markupType for markupType in
+      [self.ORIG_NODE_ATTRIBUTE_VALUE, self.PIAL_NODE_ATTRIBUTE_VALUE, self.INFLATED_NODE_ATTRIBUTE_VALUE]]
+    updatePlaneIntersectionVisibility = isModified(self.INPUT_MARKUPS_REFERENCE, self.PLANE_INTERSECTION_VISIBILITY_NAME)
+    updateInputMarkupDisplay = isModified(self.INPUT_MARKUPS_REFERENCE, self.TOOL_NODE_REFERENCE,
+      self.MARKUP_PROJECTION_VISIBILITY_NAME, *markupSliceVisibilityNames)
+    modelPolyDataNames = [modelRole + self.MODEL_POLYDATA_CHANGE_SUFFIX for modelRole in self.PARAMETER_NODE_UPDATE_MODEL_ROLES]
+    origPolyDataName = self.ORIG_MODEL_REFERENCE + self.MODEL_POLYDATA_CHANGE_SUFFIX
+    # The curv/sulc ranges of the inverseSquared cost function depend on the orig polydata
+    updateInputMarkupSurfaceCostFunction = isModified(self.INPUT_MARKUPS_REFERENCE, self.ORIG_MODEL_REFERENCE, origPolyDataName)
 
     try:
       slicer.app.pauseRender()
-      self.updateInputModelNodes(parameterNode)
-      self.updateInputModelPointLocators(parameterNode)
-      self.updateAllModelViews(parameterNode)
-
-      self.removeInputMarkupObservers()
-      self.updatePlaneIntersectionVisibility()
-      self.updateInputMarkupDisplay(parameterNode)
-      self.updateInputMarkupSurfaceCostFunction(parameterNode)
-      self.updateInputMarkupObservers(parameterNode)
-      self.updateOutputModelAttributes(parameterNode)
+      if isModified(self.ORIG_MODEL_REFERENCE, self.TOOL_NODE_REFERENCE):
+        self.updateInputModelNodes(parameterNode)
+      if isModified(*self.PARAMETER_NODE_UPDATE_MODEL_ROLES) and parameterNode is self.parameterNode:
+        self.updateInputModelObservers(parameterNode)
+      if isModified(*(self.PARAMETER_NODE_UPDATE_MODEL_ROLES + modelPolyDataNames)):
+        self.updateInputModelPointLocators(parameterNode)
+      if isModified(self.ORIG_MODEL_REFERENCE, self.PIAL_MODEL_REFERENCE, self.INFLATED_MODEL_REFERENCE, self.OUTPUT_MODEL_REFERENCE):
+        self.updateAllModelViews(parameterNode)
+
+      # The markup events are ignored while the markups are modified, so that the changes are not handled as user edits
+      with self.inputMarkupObservers.blockEvents():
+        if updatePlaneIntersectionVisibility:
+          self.updatePlaneIntersectionVisibility()
+        if updateInputMarkupDisplay:
+          self.updateInputMarkupDisplay(parameterNode)
+        if updateInputMarkupSurfaceCostFunction:
+          self.updateInputMarkupSurfaceCostFunction(parameterNode)
+        if isModified(self.INPUT_MARKUPS_REFERENCE, self.TOOL_NODE_REFERENCE):
+          self.updateInputMarkupObservers(parameterNode)
+      if isModified(self.OUTPUT_MODEL_REFERENCE):
+        self.updateOutputModelAttributes(parameterNode)
     finally:
       slicer.app.resumeRender()
 
@@ -205,86 +327,235 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
         continue
       modelNode.GetDisplayNode().SetViewNodeIDs(viewIDs)
 
+  def updateInputModelObservers(self, parameterNode):
+    """
+    Observe the polydata of the input models of the current parameter node, so that the updates that depend on the model
+    polydata (see getParameterNodeState) are run when it is replaced or modified.
+    """
+    observers = []
+    for modelRole in self.PARAMETER_NODE_UPDATE_MODEL_ROLES:
+      modelNode = parameterNode.GetNodeReference(modelRole)
+      observers.append((modelNode, slicer.vtkMRMLModelNode.PolyDataModifiedEvent, self.onInputModelPolyDataModified))
+    self.inputModelObservers.update(observers)
+
+  def onInputModelPolyDataModified(self, modelNode, eventId=None):
+    if self.parameterNode is None:
+      return
+    self.onParameterNodeModified(self.parameterNode)
+
   def updateInputModelPointLocators(self, parameterNode):
+    """
+    Build the point locators of the input models in the world surface cache, so that they are not built during the first
+    edit of a markup. The locators are not stored by the logic, and are always retrieved from the cache when they are used,
+    so that they are rebuilt when the model polydata is modified.
+    """
     if parameterNode is None:
       return
+    for modelReference in [self.ORIG_MODEL_REFERENCE, self.PIAL_MODEL_REFERENCE, self.INFLATED_MODEL_REFERENCE]:
+      self.worldSurfaceCache.getPointLocator(parameterNode.GetNodeReference(modelReference))
+
+  def getOrigSurfaceGraph(self, parameterNode):
+    """
+    Return the NeuroSegmentParcellationSurfaceGraph of the orig model, in model coordinates.
+    The graph is rebuilt when the orig model polydata is changed.
+    """
+    if parameterNode is None:
+      return None
 
     origModelNode = parameterNode.GetNodeReference(self.ORIG_MODEL_REFERENCE)
-    if origModelNode is not None and self.origPointLocator.GetDataSet() != origModelNode.GetPolyData():
-        self.origPointLocator.SetDataSet(origModelNode.GetPolyData())
-        self.origPointLocator.BuildLocator()
+    if origModelNode is None or origModelNode.GetPolyData() is None:
+      return None
 
-    pialModelNode = parameterNode.GetNodeReference(self.PIAL_MODEL_REFERENCE)
-    if pialModelNode is not None and self.pialPointLocator.GetDataSet() != pialModelNode.GetPolyData():
-        self.pialPointLocator.SetDataSet(pialModelNode.GetPolyData())
-        self.pialPointLocator.BuildLocator()
+    polyData = origModelNode.GetPolyData()
+    if self.origSurfaceGraph is None or self.origSurfaceGraphPolyData != polyData or self.origSurfaceGraphMTime != polyData.GetMTime():
+      self.origSurfaceGraph = NeuroSegmentParcellationSurfaceGraph.fromPolyData(polyData)
+      self.origSurfaceGraphPolyData = polyData
+      self.origSurfaceGraphMTime = polyData.GetMTime()
+      self.curvePathSolvers = {}
+    return self.origSurfaceGraph
+
+  def getCurvePathSolver(self, parameterNode, curveNode):
+    """
+    Return the NeuroSegmentParcellationPathSolver of the curve on the orig surface, using the same weights, penalties and
+    cost function as the curve node. The solver does not use the scene, and can be used from other threads or processes.
+    Each curve keeps its own solver so that the path trees of segments that have not changed are reused.
+    """
+    surfaceGraph = self.getOrigSurfaceGraph(parameterNode)
+    if surfaceGraph is None or not NeuroSegmentParcellationPathSolver.isAvailable():
+      return None
+    pathSolver = self.curvePathSolvers.get(curveNode.GetID())
+    if pathSolver is None:
+      pathSolver = NeuroSegmentParcellationPathSolver(surfaceGraph)
+      self.curvePathSolvers[curveNode.GetID()] = pathSolver
+    pathSolver.setParametersFromCurveNode(curveNode)
+    return pathSolver
+
+  def getCurveControlPointIds(self, parameterNode, curveNode):
+    """
+    :return: List of the closest orig model point id to each control point of the curve
+    """
+    origModelNode = parameterNode.GetNodeReference(self.ORIG_MODEL_REFERENCE)
+    if curveNode.GetNumberOfControlPoints() == 0:
+      return []
+    controlPoints = transformPointsFromWorld(getControlPointPositionsWorld(curveNode), origModelNode)
+    return self.surfaceCorrespondence.findPointIds(origModelNode, controlPoints).tolist()
+
+  def computeCurvePointIds(self, parameterNode, curveNode):
+    """
+    Compute the orig model point ids along the curve without updating the curve node.
+    :return: List of the point ids along the curve, or None if the path could not be computed
+    """
+    pathSolver = self.getCurvePathSolver(parameterNode, curveNode)
+    if pathSolver is None:
+      return None
+    controlPointIds = self.getCurveControlPointIds(parameterNode, curveNode)
+    return pathSolver.findCurvePath(controlPointIds).tolist()
+
+  def benchmarkPathSearchModes(self, parameterNode, curveNodes=None):
+    """
+    Solve each segment of each curve with all of the NeuroSegmentParcellationPathSolver search modes, without using
+    cached paths, and log the number of settled points and the duration of each solve.
+    The DIJKSTRA_SEARCH results are the current behavior, where the complete shortest path tree is computed.
+    :param curveNodes: Curves to benchmark. All of the input curves (ex. from parcellation.qry) are used by default.
+    :return: Dictionary of {curveName: {searchMode: {"numberOfSolves", "numberOfSettledPoints", "time", "pathCost"}}}.
+      The number of settled points and the time are the mean of all segments of the curve, and the path cost is the
+      total cost of the segments.
+    """
+    if curveNodes is None:
+      curveNodes = [node for node in self.getInputMarkupNodes() if node.IsA("vtkMRMLMarkupsFreeSurferCurveNode")]
 
-    inflatedModelNode = parameterNode.GetNodeReference(self.INFLATED_MODEL_REFERENCE)
-    if inflatedModelNode is not None and self.inflatedPointLocator.GetDataSet() != inflatedModelNode.GetPolyData():
-        self.inflatedPointLocator.SetDataSet(inflatedModelNode.GetPolyData())
-        self.inflatedPointLocator.BuildLocator()
+    results = {}
+    for curveNode in curveNodes:
+      if curveNode.GetNumberOfControlPoints() < 2:
+        continue
+      pathSolver = self.getCurvePathSolver(parameterNode, curveNode)
+      if pathSolver is None:
+        return results
+      curveSearchMode = pathSolver.searchMode
+      maximumNumberOfPathTrees = pathSolver.maximumNumberOfPathTrees
+      pathSolver.setMaximumNumberOfPathTrees(0)
+      controlPointIds = self.getCurveControlPointIds(parameterNode, curveNode)
+
+      curveResults = {}
+      for searchMode in pathSolver.SEARCH_MODES:
+        pathSolver.setSearchMode(searchMode)
+        numberOfSolves = len(controlPointIds) - 1
+        numberOfSettledPoints = 0
+        duration = 0.0
+        pathCost = 0.0
+        for i in range(1, len(controlPointIds)):
+          pointIds = pathSolver.findPath(controlPointIds[i-1], controlPointIds[i])
+          numberOfSettledPoints += pathSolver.lastSearchStatistics["numberOfSettledPoints"]
+          duration += pathSolver.lastSearchStatistics["time"]
+          pathCost += pathSolver.getPathCost(pointIds)
+        curveResults[searchMode] = {
+          "numberOfSolves": numberOfSolves,
+          "numberOfSettledPoints": numberOfSettledPoints / numberOfSolves,
+          "time": duration / numberOfSolves,
+          "pathCost": pathCost,
+          }
+        logging.info("%s: %s search settled %d points in %f s per solve (%d solves)", curveNode.GetName(), searchMode,
+          curveResults[searchMode]["numberOfSettledPoints"], curveResults[searchMode]["time"], numberOfSolves)
+
+      pathSolver.setMaximumNumberOfPathTrees(maximumNumberOfPathTrees)
+      pathSolver.setSearchMode(curveSearchMode)
+      results[curveNode.GetName()] = curveResults
+    return results
 
   def removeObservers(self):
     VTKObservationMixin.removeObservers(self)
     self.removeInputMarkupObservers()
+    self.inputModelObservers.removeAll()
+    self.eventScheduler.flush()
+
+  def getEventCounters(self):
+    """
+    Return the number of events received and handled by each of the observers, and the time spent handling them.
+    See NeuroSegmentParcellationEventScheduler.getCounters.
+    """
+    return self.eventScheduler.getCounters()
+
+  def resetEventCounters(self):
+    self.eventScheduler.resetCounters()
+
+  def onMarkupStartInteraction(self, markupNode, eventId=None, callData=None):
+    self.eventScheduler.startInteraction(markupNode)
+
+  def onMarkupEndInteraction(self, markupNode, eventId=None, callData=None):
+    self.eventScheduler.endInteraction(markupNode)
+
+  def getInteractionObservers(self, markupNode):
+    """
+    Observe the start and end of control point and handle interactions, so that the updates are throttled while dragging.
+    """
+    return [
+      (markupNode, slicer.vtkMRMLMarkupsNode.PointStartInteractionEvent, self.onMarkupStartInteraction),
+      (markupNode, slicer.vtkMRMLMarkupsNode.PointEndInteractionEvent, self.onMarkupEndInteraction),
+      ]
 
   def removeInputMarkupObservers(self):
-    for obj, tag in self.inputMarkupObservers:
-      obj.RemoveObserver(tag)
-    self.inputMarkupObservers = []
+    self.inputMarkupObservers.removeAll()
+
+  def getInputMarkupObserverCounts(self):
+    """
+    Return the number of registered markup observers, and the number of observers on nodes that were removed from the scene.
+    See NeuroSegmentParcellationObserverRegistry.getObserverCounts.
+    """
+    return self.inputMarkupObservers.getObserverCounts()
 
   def updateInputMarkupObservers(self, parameterNode):
+    """
+    Update the observers of the input markups, their derived control points, and the seed nodes.
+    Only the observers of nodes that were added or removed since the previous update are changed.
+    """
     if parameterNode is None:
       return
 
+    observers = []
     inputMarkupNodes = self.getInputMarkupNodes()
     for inputMarkupNode in inputMarkupNodes:
       if inputMarkupNode is None:
         continue
       if inputMarkupNode.IsA("vtkMRMLMarkupsCurveNode"):
-        tag = inputMarkupNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointAddedEvent, self.onMasterMarkupModified)
-        self.inputMarkupObservers.append((inputMarkupNode, tag))
-        tag = inputMarkupNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointModifiedEvent, self.onMasterMarkupModified)
-        self.inputMarkupObservers.append((inputMarkupNode, tag))
-        tag = inputMarkupNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointRemovedEvent, self.onMasterMarkupModified)
-        self.inputMarkupObservers.append((inputMarkupNode, tag))
-        tag = inputMarkupNode.AddObserver(slicer.vtkMRMLMarkupsNode.LockModifiedEvent, self.onMarkupLockStateModified)
-        self.inputMarkupObservers.append((inputMarkupNode, tag))
-        tag = inputMarkupNode.AddObserver(slicer.vtkMRMLMarkupsNode.DisplayModifiedEvent, self.onMasterMarkupDisplayModified)
-        self.inputMarkupObservers.append((inputMarkupNode, tag))
+        observers += [
+          (inputMarkupNode, slicer.vtkMRMLMarkupsNode.PointAddedEvent, self.onMasterMarkupModified),
+          (inputMarkupNode, slicer.vtkMRMLMarkupsNode.PointModifiedEvent, self.onMasterMarkupModified),
+          (inputMarkupNode, slicer.vtkMRMLMarkupsNode.PointRemovedEvent, self.onMasterMarkupModified),
+          (inputMarkupNode, slicer.vtkMRMLMarkupsNode.LockModifiedEvent, self.onMarkupLockStateModified),
+          (inputMarkupNode, slicer.vtkMRMLMarkupsNode.DisplayModifiedEvent, self.onMasterMarkupDisplayModified),
+          ]
+        observers += self.getInteractionObservers(inputMarkupNode)
         inputMarkupNode.SetAttribute(self.NODE_TYPE_ATTRIBUTE_NAME, self.ORIG_NODE_ATTRIBUTE_VALUE)
         self.onMarkupLockStateModified(inputMarkupNode)
 
       if inputMarkupNode.IsA("vtkMRMLMarkupsPlaneNode"):
-        tag = inputMarkupNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointModifiedEvent, self.onPlaneNodeModified)
-        self.inputMarkupObservers.append((inputMarkupNode, tag))
-        tag = inputMarkupNode.AddObserver(slicer.vtkMRMLMarkupsNode.DisplayModifiedEvent, self.onPlaneDisplayModified)
-        self.inputMarkupObservers.append((inputMarkupNode, tag))
+        observers += [
+          (inputMarkupNode, slicer.vtkMRMLMarkupsNode.PointModifiedEvent, self.onPlaneNodeModified),
+          (inputMarkupNode, slicer.vtkMRMLMarkupsNode.DisplayModifiedEvent, self.onPlaneDisplayModified),
+          ]
+        observers += self.getInteractionObservers(inputMarkupNode)
         inputMarkupNode.SetAttribute(self.NODE_TYPE_ATTRIBUTE_NAME, self.ORIG_NODE_ATTRIBUTE_VALUE)
 
-      pialControlPoints = self.getDerivedControlPointsNode(inputMarkupNode, self.PIAL_NODE_ATTRIBUTE_VALUE)
-      if pialControlPoints:
-        tag = pialControlPoints.AddObserver(slicer.vtkMRMLMarkupsNode.PointModifiedEvent, self.onDerivedControlPointsModified)
-        self.inputMarkupObservers.append((pialControlPoints, tag))
-        tag = pialControlPoints.AddObserver(slicer.vtkMRMLMarkupsNode.PointRemovedEvent, self.onDerivedControlPointsModified)
-        self.inputMarkupObservers.append((pialControlPoints, tag))
-
-      inflatedControlPoints = self.getDerivedControlPointsNode(inputMarkupNode, self.INFLATED_NODE_ATTRIBUTE_VALUE)
-      if inflatedControlPoints:
-        tag = inflatedControlPoints.AddObserver(slicer.vtkMRMLMarkupsNode.PointModifiedEvent, self.onDerivedControlPointsModified)
-        self.inputMarkupObservers.append((inflatedControlPoints, tag))
-        tag = inflatedControlPoints.AddObserver(slicer.vtkMRMLMarkupsNode.PointRemovedEvent, self.onDerivedControlPointsModified)
-        self.inputMarkupObservers.append((inflatedControlPoints, tag))
+      for nodeType in [self.PIAL_NODE_ATTRIBUTE_VALUE, self.INFLATED_NODE_ATTRIBUTE_VALUE]:
+        derivedControlPoints = self.getDerivedControlPointsNode(inputMarkupNode, nodeType)
+        if derivedControlPoints:
+          observers += [
+            (derivedControlPoints, slicer.vtkMRMLMarkupsNode.PointModifiedEvent, self.onDerivedControlPointsModified),
+            (derivedControlPoints, slicer.vtkMRMLMarkupsNode.PointRemovedEvent, self.onDerivedControlPointsModified),
+            ]
+          observers += self.getInteractionObservers(derivedControlPoints)
 
     toolNodes = self.getToolNodes()
     for toolNode in toolNodes:
       seedNode = self.getInputSeedNode(toolNode)
       if seedNode is None:
         continue
-      tag = seedNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointModifiedEvent, self.onSeedNodeModified)
-      self.inputMarkupObservers.append((seedNode, tag))
-      tag = seedNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointRemovedEvent, self.onSeedRemoved)
-      self.inputMarkupObservers.append((seedNode, tag))
+      observers += [
+        (seedNode, slicer.vtkMRMLMarkupsNode.PointModifiedEvent, self.onSeedNodeModified),
+        (seedNode, slicer.vtkMRMLMarkupsNode.PointRemovedEvent, self.onSeedRemoved),
+        ]
+
+    self.inputMarkupObservers.update(observers)
 
   def updateInputMarkupDisplay(self, parameterNode):
     if parameterNode is None:
@@ -341,70 +612,67 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
   def onMasterMarkupModified(self, inputMarkupNode, eventId=None, callData=None):
     if self.updatingFromMasterMarkup or self.parameterNode is None:
       return
+    self.eventScheduler.schedule("onMasterMarkupModified", inputMarkupNode, self.updateFromMasterMarkup,
+      inputMarkupNode, not self.updatingFromDerivedMarkup)
+
+  def updateFromMasterMarkup(self, inputMarkupNode, updateDerivedControlPoints=True):
+    """
+    Update the derived curves and control points on the pial and inflated surfaces from the orig markup.
+    :param updateDerivedControlPoints: If False, only the derived curves are updated
+    """
+    if self.parameterNode is None:
+      return
 
-    origModel = self.parameterNode.GetNodeReference(self.PIAL_MODEL_REFERENCE)
-    if origModel is None:
+    origModel = self.parameterNode.GetNodeReference(self.ORIG_MODEL_REFERENCE)
+    if origModel is None or origModel.GetPolyData() is None or origModel.GetPolyData().GetPoints() is None:
       return
 
     curvePoints = inputMarkupNode.GetCurve().GetPoints()
-    if self.origPointLocator.GetDataSet() is None or curvePoints is None:
+    if curvePoints is None:
       return
 
     wasUpdatingFromMasterMarkup = self.updatingFromMasterMarkup
     self.updatingFromMasterMarkup = True
 
-    pointIds = []
-    for i in range(curvePoints.GetNumberOfPoints()):
-      origPointLocal = list(curvePoints.GetPoint(i))
-      origModel.TransformPointFromWorld(origPointLocal, origPointLocal)
-      pointIds.append(self.origPointLocator.FindClosestPoint(origPointLocal))
-
-    pialMarkup = self.getDerivedCurveNode(inputMarkupNode, self.PIAL_NODE_ATTRIBUTE_VALUE)
-    if pialMarkup:
-      with slicer.util.NodeModify(pialMarkup):
-        pialModel = self.parameterNode.GetNodeReference(self.PIAL_MODEL_REFERENCE)
-        if pialModel and pialModel.GetPolyData() and pialModel.GetPolyData().GetPoints():
-          pialPoints = vtk.vtkPoints()
-          pointIndex = 0
-          pialPoints.SetNumberOfPoints(len(pointIds))
-          for pointId in pointIds:
-            pialPoint = list(pialModel.GetPolyData().GetPoints().GetPoint(pointId))
-            pialModel.TransformPointToWorld(pialPoint, pialPoint)
-            pialPoints.SetPoint(pointIndex, pialPoint)
-            pointIndex += 1
-          pialMarkup.SetControlPointPositionsWorld(pialPoints)
-          for pointIndex in range(len(pointIds)):
-            pialMarkup.SetNthControlPointVisibility(pointIndex, False)
-
-    inflatedMarkup = self.getDerivedCurveNode(inputMarkupNode, self.INFLATED_NODE_ATTRIBUTE_VALUE)
-    if inflatedMarkup:
-      with slicer.util.NodeModify(inflatedMarkup):
-        inflatedModel = self.parameterNode.GetNodeReference(self.INFLATED_MODEL_REFERENCE)
-        if inflatedModel and inflatedModel.GetPolyData() and inflatedModel.GetPolyData().GetPoints():
-          inflatedPoints = vtk.vtkPoints()
-          inflatedPoints.SetNumberOfPoints(len(pointIds))
-          pointIndex = 0
-          for pointId in pointIds:
-            inflatedPoint = list(inflatedModel.GetPolyData().GetPoints().GetPoint(pointId))
-            inflatedModel.TransformPointToWorld(inflatedPoint, inflatedPoint)
-            inflatedPoints.SetPoint(pointIndex, inflatedPoint)
-            pointIndex += 1
-          inflatedMarkup.SetControlPointPositionsWorld(inflatedPoints)
-          for pointIndex in range(len(pointIds)):
-            inflatedMarkup.SetNthControlPointVisibility(pointIndex, False)
-
-    if not self.updatingFromDerivedMarkup:
+    # The vertex ids are only searched for when the curve, the orig surface or its transform have been modified
+    origTransformNode = origModel.GetParentTransformNode()
+    curveMTime = (curvePoints.GetMTime(), origModel.GetPolyData().GetPoints().GetMTime(),
+      origTransformNode.GetTransformToWorldMTime() if origTransformNode else 0)
+    getOrigCurvePoints = lambda: transformPointsFromWorld(numpy_support.vtk_to_numpy(curvePoints.GetData()), origModel)
+    pointIds = self.surfaceCorrespondence.getCurvePointIds(inputMarkupNode.GetID(), curveMTime, origModel, getOrigCurvePoints)
+
+    derivedModels = {}
+    for nodeType, modelReference in [
+        (self.PIAL_NODE_ATTRIBUTE_VALUE, self.PIAL_MODEL_REFERENCE),
+        (self.INFLATED_NODE_ATTRIBUTE_VALUE, self.INFLATED_MODEL_REFERENCE)]:
+      derivedModel = self.parameterNode.GetNodeReference(modelReference)
+      derivedModels[nodeType] = derivedModel
+      derivedMarkup = self.getDerivedCurveNode(inputMarkupNode, nodeType)
+      if derivedMarkup is None or derivedModel is None or derivedModel.GetPolyData() is None:
+        continue
+      derivedPoints = self.surfaceCorrespondence.getCorrespondingPoints(derivedModel.GetPolyData(), pointIds)
+      if derivedPoints is None:
+        logging.error("NeuroSegmentParcellationLogic: " + derivedModel.GetName() + " does not have the same points as the orig model")
+        continue
+      with slicer.util.NodeModify(derivedMarkup):
+        derivedMarkup.SetControlPointPositionsWorld(createPoints(transformPointsToWorld(derivedPoints, derivedModel)))
+        for pointIndex in range(len(pointIds)):
+          derivedMarkup.SetNthControlPointVisibility(pointIndex, False)
+    pialModel = derivedModels[self.PIAL_NODE_ATTRIBUTE_VALUE]
+    inflatedModel = derivedModels[self.INFLATED_NODE_ATTRIBUTE_VALUE]
+
+    if updateDerivedControlPoints:
       pialControlPoints = self.getDerivedControlPointsNode(inputMarkupNode, self.PIAL_NODE_ATTRIBUTE_VALUE)
       if pialControlPoints is None:
         logging.error("Could not find inflated markup!")
       else:
-        self.copyControlPoints(inputMarkupNode, origModel, self.origPointLocator, pialControlPoints, pialModel)
+        self.copyControlPoints(inputMarkupNode, origModel, pialControlPoints, pialModel)
 
       inflatedControlPoints = self.getDerivedControlPointsNode(inputMarkupNode, self.INFLATED_NODE_ATTRIBUTE_VALUE)
       if inflatedControlPoints is None:
         logging.error("Could not find inflated markup!")
       else:
-        self.copyControlPoints(inputMarkupNode, origModel, self.origPointLocator, inflatedControlPoints, inflatedModel)
+        self.copyControlPoints(inputMarkupNode, origModel, inflatedControlPoints, inflatedModel)
 
     self.updatingFromMasterMarkup = wasUpdatingFromMasterMarkup
 
@@ -429,40 +697,62 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
       self.updateRelativeSeedNode(seedNode)
 
   def snapSeedsToSurface(self, seedNode):
-    dataSet = self.origPointLocator.GetDataSet()
-    if dataSet is None:
+    """
+    Move each seed point to the closest point of the orig model.
+    """
+    origModel = self.parameterNode.GetNodeReference(self.ORIG_MODEL_REFERENCE) if self.parameterNode else None
+    if origModel is None or origModel.GetPolyData() is None or origModel.GetPolyData().GetNumberOfPoints() == 0:
       return
-    for i in range(seedNode.GetNumberOfControlPoints()):
-      controlPoint = [0.0, 0.0, 0.0]
-      seedNode.GetNthControlPointPosition(i, controlPoint)
-      pointId = self.origPointLocator.FindClosestPoint(controlPoint)
-      dataSet.GetPoint(pointId, controlPoint)
-      seedNode.SetNthControlPointPosition(i, controlPoint[0], controlPoint[1], controlPoint[2])
+    if seedNode.GetNumberOfControlPoints() == 0:
+      return
+
+    seedPoints = transformPointsFromWorld(getControlPointPositionsWorld(seedNode), origModel)
+    pointIds = self.surfaceCorrespondence.findPointIds(origModel, seedPoints)
+    snappedPoints_World = transformPointsToWorld(self.surfaceCorrespondence.getCorrespondingPoints(origModel.GetPolyData(), pointIds), origModel)
+    for i, snappedPoint_World in enumerate(snappedPoints_World):
+      seedNode.SetNthControlPointPositionWorld(i, snappedPoint_World[0], snappedPoint_World[1], snappedPoint_World[2])
 
-  def copyControlPoints(self, sourceMarkup, sourceModel, sourceLocator, destinationMarkup, destinationModel, copyUndefinedControlPoints=True):
+  def copyControlPoints(self, sourceMarkup, sourceModel, destinationMarkup, destinationModel, copyUndefinedControlPoints=True):
     if sourceMarkup is None or sourceModel is None or destinationMarkup is None or destinationModel is None:
       return
+    if sourceModel.GetPolyData() is None or sourceModel.GetPolyData().GetNumberOfPoints() == 0:
+      return
     if destinationModel and destinationModel.GetPolyData() and destinationModel.GetPolyData().GetPoints():
       with slicer.util.NodeModify(destinationModel):
-        destinationControlPoints_World = vtk.vtkPoints()
-        destinationControlPoints_World.SetNumberOfPoints(sourceMarkup.GetNumberOfControlPoints())
+        numberOfControlPoints = sourceMarkup.GetNumberOfControlPoints()
         destinationMarkup.RemoveAllControlPoints()
-        for i in range(sourceMarkup.GetNumberOfControlPoints()):
-          if not copyUndefinedControlPoints and sourceMarkup.GetNthControlPointPositionStatus(i) != sourceMarkup.PositionDefined:
-            continue
-          sourcePoint = [0,0,0]
-          sourceMarkup.GetNthControlPointPositionWorld(i, sourcePoint)
-          sourceModel.TransformPointFromWorld(sourcePoint, sourcePoint)
-          pointId = sourceLocator.FindClosestPoint(sourcePoint)
-          destinationPoint_World = list(destinationModel.GetPolyData().GetPoints().GetPoint(pointId))
-          destinationModel.TransformPointToWorld(destinationPoint_World, destinationPoint_World)
-
-          destinationControlPoints_World.SetPoint(i, destinationPoint_World)
-        destinationMarkup.SetControlPointPositionsWorld(destinationControlPoints_World)
+        if numberOfControlPoints == 0:
+          return
+
+        copiedIndices = np.arange(numberOfControlPoints)
+        if not copyUndefinedControlPoints:
+          copiedIndices = np.array([i for i in range(numberOfControlPoints)
+            if sourceMarkup.GetNthControlPointPositionStatus(i) == sourceMarkup.PositionDefined], dtype=np.int64)
+
+        # Control points that are not copied are left at the origin
+        destinationControlPoints_World = np.zeros((numberOfControlPoints, 3))
+        if len(copiedIndices) > 0:
+          sourcePoints = transformPointsFromWorld(getControlPointPositionsWorld(sourceMarkup)[copiedIndices], sourceModel)
+          pointIds = self.surfaceCorrespondence.findPointIds(sourceModel, sourcePoints)
+          destinationPoints = self.surfaceCorrespondence.getCorrespondingPoints(destinationModel.GetPolyData(), pointIds)
+          if destinationPoints is None:
+            logging.error("NeuroSegmentParcellationLogic: " + destinationModel.GetName() + " does not have the same points as " + sourceModel.GetName())
+            return
+          destinationControlPoints_World[copiedIndices] = transformPointsToWorld(destinationPoints, destinationModel)
+        destinationMarkup.SetControlPointPositionsWorld(createPoints(destinationControlPoints_World))
 
   def onDerivedControlPointsModified(self, derivedMarkupNode, eventId=None, node=None):
     if self.updatingFromMasterMarkup or self.updatingFromDerivedMarkup:
       return
+    self.eventScheduler.schedule("onDerivedControlPointsModified", derivedMarkupNode, self.updateFromDerivedControlPoints,
+      derivedMarkupNode)
+
+  def updateFromDerivedControlPoints(self, derivedMarkupNode):
+    """
+    Copy the control points of a pial or inflated control point node to the orig markup and to the other derived node.
+    """
+    if self.parameterNode is None:
+      return
 
     try:
       slicer.app.pauseRender()
@@ -471,23 +761,20 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
       origMarkup = derivedMarkupNode.GetNodeReference("OrigMarkup")
       origModel = self.parameterNode.GetNodeReference(self.ORIG_MODEL_REFERENCE)
       nodeType = derivedMarkupNode.GetAttribute(self.NODE_TYPE_ATTRIBUTE_NAME)
-      locator = None
       derivedModelNode = None
       otherMarkupNode = None
       otherModelNode = None
       if nodeType == self.PIAL_NODE_ATTRIBUTE_VALUE:
-        locator = self.pialPointLocator
         derivedModelNode = self.parameterNode.GetNodeReference(self.PIAL_MODEL_REFERENCE)
 
         otherMarkupNode = self.getDerivedControlPointsNode(origMarkup, self.INFLATED_NODE_ATTRIBUTE_VALUE)
         otherModelNode = self.parameterNode.GetNodeReference(self.INFLATED_MODEL_REFERENCE)
       elif nodeType == self.INFLATED_NODE_ATTRIBUTE_VALUE:
-        locator = self.inflatedPointLocator
         derivedModelNode = self.parameterNode.GetNodeReference(self.INFLATED_MODEL_REFERENCE)
 
         otherMarkupNode = self.getDerivedControlPointsNode(origMarkup, self.PIAL_NODE_ATTRIBUTE_VALUE)
         otherModelNode = self.parameterNode.GetNodeReference(self.PIAL_MODEL_REFERENCE)
-      if locator == None or derivedModelNode == None:
+      if derivedModelNode == None:
         self.updatingFromDerivedMarkup = False
         return
 
@@ -495,8 +782,8 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
       interactionNode = slicer.mrmlScene.GetNodeByID("vtkMRMLInteractionNodeSingleton")
       if interactionNode:
         copyUndefinedControlPoints = (interactionNode.GetCurrentInteractionMode() == interactionNode.Place)
-      self.copyControlPoints(derivedMarkupNode, derivedModelNode, locator, origMarkup, origModel, copyUndefinedControlPoints)
-      self.copyControlPoints(derivedMarkupNode, derivedModelNode, locator, otherMarkupNode, otherModelNode, copyUndefinedControlPoints)
+      self.copyControlPoints(derivedMarkupNode, derivedModelNode, origMarkup, origModel, copyUndefinedControlPoints)
+      self.copyControlPoints(derivedMarkupNode, derivedModelNode, otherMarkupNode, otherModelNode, copyUndefinedControlPoints)
       self.updatingFromDerivedMarkup = False
 
     finally:
@@ -896,13 +1183,13 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
       logging.error("setMarkupProjectionEnabled: Invalid parameter node")
       return
 
-    parameterNode.SetParameter("MarkupProjectionVisibility", "TRUE" if visible else "FALSE")
+    parameterNode.SetParameter(self.MARKUP_PROJECTION_VISIBILITY_NAME, "TRUE" if visible else "FALSE")
 
   def getMarkupProjectionEnabled(self, parameterNode):
     if parameterNode is None:
       logging.error("setMarkupProjectionEnabled: Invalid parameter node")
       return False
-    return True if parameterNode.GetParameter("MarkupProjectionVisibility") == "TRUE" else False
+    return True if parameterNode.GetParameter(self.MARKUP_PROJECTION_VISIBILITY_NAME) == "TRUE" else False
 
   def runDynamicModelerTool(self, toolNode):
     if toolNode is None:
@@ -1001,27 +1288,58 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
 
     polyData = origModelNode.GetPolyData()
 
-    cellData = polyData.GetCellData()
-    cellPedigreeArray = cellData.GetArray("cellPedigree")
-    if cellPedigreeArray is None:
-      cellPedigreeIds = vtk.vtkIdTypeArray()
-      cellPedigreeIds.SetName("cellPedigree")
-      cellPedigreeIds.SetNumberOfValues(polyData.GetNumberOfCells())
-      for i in range(polyData.GetNumberOfCells()):
-        cellPedigreeIds.SetValue(i, i)
-      origModelNode.AddCellScalars(cellPedigreeIds)
+    cellPedigreeArray = polyData.GetCellData().GetArray("cellPedigree")
+    if not self.isPedigreeIdArrayValid(cellPedigreeArray, polyData.GetNumberOfCells()):
+      origModelNode.AddCellScalars(self.createPedigreeIdArray("cellPedigree", polyData.GetNumberOfCells()))
 
-    pointData = polyData.GetPointData()
-    pointPedigreeArray = pointData.GetArray("pointPedigree")
-    if pointPedigreeArray  is None:
-      pointPedigreeIds = vtk.vtkIdTypeArray()
-      pointPedigreeIds.SetName("pointPedigree")
-      pointPedigreeIds.SetNumberOfValues(polyData.GetNumberOfPoints())
-      for i in range(polyData.GetNumberOfPoints()):
-        pointPedigreeIds.SetValue(i, i)
-      origModelNode.AddPointScalars(pointPedigreeIds)
-
-  def exportOutputToSurfaceLabel(self, parameterNode, surfacesToExport=[]):
+    pointPedigreeArray = polyData.GetPointData().GetArray("pointPedigree")
+    if not self.isPedigreeIdArrayValid(pointPedigreeArray, polyData.GetNumberOfPoints()):
+      origModelNode.AddPointScalars(self.createPedigreeIdArray("pointPedigree", polyData.GetNumberOfPoints()))
+
+  def getPedigreeIdDataType(self, numberOfValues):
+    """
+    Pedigree ids are stored as 32-bit integers, unless there are too many points or cells to be indexed by a 32-bit integer.
+    :return: Tuple of the NumPy and VTK data types
+    """
+    if numberOfValues <= np.iinfo(np.int32).max:
+      return np.int32, vtk.VTK_INT
+    return numpy_support.ID_TYPE_CODE, vtk.VTK_ID_TYPE
+
+  def isPedigreeIdArrayValid(self, pedigreeArray, numberOfValues):
+    """
+    Check if an existing pedigree id array can be reused.
+    The array must have one value for each point or cell, and use the compact data type from getPedigreeIdDataType,
+    so that 64-bit arrays from older scenes are replaced. Arrays created by createPedigreeIdArray must also be unmodified.
+    """
+    if pedigreeArray is None or pedigreeArray.GetNumberOfTuples() != numberOfValues:
+      return False
+    if pedigreeArray.GetDataType() != self.getPedigreeIdDataType(numberOfValues)[1]:
+      return False
+    createdArray, createdMTime = self.pedigreeIdArrays.get(pedigreeArray.GetName(), (None, 0))
+    if createdArray is pedigreeArray and pedigreeArray.GetMTime() != createdMTime:
+      return False
+    return True
+
+  def createPedigreeIdArray(self, name, numberOfValues):
+    """
+    Create an id array containing the values [0, numberOfValues).
+    The values are generated by NumPy, and the VTK array references the NumPy buffer without copying.
+    """
+    numpyType, vtkType = self.getPedigreeIdDataType(numberOfValues)
+    pedigreeIds = np.arange(numberOfValues, dtype=numpyType)
+    pedigreeArray = numpy_support.numpy_to_vtk(pedigreeIds, deep=False, array_type=vtkType)
+    pedigreeArray.SetName(name)
+    self.pedigreeIdArrays[name] = (pedigreeArray, pedigreeArray.GetMTime())
+    return pedigreeArray
+
+  def exportOutputToSurfaceLabel(self, parameterNode, surfacesToExport=[], incremental=False):
+    """
+    Write the "labels" cell array of the orig, pial and inflated surfaces. Each cell is labelled with the index (starting from 1)
+    of the output model that contains it, or 0 if it is not in any of the exported output models.
+    :param surfacesToExport: Names of the output models that are exported. All output models are exported if empty.
+    :param incremental: If True, only the cells of output models that were modified since the previous export are rewritten.
+      A full export is done if the labels of the previous export cannot be reused.
+    """
     logging.debug("Starting export to surface label")
 
     origSurfaceNode = parameterNode.GetNodeReference(self.ORIG_MODEL_REFERENCE)
@@ -1035,33 +1353,64 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
 
     cellCount = origSurfaceNode.GetPolyData().GetNumberOfCells()
     labelArray = origSurfaceNode.GetPolyData().GetCellData().GetArray("labels")
-    if labelArray is None:
+    if labelArray is None or labelArray.GetNumberOfTuples() != cellCount:
       labelArray = vtk.vtkIntArray()
       labelArray.SetName("labels")
       labelArray.SetNumberOfComponents(1)
       labelArray.SetNumberOfTuples(cellCount)
-    labelArray.Fill(0)
+      labelArray.Fill(0)
+    labels = numpy_support.vtk_to_numpy(labelArray)
 
+    previousExport = self.surfaceLabelExport
+    modelKeys = []
+    modelCellIds = []
     numberOfOutputModels = parameterNode.GetNumberOfNodeReferences(self.OUTPUT_MODEL_REFERENCE)
     for modelIndex in range(numberOfOutputModels):
       outputSurfaceNode = parameterNode.GetNthNodeReference(self.OUTPUT_MODEL_REFERENCE, modelIndex)
-      if outputSurfaceNode and len(surfacesToExport) != 0 and not outputSurfaceNode.GetName() in surfacesToExport:
-        continue
-
-      polyData = outputSurfaceNode.GetPolyData()
-      if polyData is None:
-        logging.debug(str(outputSurfaceNode.GetName()) + " polydata is empty")
-        continue
-
-      cellData = polyData.GetCellData()
-      cellPedigreeArray = cellData.GetArray("cellPedigree")
-      if cellPedigreeArray is None:
-        logging.debug(str(outputSurfaceNode.GetName()) + " cell pedigree is missing")
-        continue
-
-      for cellIndex in range(cellPedigreeArray.GetNumberOfValues()):
-        cellId = cellPedigreeArray.GetValue(cellIndex)
-        labelArray.SetValue(cellId, modelIndex+1)
+      exported = outputSurfaceNode is not None and (len(surfacesToExport) == 0 or outputSurfaceNode.GetName() in surfacesToExport)
+      polyData = outputSurfaceNode.GetPolyData() if exported else None
+      modelKey = (outputSurfaceNode.GetID() if outputSurfaceNode else None, exported, polyData.GetMTime() if polyData else None)
+      modelKeys.append(modelKey)
+
+      if incremental and previousExport is not None and modelIndex < len(previousExport["modelKeys"]) and \
+          previousExport["modelKeys"][modelIndex] == modelKey:
+        modelCellIds.append(previousExport["modelCellIds"][modelIndex])
+      elif not exported:
+        modelCellIds.append(np.zeros(0, dtype=np.int64))
+      else:
+        modelCellIds.append(self.getSurfaceLabelCellIds(outputSurfaceNode, cellCount))
+
+    if (incremental and previousExport is not None and previousExport["labelArray"] is labelArray
+        and previousExport["labelArrayMTime"] == labelArray.GetMTime()):
+      # Only the cells that were or are now contained in a modified output model need to be relabelled
+      numberOfPreviousModels = len(previousExport["modelKeys"])
+      changedCellIds = [previousExport["modelCellIds"][modelIndex] for modelIndex in range(numberOfOutputModels, numberOfPreviousModels)]
+      for modelIndex in range(numberOfOutputModels):
+        if modelIndex < numberOfPreviousModels and previousExport["modelKeys"][modelIndex] == modelKeys[modelIndex]:
+          continue
+        changedCellIds.append(modelCellIds[modelIndex])
+        if modelIndex < numberOfPreviousModels:
+          changedCellIds.append(previousExport["modelCellIds"][modelIndex])
+
+      if len(changedCellIds) > 0:
+        changedCells = np.zeros(cellCount, dtype=bool)
+        for cellIds in changedCellIds:
+          changedCells[cellIds] = True
+        labels[changedCells] = 0
+        for modelIndex, cellIds in enumerate(modelCellIds):
+          labels[cellIds[changedCells[cellIds]]] = modelIndex+1
+    else:
+      labels.fill(0)
+      for modelIndex, cellIds in enumerate(modelCellIds):
+        labels[cellIds] = modelIndex+1
+    labelArray.Modified()
+
+    self.surfaceLabelExport = {
+      "labelArray": labelArray,
+      "labelArrayMTime": labelArray.GetMTime(),
+      "modelKeys": modelKeys,
+      "modelCellIds": modelCellIds,
+      }
 
     origSurfaceNode.GetPolyData().GetCellData().AddArray(labelArray)
     if pialSurfaceNode:
@@ -1078,6 +1427,24 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
     if labelOutlineNode and labelOutlineNode.GetDisplayVisibility():
       self.updateLabelOutlinePolyData()
 
+  def getSurfaceLabelCellIds(self, outputSurfaceNode, cellCount):
+    """
+    Return the orig surface cell ids that are contained in an output model, from its cell pedigree ids.
+    :return: NumPy array of cell ids. Empty if the output model has no polydata or cell pedigree ids.
+    """
+    polyData = outputSurfaceNode.GetPolyData()
+    if polyData is None:
+      logging.debug(str(outputSurfaceNode.GetName()) + " polydata is empty")
+      return np.zeros(0, dtype=np.int64)
+
+    cellPedigreeArray = polyData.GetCellData().GetArray("cellPedigree")
+    if cellPedigreeArray is None:
+      logging.debug(str(outputSurfaceNode.GetName()) + " cell pedigree is missing")
+      return np.zeros(0, dtype=np.int64)
+
+    cellIds = numpy_support.vtk_to_numpy(cellPedigreeArray).astype(np.int64)
+    return cellIds[(cellIds >= 0) & (cellIds < cellCount)]
+
   def getParcellationColorNode(self):
     parcellationColorNode = self.parameterNode.GetNodeReference("ParcellationColorNode")
     if parcellationColorNode is None:
@@ -1456,7 +1823,7 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
     return intersectionNodes
 
   def onPlaneNodeModified(self, planeNode, eventId=None, callData=None):
-    self.updatePlaneIntersection(self.parameterNode, planeNode)
+    self.eventScheduler.schedule("onPlaneNodeModified", planeNode, self.updatePlaneIntersection, self.parameterNode, planeNode)
 
   def onPlaneDisplayModified(self, planeNode, eventId=None, callData=None):
     self.updatePlaneIntersectionDisplay(planeNode)
@@ -1483,16 +1850,10 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
     origIntersectionPolyData = vtk.vtkPolyData()
     if planeNode.GetNumberOfControlPoints() >= 3:
 
-      self.initializePedigreeIds(parameterNode)
-
-      transformFilter = vtk.vtkTransformPolyDataFilter()
-      transformFilter.SetInputData(origModelNode.GetPolyData())
-      modelToWorldTransform = vtk.vtkGeneralTransform()
-      slicer.vtkMRMLTransformNode.GetTransformBetweenNodes(origModelNode.GetParentTransformNode(), None, modelToWorldTransform);
-      transformFilter.SetTransform(modelToWorldTransform)
-
+      # The world space orig surface and its point pedigree ids are cached, so that they are not recomputed
+      # every time that a plane is moved
       planeExtractor = vtk.vtkExtractPolyDataGeometry()
-      planeExtractor.SetInputConnection(transformFilter.GetOutputPort())
+      planeExtractor.SetInputData(self.worldSurfaceCache.getPointPedigreePolyData(origModelNode))
       planeExtractor.ExtractInsideOff()
       planeExtractor.ExtractBoundaryCellsOff()
 
@@ -1566,19 +1927,11 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
       logging.error("Could not find orig polydata")
       return
 
-    # Iterate through all of the lines and find the corresponding pedigree point ids for the original surface.
+    # Find the corresponding pedigree point ids for the original surface for all of the line points at once.
     # Restore the original point ids to the line cells.
-    newLines = vtk.vtkCellArray()
-    oldLines = polyData.GetLines()
-    oldLine = vtk.vtkIdList()
-    polyData.GetLines().InitTraversal()
-    while(polyData.GetLines().GetNextCell(oldLine)):
-      newLine = vtk.vtkIdList()
-      for pointIndex in range(oldLine.GetNumberOfIds()):
-        oldPointId = oldLine.GetId(pointIndex)
-        newPointId = pedigreeArray.GetValue(oldPointId)
-        newLine.InsertNextId(newPointId)
-      newLines.InsertNextCell(newLine)
+    connectivity, offsets = NeuroSegmentParcellationSurfaceGraph.getCellArrayConnectivity(polyData.GetLines())
+    pedigreeIds = numpy_support.vtk_to_numpy(pedigreeArray)
+    newLines = NeuroSegmentParcellationSurfaceGraph.createCellArray(pedigreeIds[connectivity], offsets)
     polyData.Initialize()
     polyData.SetPoints(origModelNode.GetPolyData().GetPoints())
     polyData.SetLines(newLines)
@@ -1589,39 +1942,66 @@ class NeuroSegmentParcellationLogic(ScriptedLoadableModuleLogic, VTKObservationM
     Uses the "label" overlay from FreeSurfer (3 inside, 1000 outside)
     Replaces the contents of the destination node polydata
     """
-    if overlayModelNode and overlayModelNode.GetPolyData() and overlayModelNode.GetPolyData().GetPointData():
-      importArray = overlayModelNode.GetPolyData().GetPointData().GetArray(importOverlay)
-    if importArray is None:
-      logging.error("convertOverlayToModelNode: Could not find array " + str(importOverlay))
+    self.convertOverlaysToModelNodes(overlayModelNode, [(importOverlay, destinationNode)])
+
+  def convertOverlaysToModelNodes(self, overlayModelNode, overlayDestinations):
+    """
+    Convert several scalar overlays from a model node to model nodes (see convertOverlayToModelNode).
+    The polygon connectivity of the overlay model is only read once.
+    :param overlayModelNode: Model node containing the overlays as point data arrays
+    :param overlayDestinations: List of (overlay array name, destination model node)
+    """
+    if overlayModelNode is None or overlayModelNode.GetPolyData() is None or overlayModelNode.GetPolyData().GetPointData() is None:
+      logging.error("convertOverlaysToModelNodes: Invalid overlay model")
       return
 
     freeSurferInsideLabelValue = 3
 
     overlayModel = overlayModelNode.GetPolyData()
-    cellIds = vtk.vtkIdList()
-    for cellId in range(overlayModel.GetNumberOfPolys()):
-      pointIds = vtk.vtkIdList()
-      overlayModel.GetCellPoints(cellId, pointIds)
-      includedCell = True
-      for pointIndex in range(pointIds.GetNumberOfIds()):
-        pointId = pointIds.GetId(pointIndex)
-        labelValue = importArray.GetValue(pointId)
-        if labelValue != freeSurferInsideLabelValue:
-          includedCell = False
-          break
-
-      if includedCell:
-        cellIds.InsertNextId(cellId)
-
-    extractCells = vtk.vtkExtractCells()
-    extractCells.SetInputData(overlayModel)
-    extractCells.SetCellList(cellIds)
-    geometryFilter = vtk.vtkGeometryFilter()
-    geometryFilter.SetInputConnection(extractCells.GetOutputPort())
-    geometryFilter.Update()
-    destinationPolyData = geometryFilter.GetOutput()
-
-    cleanFilter = vtk.vtkCleanPolyData()
-    cleanFilter.SetInputData(destinationPolyData)
-    cleanFilter.Update()
-    destinationNode.SetAndObservePolyData(cleanFilter.GetOutput())
+    connectivity, offsets = NeuroSegmentParcellationSurfaceGraph.getPolygonConnectivity(overlayModel)
+    # Polygons are stored after the vertices and lines in the polydata cell ids
+    firstPolygonCellId = overlayModel.GetNumberOfVerts() + overlayModel.GetNumberOfLines()
+
+    maskArrayName = "OverlayMask"
+    maskPolyData = vtk.vtkPolyData()
+    maskPolyData.ShallowCopy(overlayModel)
+
+    for importOverlay, destinationNode in overlayDestinations:
+      importArray = overlayModel.GetPointData().GetArray(importOverlay)
+      if importArray is None:
+        logging.error("convertOverlaysToModelNodes: Could not find array " + str(importOverlay))
+        continue
+
+      # A polygon is included if all of its points are inside the label.
+      # The number of outside points in each polygon is the difference of the cumulative count at the polygon offsets.
+      outsidePoints = numpy_support.vtk_to_numpy(importArray).reshape(importArray.GetNumberOfTuples(), -1)[:, 0] != freeSurferInsideLabelValue
+      outsideCount = np.zeros(len(connectivity)+1, dtype=np.int64)
+      np.cumsum(outsidePoints[connectivity], out=outsideCount[1:])
+      includedPolygons = outsideCount[offsets[1:]] == outsideCount[offsets[:-1]]
+
+      cellMask = np.zeros(overlayModel.GetNumberOfCells(), dtype=np.uint8)
+      cellMask[firstPolygonCellId:firstPolygonCellId+len(includedPolygons)] = includedPolygons
+      maskArray = numpy_support.numpy_to_vtk(cellMask, deep=True, array_type=vtk.VTK_UNSIGNED_CHAR)
+      maskArray.SetName(maskArrayName)
+      maskPolyData.GetCellData().AddArray(maskArray)
+
+      thresholdFilter = vtk.vtkThreshold()
+      thresholdFilter.SetInputData(maskPolyData)
+      thresholdFilter.SetInputArrayToProcess(0, 0, 0, vtk.vtkDataObject.FIELD_ASSOCIATION_CELLS, maskArrayName)
+      if hasattr(thresholdFilter, "SetThresholdFunction"):
+        # VTK 9.1 and later
+        thresholdFilter.SetThresholdFunction(vtk.vtkThreshold.THRESHOLD_BETWEEN)
+        thresholdFilter.SetLowerThreshold(1)
+        thresholdFilter.SetUpperThreshold(1)
+      else:
+        thresholdFilter.ThresholdBetween(1, 1)
+      geometryFilter = vtk.vtkGeometryFilter()
+      geometryFilter.SetInputConnection(thresholdFilter.GetOutputPort())
+      geometryFilter.Update()
+      destinationPolyData = geometryFilter.GetOutput()
+      destinationPolyData.GetCellData().RemoveArray(maskArrayName)
+
+      cleanFilter = vtk.vtkCleanPolyData()
+      cleanFilter.SetInputData(destinationPolyData)
+      cleanFilter.Update()
+      destinationNode.SetAndObservePolyData(cleanFilter.GetOutput())
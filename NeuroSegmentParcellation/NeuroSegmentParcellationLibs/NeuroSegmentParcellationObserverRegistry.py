@@ -0,0 +1,102 @@
+import logging
+import collections
+
+class NeuroSegmentParcellationObserverRegistry(object):
+  """
+  Keyed registry of VTK observers, with one entry for each (node, event, callback).
+  The observers are updated by passing the complete list of observers that should exist to update, which only adds
+  and removes the difference from the currently registered observers.
+  Events can be temporarily ignored using blockEvents, without removing the observers.
+  """
+
+  def __init__(self):
+    # (node key, event, callback) -> (node, observer tag)
+    self.observers = {}
+    self.blockCount = 0
+    self.numberOfAddedObservers = 0
+    self.numberOfRemovedObservers = 0
+
+  def __len__(self):
+    return len(self.observers)
+
+  @staticmethod
+  def getNodeKey(node):
+    return node.GetID() if node.GetID() else id(node)
+
+  def createEventCallback(self, callback):
+    def onEvent(caller, eventId):
+      if self.blockCount > 0:
+        return
+      callback(caller, eventId)
+    return onEvent
+
+  def update(self, desiredObservers):
+    """
+    Add and remove observers so that exactly the desired observers are registered.
+    :param desiredObservers: List of (node, event, callback)
+    :return: Tuple of the number of added and removed observers
+    """
+    desiredKeys = collections.OrderedDict()
+    for node, event, callback in desiredObservers:
+      if node is None:
+        continue
+      desiredKeys[(self.getNodeKey(node), event, callback)] = node
+
+    removedKeys = [key for key, (node, tag) in self.observers.items() if desiredKeys.get(key) is not node]
+    for key in removedKeys:
+      self.removeObserver(key)
+
+    numberOfAddedObservers = 0
+    for key, node in desiredKeys.items():
+      if key in self.observers:
+        continue
+      _, event, callback = key
+      tag = node.AddObserver(event, self.createEventCallback(callback))
+      self.observers[key] = (node, tag)
+      numberOfAddedObservers += 1
+    self.numberOfAddedObservers += numberOfAddedObservers
+
+    if numberOfAddedObservers > 0 or len(removedKeys) > 0:
+      logging.debug("NeuroSegmentParcellationObserverRegistry: Added %d and removed %d observers", numberOfAddedObservers, len(removedKeys))
+    return numberOfAddedObservers, len(removedKeys)
+
+  def removeObserver(self, key):
+    node, tag = self.observers.pop(key)
+    node.RemoveObserver(tag)
+    self.numberOfRemovedObservers += 1
+
+  def removeAll(self):
+    for key in list(self.observers.keys()):
+      self.removeObserver(key)
+
+  def blockEvents(self):
+    """
+    Context manager that ignores all events of the registered observers while it is active.
+    """
+    registry = self
+    class EventBlocker(object):
+      def __enter__(self):
+        registry.blockCount += 1
+      def __exit__(self, type, value, traceback):
+        registry.blockCount -= 1
+    return EventBlocker()
+
+  def getLeakedObservers(self):
+    """
+    :return: List of (node, event) for observers of nodes that are no longer in a scene
+    """
+    return [(node, key[1]) for key, (node, tag) in self.observers.items() if node.GetScene() is None]
+
+  def getObserverCounts(self):
+    """
+    :return: Dictionary containing the number of "registered" observers, the number of observers registered on each node
+      ("nodes"), the number of "leaked" observers (see getLeakedObservers), and the total number of "added" and "removed" observers
+    """
+    nodeCounts = collections.Counter(key[0] for key in self.observers.keys())
+    return {
+      "registered": len(self.observers),
+      "nodes": dict(nodeCounts),
+      "leaked": len(self.getLeakedObservers()),
+      "added": self.numberOfAddedObservers,
+      "removed": self.numberOfRemovedObservers,
+      }
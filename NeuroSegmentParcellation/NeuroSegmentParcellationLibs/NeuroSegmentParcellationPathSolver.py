@@ -0,0 +1,589 @@
+import re
+import ast
+import time
+import logging
+import collections
+import numpy as np
+
+try:
+  import scipy.sparse
+  import scipy.sparse.csgraph
+except ImportError:
+  scipy = None
+
+class NeuroSegmentParcellationPathSolver(object):
+  """
+  Shortest path solver on a NeuroSegmentParcellationSurfaceGraph that does not require a Slicer scene.
+  The graph is shared and never modified. Each solver owns its own edge cost buffer, so one solver should be created
+  per thread or process.
+
+  The solver reproduces the surface cost functions used by the curves of the parcellation:
+    - DISTANCE_COST_FUNCTION: The cost of an edge is the weighted sum of the FreeSurfer cost terms
+      (see NeuroSegmentParcellationSurfaceGraph.computeEdgeCosts).
+    - INVERSE_SQUARED_COST_FUNCTION: The weighted cost is divided by the square of the distance weighting function,
+      evaluated at the target vertex of each edge.
+
+  The path between two vertices is found using one of the search modes:
+    - DIJKSTRA_SEARCH: The complete shortest path tree from the start point is computed, and cached so that the paths
+      from the same start point to other points are reused.
+    - BIDIRECTIONAL_SEARCH: Searches from the start point over the edges, and from the end point over the reversed edges,
+      until the two searches meet.
+    - ASTAR_SEARCH: A* search guided by the Euclidean distance to the end point, scaled by the lowest cost per unit length
+      of all edges. This never overestimates the remaining cost, so the lowest cost path is still found.
+  Both of the bounded searches are run by the compiled SciPy Dijkstra, with a cost limit that is increased until the
+  path is found (see findPathBidirectional and findPathAStar). They only settle the vertices near the path, which is
+  faster than the complete tree for long curves when the tree cannot be reused. The first limit of each search is
+  estimated from the limit that was needed by the previous search of the solver, since consecutive searches usually
+  have similar costs (ex. while a control point is moved, or between the weights of a sweep).
+  """
+
+  DISTANCE_COST_FUNCTION = "distance"
+  INVERSE_SQUARED_COST_FUNCTION = "inverseSquared"
+
+  # Cost of edges with a distance weighting function value of 0
+  MAXIMUM_EDGE_COST = 1e30
+
+  DIJKSTRA_SEARCH = "Dijkstra"
+  BIDIRECTIONAL_SEARCH = "Bidirectional"
+  ASTAR_SEARCH = "AStar"
+  SEARCH_MODES = [DIJKSTRA_SEARCH, BIDIRECTIONAL_SEARCH, ASTAR_SEARCH]
+
+  # Curve node attribute used to select the search mode of the curve
+  SEARCH_MODE_ATTRIBUTE_NAME = "PathSearchMode"
+
+  # Number of times that the cost limit of the bidirectional and A* searches is doubled before searching without a limit
+  MAXIMUM_NUMBER_OF_LIMITED_SEARCHES = 8
+
+  # Margin added to the cost limit estimated from the previous search, relative to the estimated limit
+  SEARCH_LIMIT_MARGIN = 0.25
+
+  # Default number of cached shortest path trees. Each tree uses 4 bytes per vertex.
+  DEFAULT_MAXIMUM_NUMBER_OF_PATH_TREES = 32
+
+  # Names that can be used in distance weighting functions
+  DISTANCE_WEIGHTING_FUNCTION_NAMES = ["curv", "sulc", "curvMin", "curvMax", "sulcMin", "sulcMax"]
+
+  # Operators that can be used in distance weighting functions
+  DISTANCE_WEIGHTING_FUNCTION_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.divide,
+    ast.Pow: np.power,
+    ast.UAdd: np.positive,
+    ast.USub: np.negative,
+    }
+
+  def __init__(self, surfaceGraph):
+    """
+    :param surfaceGraph: NeuroSegmentParcellationSurfaceGraph
+    """
+    if scipy is None:
+      raise ImportError("NeuroSegmentParcellationPathSolver requires scipy")
+    self.surfaceGraph = surfaceGraph
+    numberOfPoints = surfaceGraph.numberOfPoints
+    self.costMatrix = scipy.sparse.csr_matrix(
+      (np.ones(surfaceGraph.numberOfEdges), surfaceGraph.indices, surfaceGraph.indptr),
+      shape=(numberOfPoints, numberOfPoints))
+    self.edgeCosts = self.costMatrix.data
+
+    self.weights = [1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    self.penalties = [10.0, 10.0, 10.0, 10.0, 10.0, 10.0]
+    self.costFunctionType = self.DISTANCE_COST_FUNCTION
+    self.distanceWeightingFunction = ""
+    self.distanceWeightingFunctionValues = None
+
+    self.searchMode = self.DIJKSTRA_SEARCH
+    # Edges with a length > 0 and their inverse lengths, used to compute the heuristic scale
+    self.heuristicEdgeIds = None
+    self.inverseEdgeLengths = None
+    # Difference of the Euclidean distance to the end point between the target and source of each edge
+    self.heuristicEndPointId = None
+    self.edgeDistanceDifferences = None
+    self.reducedCostMatrix = None
+    self.reverseEdgeOrder = None
+    self.reverseCostMatrix = None
+    # Search mode -> cost limit needed by the last search, relative to the heuristic from the start to the end point
+    self.searchLimitScales = {
+      self.BIDIRECTIONAL_SEARCH: 0.5,
+      self.ASTAR_SEARCH: 0.5,
+      }
+    self.lastSearchStatistics = {
+      "searchMode": self.searchMode,
+      "numberOfSettledPoints": 0,
+      "time": 0.0,
+      }
+
+    self.pathTrees = collections.OrderedDict()
+    self.maximumNumberOfPathTrees = self.DEFAULT_MAXIMUM_NUMBER_OF_PATH_TREES
+
+  @staticmethod
+  def isAvailable():
+    return scipy is not None
+
+  def setWeights(self, weights):
+    """
+    :param weights: Weights [d, c, h, dc, dh, ch, dch, p]
+    """
+    self.weights = [float(weight) for weight in weights]
+
+  def setPenalties(self, penalties):
+    """
+    :param penalties: Penalties [c, h, dc, dh, ch, dch] applied when curv or sulc are < 0
+    """
+    self.penalties = [float(penalty) for penalty in penalties]
+
+  def setCostFunctionType(self, costFunctionType):
+    if costFunctionType not in [self.DISTANCE_COST_FUNCTION, self.INVERSE_SQUARED_COST_FUNCTION]:
+      logging.error("NeuroSegmentParcellationPathSolver: Invalid cost function type " + str(costFunctionType))
+      return
+    self.costFunctionType = costFunctionType
+
+  def setSearchMode(self, searchMode):
+    """
+    :param searchMode: One of DIJKSTRA_SEARCH, BIDIRECTIONAL_SEARCH or ASTAR_SEARCH
+    """
+    if searchMode not in self.SEARCH_MODES:
+      logging.error("NeuroSegmentParcellationPathSolver: Invalid search mode " + str(searchMode))
+      return
+    self.searchMode = searchMode
+
+  def setDistanceWeightingFunction(self, distanceWeightingFunction):
+    """
+    :param distanceWeightingFunction: Expression using the "curv" and "sulc" point scalars
+      (ex. "1 + (sulc - sulcMin) / (sulcMax - sulcMin)"). The sulcMin, sulcMax, curvMin and curvMax placeholders are
+      replaced by the range of the surface scalars. See evaluateDistanceWeightingFunction for the supported syntax.
+    """
+    if distanceWeightingFunction is None:
+      distanceWeightingFunction = ""
+    for scalarName, scalars in [("sulc", self.surfaceGraph.sulc), ("curv", self.surfaceGraph.curv)]:
+      if scalars is None or len(scalars) == 0:
+        continue
+      distanceWeightingFunction = distanceWeightingFunction.replace(scalarName+"Min", str(float(np.min(scalars))))
+      distanceWeightingFunction = distanceWeightingFunction.replace(scalarName+"Max", str(float(np.max(scalars))))
+    if distanceWeightingFunction == self.distanceWeightingFunction:
+      return
+    self.distanceWeightingFunction = distanceWeightingFunction
+    self.distanceWeightingFunctionValues = None
+
+  def setParametersFromCurveNode(self, curveNode):
+    """
+    Copy the weights, penalties and cost function from a vtkMRMLMarkupsFreeSurferCurveNode.
+    The cost function is selected in the same way as NeuroSegmentParcellationLogic.updateInputMarkupSurfaceCostFunction.
+    """
+    self.setWeights(self.getCurveNodeWeights(curveNode))
+    self.setPenalties(self.getCurveNodePenalties(curveNode))
+    costFunctionType, distanceWeightingFunction = self.getCurveNodeCostFunction(curveNode, self.surfaceGraph)
+    self.setCostFunctionType(costFunctionType)
+    self.setDistanceWeightingFunction(distanceWeightingFunction)
+    self.setSearchMode(self.getCurveNodeSearchMode(curveNode))
+
+  @classmethod
+  def getCurveNodeSearchMode(cls, curveNode):
+    """
+    :return: Search mode selected by the SEARCH_MODE_ATTRIBUTE_NAME attribute of the curve node, or DIJKSTRA_SEARCH
+      if the attribute is not set
+    """
+    searchMode = curveNode.GetAttribute(cls.SEARCH_MODE_ATTRIBUTE_NAME)
+    return searchMode if searchMode in cls.SEARCH_MODES else cls.DIJKSTRA_SEARCH
+
+  @staticmethod
+  def getCurveNodeWeights(curveNode):
+    """
+    :return: Weights [d, c, h, dc, dh, ch, dch, p] of a vtkMRMLMarkupsFreeSurferCurveNode
+    """
+    return [
+      curveNode.GetDistanceWeight(),
+      curveNode.GetCurvatureWeight(),
+      curveNode.GetSulcalHeightWeight(),
+      curveNode.GetDistanceCurvatureWeight(),
+      curveNode.GetDistanceSulcalHeightWeight(),
+      curveNode.GetCurvatureSulcalHeightWeight(),
+      curveNode.GetDistanceCurvatureSulcalHeightWeight(),
+      curveNode.GetDirectionWeight(),
+      ]
+
+  @staticmethod
+  def getCurveNodePenalties(curveNode):
+    """
+    :return: Penalties [c, h, dc, dh, ch, dch] of a vtkMRMLMarkupsFreeSurferCurveNode
+    """
+    return [
+      curveNode.GetCurvaturePenalty(),
+      curveNode.GetSulcalHeightPenalty(),
+      curveNode.GetDistanceCurvaturePenalty(),
+      curveNode.GetDistanceSulcalHeightPenalty(),
+      curveNode.GetCurvatureSulcalHeightPenalty(),
+      curveNode.GetDistanceCurvatureSulcalHeightPenalty(),
+      ]
+
+  @classmethod
+  def getCurveNodeCostFunction(cls, curveNode, surfaceGraph):
+    """
+    The inverse squared cost function is used if the curve has a "DistanceWeightingFunction" attribute and the surface
+    has both curv and sulc scalars. Otherwise the distance cost function is used.
+    :return: Tuple of the cost function type and distance weighting function
+    """
+    distanceWeightingFunction = curveNode.GetAttribute("DistanceWeightingFunction")
+    if distanceWeightingFunction and surfaceGraph.curv is not None and surfaceGraph.sulc is not None:
+      return cls.INVERSE_SQUARED_COST_FUNCTION, distanceWeightingFunction
+    return cls.DISTANCE_COST_FUNCTION, ""
+
+  def getDistanceWeightingFunctionValues(self):
+    """
+    Evaluate the distance weighting function at every vertex.
+    """
+    if self.distanceWeightingFunctionValues is not None:
+      return self.distanceWeightingFunctionValues
+
+    numberOfPoints = self.surfaceGraph.numberOfPoints
+    variables = {}
+    for scalarName, scalars in [("curv", self.surfaceGraph.curv), ("sulc", self.surfaceGraph.sulc)]:
+      if scalars is None or len(scalars) == 0:
+        scalars = np.zeros(numberOfPoints)
+      variables[scalarName] = np.asarray(scalars, dtype=np.float64)
+      variables[scalarName+"Min"] = float(np.min(scalars))
+      variables[scalarName+"Max"] = float(np.max(scalars))
+    values = self.evaluateDistanceWeightingFunction(self.distanceWeightingFunction, variables)
+    if values is None:
+      values = 1.0
+    self.distanceWeightingFunctionValues = np.broadcast_to(np.asarray(values, dtype=np.float64), (numberOfPoints,))
+    return self.distanceWeightingFunctionValues
+
+  @classmethod
+  def evaluateDistanceWeightingFunction(cls, expression, variables):
+    """
+    Evaluate a distance weighting function without using eval.
+    Only numbers, the names in DISTANCE_WEIGHTING_FUNCTION_NAMES and the operators + - * / ** (or ^) are allowed.
+    :param expression: Distance weighting function
+    :param variables: Dictionary containing the value of each name
+    :return: Value of the expression, or None if the expression is not valid
+    """
+    def evaluateNode(node):
+      if isinstance(node, ast.Expression):
+        return evaluateNode(node.body)
+      if isinstance(node, ast.BinOp) and type(node.op) in cls.DISTANCE_WEIGHTING_FUNCTION_OPERATORS:
+        return cls.DISTANCE_WEIGHTING_FUNCTION_OPERATORS[type(node.op)](evaluateNode(node.left), evaluateNode(node.right))
+      if isinstance(node, ast.UnaryOp) and type(node.op) in cls.DISTANCE_WEIGHTING_FUNCTION_OPERATORS:
+        return cls.DISTANCE_WEIGHTING_FUNCTION_OPERATORS[type(node.op)](evaluateNode(node.operand))
+      if isinstance(node, ast.Name) and node.id in cls.DISTANCE_WEIGHTING_FUNCTION_NAMES and node.id in variables:
+        return variables[node.id]
+      # ast.Num is used instead of ast.Constant before Python 3.8
+      numberNodeTypes = tuple(getattr(ast, nodeType) for nodeType in ["Constant", "Num"] if hasattr(ast, nodeType))
+      value = getattr(node, "value", getattr(node, "n", None))
+      if isinstance(node, numberNodeTypes) and type(value) in [int, float]:
+        return float(value)
+      raise ValueError("Unsupported expression: " + ast.dump(node))
+
+    try:
+      expressionTree = ast.parse(re.sub(r"\^", "**", expression), mode="eval")
+      with np.errstate(all="ignore"):
+        return evaluateNode(expressionTree)
+    except Exception as e:
+      logging.error("NeuroSegmentParcellationPathSolver: Could not evaluate distance weighting function \"" + str(expression) + "\": " + str(e))
+      return None
+
+  def setMaximumNumberOfPathTrees(self, maximumNumberOfPathTrees):
+    """
+    Set the maximum number of shortest path trees that are cached. If 0, the trees are not cached.
+    """
+    self.maximumNumberOfPathTrees = max(0, int(maximumNumberOfPathTrees))
+    while len(self.pathTrees) > self.maximumNumberOfPathTrees:
+      self.pathTrees.popitem(last=False)
+
+  def clearPathTrees(self):
+    self.pathTrees.clear()
+
+  def getPathTreeKey(self, startPointId, endPointId, weights, penalties):
+    """
+    Return the key of the shortest path tree from the start point with the specified parameters.
+    The direction cost depends on the end point, so the end point is only part of the key if the direction weight is used.
+    """
+    directionPointId = int(endPointId) if weights[7] != 0.0 else None
+    distanceWeightingFunction = None
+    if self.costFunctionType == self.INVERSE_SQUARED_COST_FUNCTION:
+      distanceWeightingFunction = self.distanceWeightingFunction
+    return (int(startPointId), directionPointId, tuple(float(weight) for weight in weights),
+      tuple(float(penalty) for penalty in penalties), distanceWeightingFunction)
+
+  def getPathKey(self, startPointId, endPointId, weights, penalties):
+    """
+    Return the key of a path found by the bidirectional or A* search.
+    """
+    return self.getPathTreeKey(startPointId, endPointId, weights, penalties) + (self.searchMode, int(endPointId))
+
+  def setLastSearchStatistics(self, numberOfSettledPoints, startTime):
+    self.lastSearchStatistics = {
+      "searchMode": self.searchMode,
+      "numberOfSettledPoints": numberOfSettledPoints,
+      "time": time.time() - startTime,
+      }
+    logging.debug("NeuroSegmentParcellationPathSolver: %s search settled %d points in %f s", self.searchMode,
+      numberOfSettledPoints, self.lastSearchStatistics["time"])
+
+  def addToCache(self, key, value):
+    if self.maximumNumberOfPathTrees <= 0:
+      return
+    self.pathTrees[key] = value
+    while len(self.pathTrees) > self.maximumNumberOfPathTrees:
+      self.pathTrees.popitem(last=False)
+
+  def getPathTree(self, startPointId, endPointId, weights, penalties):
+    """
+    Return the predecessors of all vertices in the shortest path tree from the start point.
+    The tree is taken from the cache if it has already been computed.
+    """
+    key = self.getPathTreeKey(startPointId, endPointId, weights, penalties)
+    predecessors = self.pathTrees.get(key)
+    if predecessors is not None:
+      self.pathTrees.move_to_end(key)
+      self.setLastSearchStatistics(0, time.time())
+      return predecessors
+
+    startTime = time.time()
+    self.updateEdgeCosts(startPointId, endPointId, weights, penalties)
+    distances, predecessors = scipy.sparse.csgraph.dijkstra(self.costMatrix, directed=True, indices=startPointId,
+      return_predecessors=True)
+    predecessors = predecessors.astype(np.int32)
+    self.setLastSearchStatistics(int(np.count_nonzero(np.isfinite(distances))), startTime)
+    self.addToCache(key, predecessors)
+    return predecessors
+
+  def updateEdgeCosts(self, startPointId, endPointId, weights, penalties):
+    points = self.surfaceGraph.points
+    direction = points[endPointId] - points[startPointId]
+    self.surfaceGraph.computeEdgeCosts(weights, penalties, direction, self.edgeCosts)
+    if self.costFunctionType == self.INVERSE_SQUARED_COST_FUNCTION and self.distanceWeightingFunction:
+      vertexWeights = self.getDistanceWeightingFunctionValues()[self.surfaceGraph.edgeTargets]
+      with np.errstate(divide="ignore"):
+        self.edgeCosts /= vertexWeights * vertexWeights
+      self.edgeCosts[~np.isfinite(self.edgeCosts)] = self.MAXIMUM_EDGE_COST
+
+  def findPath(self, startPointId, endPointId, weights=None, penalties=None):
+    """
+    Find the lowest cost path between two surface points.
+    :param startPointId: Start vertex id
+    :param endPointId: End vertex id
+    :param weights: Weights [d, c, h, dc, dh, ch, dch, p]. Uses the solver weights if not specified.
+    :param penalties: Penalties [c, h, dc, dh, ch, dch]. Uses the solver penalties if not specified.
+    :return: NumPy array of the vertex ids along the path, from start to end. Empty if there is no path.
+    """
+    if weights is None:
+      weights = self.weights
+    if penalties is None:
+      penalties = self.penalties
+    if startPointId == endPointId:
+      self.setLastSearchStatistics(0, time.time())
+      return np.array([startPointId], dtype=np.int64)
+    if self.searchMode == self.DIJKSTRA_SEARCH:
+      predecessors = self.getPathTree(startPointId, endPointId, weights, penalties)
+      return self.getPathFromPredecessors(predecessors, startPointId, endPointId)
+
+    key = self.getPathKey(startPointId, endPointId, weights, penalties)
+    pathPointIds = self.pathTrees.get(key)
+    if pathPointIds is not None:
+      self.pathTrees.move_to_end(key)
+      self.setLastSearchStatistics(0, time.time())
+      return pathPointIds
+
+    startTime = time.time()
+    self.updateEdgeCosts(startPointId, endPointId, weights, penalties)
+    if self.searchMode == self.ASTAR_SEARCH:
+      pathPointIds, numberOfSettledPoints = self.findPathAStar(startPointId, endPointId)
+    else:
+      pathPointIds, numberOfSettledPoints = self.findPathBidirectional(startPointId, endPointId)
+    self.setLastSearchStatistics(numberOfSettledPoints, startTime)
+    if len(pathPointIds) == 0:
+      logging.error("NeuroSegmentParcellationPathSolver: Could not find path")
+      return pathPointIds
+    self.addToCache(key, pathPointIds)
+    return pathPointIds
+
+  def findPaths(self, startPointId, endPointIds, weights=None, penalties=None):
+    """
+    Find the lowest cost paths from one surface point to several others.
+    Unless the direction weight is used, all of the paths are found using a single search.
+    :return: List of NumPy arrays of the vertex ids along each path
+    """
+    return [self.findPath(startPointId, endPointId, weights, penalties) for endPointId in endPointIds]
+
+  def findCurvePath(self, controlPointIds):
+    """
+    Find the path through all of the control points, solving each segment between consecutive control points
+    in the same way as a shortest distance on surface curve.
+    :param controlPointIds: Vertex ids of the control points
+    :return: NumPy array of the vertex ids along the curve
+    """
+    if len(controlPointIds) == 0:
+      return np.zeros(0, dtype=np.int64)
+
+    pathPointIds = [np.array([controlPointIds[0]], dtype=np.int64)]
+    for i in range(1, len(controlPointIds)):
+      segmentPointIds = self.findPath(controlPointIds[i-1], controlPointIds[i])
+      pathPointIds.append(segmentPointIds[1:])
+    return np.concatenate(pathPointIds)
+
+  def getPathCost(self, pathPointIds):
+    """
+    :param pathPointIds: Vertex ids along a path, where each consecutive pair of vertices is connected by an edge
+    :return: Sum of the current edge costs (computed by the last search) along the path
+    """
+    pathPointIds = np.asarray(pathPointIds, dtype=np.int64)
+    if len(pathPointIds) < 2:
+      return 0.0
+    # Edges are sorted by source and target
+    numberOfPoints = self.surfaceGraph.numberOfPoints
+    edgeKeys = self.surfaceGraph.edgeSources * numberOfPoints + self.surfaceGraph.edgeTargets
+    edgeIds = np.searchsorted(edgeKeys, pathPointIds[:-1] * numberOfPoints + pathPointIds[1:])
+    return float(np.sum(self.edgeCosts[edgeIds]))
+
+  def getHeuristicScale(self):
+    """
+    Return the lowest cost per unit length of all edges. Multiplied by the Euclidean distance between two points,
+    this is a lower bound of the cost of any path between them.
+    """
+    if self.heuristicEdgeIds is None:
+      edgeLengths = self.surfaceGraph.edgeLengths
+      validEdges = edgeLengths > 0.0
+      self.heuristicEdgeIds = slice(None) if np.all(validEdges) else np.flatnonzero(validEdges)
+      self.inverseEdgeLengths = 1.0 / edgeLengths[self.heuristicEdgeIds]
+    if len(self.inverseEdgeLengths) == 0:
+      return 0.0
+    return max(0.0, float(np.min(self.edgeCosts[self.heuristicEdgeIds] * self.inverseEdgeLengths)))
+
+  def getHeuristicCost(self, startPointId, endPointId):
+    """
+    :return: Lower bound of the cost from the start point to the end point, using the current edge costs
+    """
+    points = self.surfaceGraph.points
+    return self.getHeuristicScale() * float(np.linalg.norm(points[endPointId] - points[startPointId]))
+
+  def updateEdgeDistanceDifferences(self, endPointId):
+    """
+    Compute the difference of the Euclidean distance to the end point between the target and source of each edge.
+    The differences are kept until a path to another end point is searched for.
+    """
+    if self.heuristicEndPointId == endPointId:
+      return
+    pointVectors = self.surfaceGraph.points - self.surfaceGraph.points[endPointId]
+    distances = np.sqrt(np.einsum("ij,ij->i", pointVectors, pointVectors))
+    self.edgeDistanceDifferences = distances[self.surfaceGraph.edgeTargets] - distances[self.surfaceGraph.edgeSources]
+    self.heuristicEndPointId = endPointId
+
+  def getInitialSearchLimit(self, minimumLimitScale, heuristicCost):
+    """
+    :param minimumLimitScale: Lowest limit that the path can be found with, relative to the heuristic cost
+    :param heuristicCost: Heuristic cost from the start to the end point
+    :return: Cost limit of the first bounded search, estimated from the limit needed by the previous search
+    """
+    limitScale = max(minimumLimitScale, self.searchLimitScales[self.searchMode] * (1.0 + self.SEARCH_LIMIT_MARGIN))
+    return limitScale * heuristicCost
+
+  def findPathAStar(self, startPointId, endPointId):
+    """
+    Find the lowest cost path using the current edge costs with an A* search.
+    The heuristic h is consistent, so the A* search is a Dijkstra search using the reduced edge costs
+    c(u, v) - h(u) + h(v) >= 0, which is run by SciPy. The reduced cost of a path is its cost minus h(start), so the
+    search only settles the vertices whose cost from the start plus their heuristic is within the limit.
+    :return: Tuple of the vertex ids along the path and the number of settled vertices
+    """
+    if self.reducedCostMatrix is None:
+      self.reducedCostMatrix = self.costMatrix.copy()
+    reducedEdgeCosts = self.reducedCostMatrix.data
+    self.updateEdgeDistanceDifferences(endPointId)
+    np.multiply(self.edgeDistanceDifferences, self.getHeuristicScale(), out=reducedEdgeCosts)
+    reducedEdgeCosts += self.edgeCosts
+    np.maximum(reducedEdgeCosts, 0.0, out=reducedEdgeCosts)
+
+    # The limit is the allowed excess of the path cost over the heuristic. It is doubled until the end point is reached.
+    heuristicCost = self.getHeuristicCost(startPointId, endPointId)
+    limit = self.getInitialSearchLimit(0.01, heuristicCost)
+    numberOfSettledPoints = 0
+    for searchIndex in range(self.MAXIMUM_NUMBER_OF_LIMITED_SEARCHES + 1):
+      if searchIndex == self.MAXIMUM_NUMBER_OF_LIMITED_SEARCHES or limit <= 0.0:
+        limit = np.inf
+      distances, predecessors = scipy.sparse.csgraph.dijkstra(self.reducedCostMatrix, directed=True, indices=startPointId,
+        return_predecessors=True, limit=limit)
+      numberOfSettledPoints += int(np.count_nonzero(np.isfinite(distances)))
+      if np.isfinite(distances[endPointId]):
+        if heuristicCost > 0.0:
+          self.searchLimitScales[self.ASTAR_SEARCH] = distances[endPointId] / heuristicCost
+        return self.getPathFromPredecessors(predecessors, startPointId, endPointId), numberOfSettledPoints
+      if limit == np.inf:
+        break
+      limit *= 2.0
+    return np.zeros(0, dtype=np.int64), numberOfSettledPoints
+
+  def updateReverseEdges(self):
+    """
+    Compute the order of the edges in the reversed graph, used by the backward search of the bidirectional search.
+    """
+    if self.reverseEdgeOrder is not None:
+      return
+    surfaceGraph = self.surfaceGraph
+    self.reverseEdgeOrder = np.lexsort((surfaceGraph.edgeSources, surfaceGraph.edgeTargets))
+    reverseIndptr = np.zeros(surfaceGraph.numberOfPoints+1, dtype=np.int64)
+    np.cumsum(np.bincount(surfaceGraph.edgeTargets, minlength=surfaceGraph.numberOfPoints), out=reverseIndptr[1:])
+    self.reverseCostMatrix = scipy.sparse.csr_matrix(
+      (np.zeros(surfaceGraph.numberOfEdges), surfaceGraph.edgeSources[self.reverseEdgeOrder], reverseIndptr),
+      shape=self.costMatrix.shape)
+
+  def findPathBidirectional(self, startPointId, endPointId):
+    """
+    Find the lowest cost path using the current edge costs, searching forward from the start point and backward
+    from the end point, each up to the same cost limit. The lowest cost of the paths through an edge (u, v) that
+    is reached by both searches is forward(u) + c(u, v) + backward(v). If this cost is at most twice the limit, the
+    lowest cost path has such an edge, and the path is found. Otherwise the limit is doubled, or set to half of the
+    cost of the path through the edge if that is lower, since the lowest cost path is found with that limit.
+    :return: Tuple of the vertex ids along the path and the number of settled vertices
+    """
+    self.updateReverseEdges()
+    surfaceGraph = self.surfaceGraph
+    np.take(self.edgeCosts, self.reverseEdgeOrder, out=self.reverseCostMatrix.data)
+
+    # The lowest cost path costs at least the heuristic, so the searches cannot meet before half of it
+    heuristicCost = self.getHeuristicCost(startPointId, endPointId)
+    limit = self.getInitialSearchLimit(0.5, heuristicCost)
+    numberOfSettledPoints = 0
+    for searchIndex in range(self.MAXIMUM_NUMBER_OF_LIMITED_SEARCHES):
+      if limit <= 0.0:
+        break
+      forwardDistances, forwardPredecessors = scipy.sparse.csgraph.dijkstra(self.costMatrix, directed=True,
+        indices=startPointId, return_predecessors=True, limit=limit)
+      backwardDistances, backwardPredecessors = scipy.sparse.csgraph.dijkstra(self.reverseCostMatrix, directed=True,
+        indices=endPointId, return_predecessors=True, limit=limit)
+      numberOfSettledPoints += int(np.count_nonzero(np.isfinite(forwardDistances)))
+      numberOfSettledPoints += int(np.count_nonzero(np.isfinite(backwardDistances)))
+
+      pathCosts = (forwardDistances[surfaceGraph.edgeSources] + self.edgeCosts +
+        backwardDistances[surfaceGraph.edgeTargets])
+      edgeIndex = int(np.argmin(pathCosts))
+      if pathCosts[edgeIndex] <= 2.0 * limit:
+        self.searchLimitScales[self.BIDIRECTIONAL_SEARCH] = 0.5 * pathCosts[edgeIndex] / heuristicCost
+        forwardPath = self.getPathFromPredecessors(forwardPredecessors, startPointId, surfaceGraph.edgeSources[edgeIndex])
+        backwardPath = self.getPathFromPredecessors(backwardPredecessors, endPointId, surfaceGraph.edgeTargets[edgeIndex])
+        return np.concatenate([forwardPath, backwardPath[::-1]]), numberOfSettledPoints
+      limit = min(2.0 * limit, 0.5 * pathCosts[edgeIndex])
+
+    # The searches did not meet, so the path is found by a search without a limit
+    distances, predecessors = scipy.sparse.csgraph.dijkstra(self.costMatrix, directed=True, indices=startPointId,
+      return_predecessors=True)
+    numberOfSettledPoints += int(np.count_nonzero(np.isfinite(distances)))
+    if not np.isfinite(distances[endPointId]):
+      return np.zeros(0, dtype=np.int64), numberOfSettledPoints
+    return self.getPathFromPredecessors(predecessors, startPointId, endPointId), numberOfSettledPoints
+
+  @staticmethod
+  def getPathFromPredecessors(predecessors, startPointId, endPointId):
+    if startPointId == endPointId:
+      return np.array([startPointId], dtype=np.int64)
+    if predecessors[endPointId] < 0:
+      logging.error("NeuroSegmentParcellationPathSolver: Could not find path")
+      return np.zeros(0, dtype=np.int64)
+
+    pointIds = [endPointId]
+    pointId = endPointId
+    while pointId != startPointId:
+      pointId = predecessors[pointId]
+      pointIds.append(pointId)
+    return np.array(pointIds[::-1], dtype=np.int64)
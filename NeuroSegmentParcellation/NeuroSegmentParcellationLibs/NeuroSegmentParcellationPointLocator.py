@@ -0,0 +1,53 @@
+import vtk
+import numpy as np
+from vtk.util import numpy_support
+
+try:
+  from scipy.spatial import cKDTree
+except ImportError:
+  cKDTree = None
+
+class NeuroSegmentParcellationPointLocator(object):
+  """
+  Bulk closest point queries against a fixed point set.
+  Uses a scipy KD-tree when available, and falls back to a vtkPointLocator otherwise.
+  """
+
+  def __init__(self, points):
+    """
+    :param points: (N, 3) NumPy array of the points to search
+    """
+    self.points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 3)
+    self.kdTree = None
+    self.pointLocator = None
+    if len(self.points) == 0:
+      return
+
+    if cKDTree is not None:
+      self.kdTree = cKDTree(self.points)
+    else:
+      polyData = vtk.vtkPolyData()
+      vtkPoints = vtk.vtkPoints()
+      vtkPoints.SetData(numpy_support.numpy_to_vtk(self.points, deep=True))
+      polyData.SetPoints(vtkPoints)
+      self.pointLocator = vtk.vtkPointLocator()
+      self.pointLocator.SetDataSet(polyData)
+      self.pointLocator.BuildLocator()
+
+  def findClosestPoints(self, queryPoints):
+    """
+    Find the closest point for each of the query points.
+    :param queryPoints: (M, 3) NumPy array
+    :return: Tuple of (closest point ids, squared distances to the closest points)
+    """
+    queryPoints = np.asarray(queryPoints, dtype=np.float64).reshape(-1, 3)
+    if len(queryPoints) == 0 or len(self.points) == 0:
+      return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    if self.kdTree is not None:
+      _, closestPointIds = self.kdTree.query(queryPoints)
+    else:
+      closestPointIds = np.array([self.pointLocator.FindClosestPoint(point) for point in queryPoints], dtype=np.int64)
+    closestPointIds = np.asarray(closestPointIds, dtype=np.int64)
+    distances2 = np.sum((self.points[closestPointIds] - queryPoints)**2, axis=1)
+    return closestPointIds, distances2
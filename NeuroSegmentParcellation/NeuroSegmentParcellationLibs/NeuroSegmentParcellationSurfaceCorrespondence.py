@@ -0,0 +1,77 @@
+import numpy as np
+from vtk.util import numpy_support
+
+class NeuroSegmentParcellationSurfaceCorrespondence(object):
+  """
+  Point correspondence between the FreeSurfer orig, pial and inflated surfaces, which share vertex indices one to one.
+
+  Points are identified by their surface vertex ids once, and the corresponding points on the other surfaces are gathered
+  from the surface point arrays using the same ids, without any spatial search.
+  The vertex ids of each curve are kept until the curve points are modified, or the curve is removed (see removeCurve).
+  """
+
+  def __init__(self, worldSurfaceCache):
+    """
+    :param worldSurfaceCache: NeuroSegmentParcellationWorldSurfaceCache that provides the point locators of the surfaces
+    """
+    self.worldSurfaceCache = worldSurfaceCache
+    # Curve key -> (curve MTime, surface node ID, vertex ids)
+    self.curvePointIds = {}
+
+  @staticmethod
+  def getSurfacePoints(polyData):
+    """
+    :return: (N, 3) float64 NumPy view of the surface points, or None if the surface has no points
+    """
+    if polyData is None or polyData.GetPoints() is None:
+      return None
+    return numpy_support.vtk_to_numpy(polyData.GetPoints().GetData()).reshape(-1, 3)
+
+  def findPointIds(self, surfaceNode, points):
+    """
+    Find the closest surface vertex to each of the points.
+    :param surfaceNode: Surface model node. The point locator of the model polydata is shared through the world surface cache.
+    :param points: (M, 3) NumPy array of points in the model coordinate system
+    :return: (M,) NumPy array of vertex ids
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    pointLocator = self.worldSurfaceCache.getPointLocator(surfaceNode)
+    if len(points) == 0 or pointLocator is None:
+      return np.zeros(0, dtype=np.int64)
+    pointIds, _ = pointLocator.findClosestPoints(points)
+    return pointIds
+
+  def getCurvePointIds(self, curveKey, curveMTime, surfaceNode, points):
+    """
+    Return the vertex ids of the points of a curve. The ids are only searched for if the curve was modified
+    since they were last stored.
+    :param curveMTime: Modified time of the curve points, or tuple of the modified times that the vertex ids depend on
+    :param points: (M, 3) NumPy array of the curve points in the surface coordinate system,
+      or a function returning the array, so that the points are only computed when needed
+    """
+    if curveKey in self.curvePointIds:
+      storedMTime, storedSurfaceID, pointIds = self.curvePointIds[curveKey]
+      if storedMTime == curveMTime and storedSurfaceID == surfaceNode.GetID():
+        return pointIds
+    if callable(points):
+      points = points()
+    pointIds = self.findPointIds(surfaceNode, points)
+    self.curvePointIds[curveKey] = (curveMTime, surfaceNode.GetID(), pointIds)
+    return pointIds
+
+  def removeCurve(self, curveKey):
+    """
+    Discard the stored vertex ids of a curve (ex. when the curve node is removed from the scene).
+    """
+    self.curvePointIds.pop(curveKey, None)
+
+  def getCorrespondingPoints(self, polyData, pointIds):
+    """
+    Gather the points with the specified vertex ids from a surface that shares the vertex indices of the source surface.
+    :return: (M, 3) NumPy array of points in the surface coordinate system, or None if the ids are not valid for the surface
+    """
+    surfacePoints = self.getSurfacePoints(polyData)
+    pointIds = np.asarray(pointIds, dtype=np.int64)
+    if surfacePoints is None or (len(pointIds) > 0 and (pointIds.min() < 0 or pointIds.max() >= len(surfacePoints))):
+      return None
+    return surfacePoints[pointIds].astype(np.float64)
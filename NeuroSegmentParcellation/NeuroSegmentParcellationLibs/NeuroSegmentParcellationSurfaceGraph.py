@@ -0,0 +1,308 @@
+import vtk
+import logging
+import threading
+import numpy as np
+from vtk.util import numpy_support
+
+try:
+  import scipy.sparse
+  import scipy.sparse.csgraph
+except ImportError:
+  scipy = None
+
+class NeuroSegmentParcellationSurfaceGraph(object):
+  """
+  Read-only vertex/edge representation of a triangulated FreeSurfer surface.
+  Edges are stored as a directed compressed sparse row (CSR) structure, so that the graph can be shared between
+  path solvers running on different threads or processes without a Slicer scene.
+
+  Edge costs combine the same terms as the weights of vtkMRMLMarkupsFreeSurferCurveNode:
+    [d, c, h, dc, dh, ch, dch, p] (d=distance, c=curvature, h=sulcal height, p=direction)
+  The curvature and sulcal height terms are evaluated at the target vertex of each edge, and are multiplied by
+  the corresponding penalty [c, h, dc, dh, ch, dch] when curv or sulc are < 0.
+  """
+
+  NUMBER_OF_WEIGHTS = 8
+  NUMBER_OF_PENALTIES = 6
+
+  def __init__(self, points, connectivity, offsets, curv=None, sulc=None):
+    """
+    :param points: (N, 3) NumPy array of vertex positions
+    :param connectivity: Flat NumPy array of polygon point ids
+    :param offsets: NumPy array of polygon offsets into the connectivity array (number of polygons + 1 values)
+    :param curv: Optional NumPy array of FreeSurfer curvature values for each vertex
+    :param sulc: Optional NumPy array of FreeSurfer sulcal height values for each vertex
+    """
+    self.points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 3)
+    self.numberOfPoints = len(self.points)
+    self.curv = self.getScalarArray(curv)
+    self.sulc = self.getScalarArray(sulc)
+
+    connectivity = np.asarray(connectivity, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+
+    # Each polygon point is connected to the next point in the polygon, wrapping around at the end.
+    nextPointIndices = np.arange(1, len(connectivity)+1)
+    cellSizes = np.diff(offsets)
+    nonEmptyCells = cellSizes > 0
+    nextPointIndices[offsets[1:][nonEmptyCells] - 1] = offsets[:-1][nonEmptyCells]
+    sources = connectivity
+    targets = connectivity[nextPointIndices] if len(connectivity) > 0 else connectivity
+
+    # Store both directions of each edge only once
+    sources, targets = np.concatenate([sources, targets]), np.concatenate([targets, sources])
+    edgeKeys = np.unique(sources * self.numberOfPoints + targets)
+    self.edgeSources = edgeKeys // self.numberOfPoints
+    self.edgeTargets = edgeKeys % self.numberOfPoints
+    validEdges = self.edgeSources != self.edgeTargets
+    self.edgeSources = self.edgeSources[validEdges]
+    self.edgeTargets = self.edgeTargets[validEdges]
+    self.numberOfEdges = len(self.edgeSources)
+
+    # CSR structure. Edges are already sorted by source since the keys were sorted.
+    self.indptr = np.zeros(self.numberOfPoints+1, dtype=np.int64)
+    np.cumsum(np.bincount(self.edgeSources, minlength=self.numberOfPoints), out=self.indptr[1:])
+    self.indices = self.edgeTargets
+
+    self.edgeVectors = self.points[self.edgeTargets] - self.points[self.edgeSources]
+    self.edgeLengths = np.sqrt(np.sum(self.edgeVectors**2, axis=1))
+
+    self.edgeFeatures = None
+    self.edgeFeaturesPenalties = None
+    self.edgeFeaturesLock = threading.Lock()
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    del state["edgeFeaturesLock"]
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.edgeFeaturesLock = threading.Lock()
+
+  @classmethod
+  def fromPolyData(cls, polyData, curvArrayName="curv", sulcArrayName="sulc"):
+    """
+    Create a surface graph from the points and polygons of a vtkPolyData.
+    :param polyData: Surface vtkPolyData. Should already be in the coordinate system that the paths are computed in.
+    """
+    if polyData is None or polyData.GetPoints() is None:
+      logging.error("NeuroSegmentParcellationSurfaceGraph: Invalid polydata")
+      return None
+
+    points = numpy_support.vtk_to_numpy(polyData.GetPoints().GetData())
+    connectivity, offsets = cls.getPolygonConnectivity(polyData)
+
+    curv = None
+    sulc = None
+    pointData = polyData.GetPointData()
+    if pointData:
+      curvArray = pointData.GetArray(curvArrayName)
+      if curvArray:
+        curv = numpy_support.vtk_to_numpy(curvArray)
+      sulcArray = pointData.GetArray(sulcArrayName)
+      if sulcArray:
+        sulc = numpy_support.vtk_to_numpy(sulcArray)
+    return cls(points, connectivity, offsets, curv, sulc)
+
+  @classmethod
+  def getPolygonConnectivity(cls, polyData):
+    """
+    Return the (connectivity, offsets) NumPy arrays of the polygons in the polydata.
+    """
+    return cls.getCellArrayConnectivity(polyData.GetPolys())
+
+  @staticmethod
+  def getCellArrayConnectivity(cellArray):
+    """
+    Return the (connectivity, offsets) NumPy arrays of a vtkCellArray.
+    The arrays are views of the cell array data when possible, and have the integer type of the cell array
+    (usually vtkIdType). They must not be modified, and callers that need a specific integer type should convert them.
+    """
+    if cellArray is None or cellArray.GetNumberOfCells() == 0:
+      return np.zeros(0, dtype=np.int64), np.zeros(1, dtype=np.int64)
+
+    if hasattr(cellArray, "GetConnectivityArray"):
+      connectivity = numpy_support.vtk_to_numpy(cellArray.GetConnectivityArray())
+      offsets = numpy_support.vtk_to_numpy(cellArray.GetOffsetsArray())
+      return connectivity, offsets
+
+    # Legacy cell array layout: [n, id_0, ... id_n-1, n, ...]
+    legacyData = numpy_support.vtk_to_numpy(cellArray.GetData())
+    cellSizes = []
+    cellStarts = []
+    position = 0
+    while position < len(legacyData):
+      cellSizes.append(legacyData[position])
+      cellStarts.append(position + 1)
+      position += legacyData[position] + 1
+    cellSizes = np.array(cellSizes, dtype=np.int64)
+    cellStarts = np.array(cellStarts, dtype=np.int64)
+    offsets = np.zeros(len(cellSizes)+1, dtype=np.int64)
+    np.cumsum(cellSizes, out=offsets[1:])
+    connectivity = legacyData[np.repeat(cellStarts - offsets[:-1], cellSizes) + np.arange(offsets[-1])]
+    return connectivity, offsets
+
+  @staticmethod
+  def createCellArray(connectivity, offsets):
+    """
+    Create a vtkCellArray from (connectivity, offsets) NumPy arrays.
+    """
+    connectivityArray = numpy_support.numpy_to_vtk(np.asarray(connectivity, dtype=numpy_support.ID_TYPE_CODE), deep=True,
+      array_type=vtk.VTK_ID_TYPE)
+    cellArray = vtk.vtkCellArray()
+    if hasattr(cellArray, "GetConnectivityArray"):
+      offsetsArray = numpy_support.numpy_to_vtk(np.asarray(offsets, dtype=numpy_support.ID_TYPE_CODE), deep=True,
+        array_type=vtk.VTK_ID_TYPE)
+      cellArray.SetData(offsetsArray, connectivityArray)
+      return cellArray
+
+    # Legacy cell array layout: [n, id_0, ... id_n-1, n, ...]
+    offsets = np.asarray(offsets, dtype=np.int64)
+    cellSizes = np.diff(offsets)
+    legacyData = np.insert(np.asarray(connectivity, dtype=np.int64), offsets[:-1], cellSizes)
+    legacyArray = numpy_support.numpy_to_vtk(legacyData.astype(numpy_support.ID_TYPE_CODE), deep=True, array_type=vtk.VTK_ID_TYPE)
+    cellArray.SetCells(len(cellSizes), legacyArray)
+    return cellArray
+
+  def getScalarArray(self, scalars):
+    if scalars is None:
+      return None
+    scalars = np.asarray(scalars, dtype=np.float64).reshape(-1)
+    if len(scalars) != self.numberOfPoints:
+      logging.error("NeuroSegmentParcellationSurfaceGraph: Scalar array size does not match the number of points")
+      return None
+    return scalars
+
+  def getNeighbors(self, pointIds):
+    """
+    Return the concatenated neighbor ids of all of the specified points. Points may appear more than once.
+    """
+    pointIds = np.asarray(pointIds, dtype=np.int64)
+    starts = self.indptr[pointIds]
+    counts = self.indptr[pointIds+1] - starts
+    totalCount = np.sum(counts)
+    if totalCount == 0:
+      return np.zeros(0, dtype=np.int64)
+    countOffsets = np.cumsum(counts) - counts
+    return self.indices[np.repeat(starts - countOffsets, counts) + np.arange(totalCount)]
+
+  def getRingIndices(self, sourcePointIds, numberOfRings):
+    """
+    Multi-source breadth-first expansion from the source points.
+    The cost is proportional to the number of vertices within the rings, rather than the size of the surface.
+    :param sourcePointIds: Ids of the points in ring 0
+    :param numberOfRings: Number of rings of neighbors to expand around the source points
+    :return: NumPy array containing the ring index of each point, or -1 for points outside of the rings
+    """
+    ringIndices = np.full(self.numberOfPoints, -1, dtype=np.int64)
+    frontier = np.unique(np.asarray(sourcePointIds, dtype=np.int64))
+    ringIndices[frontier] = 0
+    for ringIndex in range(1, numberOfRings+1):
+      if len(frontier) == 0:
+        break
+      neighbors = self.getNeighbors(frontier)
+      frontier = np.unique(neighbors[ringIndices[neighbors] < 0])
+      ringIndices[frontier] = ringIndex
+    return ringIndices
+
+  def getGeodesicDistances(self, sourcePointIds):
+    """
+    Compute the distance along the surface edges from each point to the closest source point.
+    :param sourcePointIds: Ids of the source points
+    :return: NumPy array containing the distance of each point, or None if scipy is not available
+    """
+    if scipy is None:
+      logging.warning("NeuroSegmentParcellationSurfaceGraph: Geodesic distances require scipy")
+      return None
+    sourcePointIds = np.unique(np.asarray(sourcePointIds, dtype=np.int64))
+    if len(sourcePointIds) == 0:
+      return np.full(self.numberOfPoints, np.inf)
+    lengthMatrix = scipy.sparse.csr_matrix((self.edgeLengths, self.indices, self.indptr),
+      shape=(self.numberOfPoints, self.numberOfPoints))
+    return scipy.sparse.csgraph.dijkstra(lengthMatrix, directed=True, indices=sourcePointIds, min_only=True)
+
+  def getNormalizedCost(self, scalars):
+    """
+    Return the per-vertex cost of a FreeSurfer scalar, scaled so that the highest value (deepest sulcus) has no cost
+    and the lowest value has a cost of 1.
+    """
+    if scalars is None:
+      return np.zeros(self.numberOfPoints)
+    scalarMin = np.min(scalars)
+    scalarRange = np.max(scalars) - scalarMin
+    if scalarRange == 0.0:
+      return np.zeros(self.numberOfPoints)
+    return 1.0 - ((scalars - scalarMin) / scalarRange)
+
+  def getEdgeFeatures(self, penalties):
+    """
+    Return the static edge feature matrix, with one row per directed edge and one column per cost term
+    [d, c, h, dc, dh, ch, dch]. The penalties are already applied to the curvature and sulcal height terms.
+    The direction term (p) depends on the path endpoints and is computed separately.
+    The matrix is built on first use and cached until it is requested with different penalties.
+    :param penalties: Penalties [c, h, dc, dh, ch, dch] applied when curv or sulc are < 0
+    """
+    penaltiesKey = tuple(float(penalty) for penalty in penalties)
+    with self.edgeFeaturesLock:
+      if self.edgeFeatures is not None and self.edgeFeaturesPenalties == penaltiesKey:
+        return self.edgeFeatures
+
+      targets = self.edgeTargets
+      distance = self.edgeLengths
+      curvature = self.getNormalizedCost(self.curv)[targets]
+      sulcalHeight = self.getNormalizedCost(self.sulc)[targets]
+      curvatureNegative = self.curv[targets] < 0.0 if self.curv is not None else np.zeros(self.numberOfEdges, dtype=bool)
+      sulcalHeightNegative = self.sulc[targets] < 0.0 if self.sulc is not None else np.zeros(self.numberOfEdges, dtype=bool)
+      eitherNegative = np.logical_or(curvatureNegative, sulcalHeightNegative)
+
+      edgeFeatures = np.empty((self.numberOfEdges, self.NUMBER_OF_WEIGHTS-1))
+      edgeFeatures[:, 0] = distance
+      edgeFeatures[:, 1] = curvature
+      edgeFeatures[:, 2] = sulcalHeight
+      edgeFeatures[:, 3] = distance * curvature
+      edgeFeatures[:, 4] = distance * sulcalHeight
+      edgeFeatures[:, 5] = curvature * sulcalHeight
+      edgeFeatures[:, 6] = distance * curvature * sulcalHeight
+      negativeMasks = [curvatureNegative, sulcalHeightNegative, curvatureNegative, sulcalHeightNegative, eitherNegative, eitherNegative]
+      for penaltyIndex in range(self.NUMBER_OF_PENALTIES):
+        edgeFeatures[negativeMasks[penaltyIndex], penaltyIndex+1] *= penaltiesKey[penaltyIndex]
+
+      self.edgeFeatures = edgeFeatures
+      self.edgeFeaturesPenalties = penaltiesKey
+      return self.edgeFeatures
+
+  def computeEdgeCosts(self, weights, penalties, direction=None, edgeCosts=None):
+    """
+    Compute the cost of each directed edge for the given weights, as the product of the edge feature matrix and
+    the weight vector.
+    :param weights: Weights [d, c, h, dc, dh, ch, dch, p]
+    :param penalties: Penalties [c, h, dc, dh, ch, dch] applied when curv or sulc are < 0
+    :param direction: Direction that the direction weight (p) is computed relative to. Usually the vector from the start
+      to the end of the path.
+    :param edgeCosts: Optional output array of length numberOfEdges
+    :return: NumPy array containing the cost of each edge
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    if edgeCosts is None:
+      edgeCosts = np.empty(self.numberOfEdges)
+    np.dot(self.getEdgeFeatures(penalties), weights[:self.NUMBER_OF_WEIGHTS-1], out=edgeCosts)
+
+    if weights[7] != 0.0 and direction is not None:
+      edgeCosts += weights[7] * self.computeDirectionCosts(direction)
+
+    # Dijkstra requires strictly positive edge costs
+    np.maximum(edgeCosts, 1e-12, out=edgeCosts)
+    return edgeCosts
+
+  def computeDirectionCosts(self, direction):
+    """
+    Cost of travelling along each edge relative to the specified direction.
+    Edges parallel to the direction have no cost, and edges in the opposite direction cost their full length.
+    """
+    direction = np.asarray(direction, dtype=np.float64)
+    directionLength = np.linalg.norm(direction)
+    if directionLength == 0.0:
+      return np.zeros(self.numberOfEdges)
+    direction = direction / directionLength
+    return 0.5 * (self.edgeLengths - np.dot(self.edgeVectors, direction))
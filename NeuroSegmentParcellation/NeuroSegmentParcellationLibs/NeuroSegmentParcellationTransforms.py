@@ -0,0 +1,85 @@
+import vtk
+import numpy as np
+from vtk.util import numpy_support
+
+def arrayFromVTKMatrix(matrix):
+  """
+  :param matrix: vtkMatrix4x4
+  :return: 4x4 NumPy array containing a copy of the matrix
+  """
+  return np.array([[matrix.GetElement(row, column) for column in range(4)] for row in range(4)])
+
+def createPoints(points):
+  """
+  :param points: (N, 3) NumPy array
+  :return: vtkPoints containing a copy of the points
+  """
+  vtkPoints = vtk.vtkPoints()
+  vtkPoints.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 3), deep=True))
+  return vtkPoints
+
+def arrayFromPoints(points):
+  """
+  :param points: vtkPoints
+  :return: (N, 3) float64 NumPy array containing a copy of the points
+  """
+  if points is None or points.GetNumberOfPoints() == 0:
+    return np.zeros((0, 3))
+  return numpy_support.vtk_to_numpy(points.GetData()).astype(np.float64).reshape(-1, 3)
+
+def getControlPointPositionsWorld(markupsNode):
+  """
+  :return: (N, 3) NumPy array of the world positions of all control points of the markups node
+  """
+  points = vtk.vtkPoints()
+  markupsNode.GetControlPointPositionsWorld(points)
+  return arrayFromPoints(points)
+
+def transformPoints(points, transformableNode, toWorld=True):
+  """
+  Transform all of the points between the coordinate system of a transformable node and the world coordinate system at once.
+  If the parent transform is linear, the points are multiplied by the composed transform matrix. Otherwise, all of the
+  points are transformed by a single call to the general transform.
+  :param points: (N, 3) NumPy array of points
+  :param transformableNode: Node that the points are relative to (ex. a model node)
+  :param toWorld: If True, the points are transformed from the node to world coordinates, otherwise from world to node coordinates
+  :return: (N, 3) NumPy array of the transformed points
+  """
+  points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+  parentTransformNode = transformableNode.GetParentTransformNode() if transformableNode is not None else None
+  if parentTransformNode is None or len(points) == 0:
+    return points.copy()
+
+  if parentTransformNode.IsTransformToWorldLinear():
+    matrix = vtk.vtkMatrix4x4()
+    if toWorld:
+      parentTransformNode.GetMatrixTransformToWorld(matrix)
+    else:
+      parentTransformNode.GetMatrixTransformFromWorld(matrix)
+    matrix = arrayFromVTKMatrix(matrix)
+    return points.dot(matrix[:3, :3].T) + matrix[:3, 3]
+
+  # Only imported here, so that the other functions can be used outside of Slicer (ex. by CurveComparisonBatch)
+  import slicer
+  transform = vtk.vtkGeneralTransform()
+  if toWorld:
+    slicer.vtkMRMLTransformNode.GetTransformBetweenNodes(parentTransformNode, None, transform)
+  else:
+    slicer.vtkMRMLTransformNode.GetTransformBetweenNodes(None, parentTransformNode, transform)
+  outputPoints = vtk.vtkPoints()
+  transform.TransformPoints(createPoints(points), outputPoints)
+  return arrayFromPoints(outputPoints)
+
+def transformPointsToWorld(points, transformableNode):
+  """
+  :param points: (N, 3) NumPy array of points in the coordinate system of the node
+  :return: (N, 3) NumPy array of the points in world coordinates
+  """
+  return transformPoints(points, transformableNode, True)
+
+def transformPointsFromWorld(points, transformableNode):
+  """
+  :param points: (N, 3) NumPy array of points in world coordinates
+  :return: (N, 3) NumPy array of the points in the coordinate system of the node
+  """
+  return transformPoints(points, transformableNode, False)
@@ -3,6 +3,8 @@ import ast
 import vtk, slicer
 import logging
 
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationPathSolver import NeuroSegmentParcellationPathSolver
+
 class NeuroSegmentParcellationVisitor(ast.NodeVisitor):
   """
   ast NodeVisitor subclass that parses a query string to create the specified input and output MRML Nodes.
@@ -11,6 +13,7 @@ class NeuroSegmentParcellationVisitor(ast.NodeVisitor):
   Basic format uses the following syntax:
     _DistanceWeightingValues = [d, c, h, dc, dh, ch, dch, p] # Weighting for pathfinding (d=distance, c=curvature, h=sulcal height, p=direction)
     _DistanceWeightingPenalties = [c, h, dc, dh, ch, dch] # Penalties applied when c or s are < 0.
+    _PathSearchMode = AStar # Search mode of NeuroSegmentParcellationPathSolver for the following curves (Dijkstra, Bidirectional or AStar)
     _Planes = [...] # Create or retrieve all vtkMRMLMarkupPlaneNode with the specified names in the scene
     _Curves = [...] # Create or retrieve all vtkMRMLMarkupsFreeSurferCurveNode with the specified names in the scene
     _ClosedCurves = [...] # Create or retrieve all vtkMRMLMarkupsClosedCurveNode with the specified names in the scene
@@ -39,6 +42,7 @@ class NeuroSegmentParcellationVisitor(ast.NodeVisitor):
       10.0, # ch
       10.0, # dch
     ]
+    self.searchMode = NeuroSegmentParcellationPathSolver.DIJKSTRA_SEARCH
 
   def setParameterNode(self, parameterNode):
     self.parameterNode = parameterNode
@@ -86,6 +90,9 @@ class NeuroSegmentParcellationVisitor(ast.NodeVisitor):
     elif target.id == "_DistanceWeightingPenalties":
       self.process__DistanceWeightingPenalties(node.value)
       return
+    elif target.id == "_PathSearchMode":
+      self.process__PathSearchMode(node.value)
+      return
 
     outputModel = slicer.util.getFirstNodeByClassByName("vtkMRMLModelNode", target.id)
     if outputModel is None:
@@ -199,6 +206,7 @@ class NeuroSegmentParcellationVisitor(ast.NodeVisitor):
           ]
         for i in range(len(penaltyFunctions)):
           penaltyFunctions[i](self.penalties[i])
+        inputNode.SetAttribute(NeuroSegmentParcellationPathSolver.SEARCH_MODE_ATTRIBUTE_NAME, self.searchMode)
 
       inputNodes.append(inputNode)
       self.parameterNode.AddNodeReferenceID(self.logic.INPUT_MARKUPS_REFERENCE, inputNode.GetID())
@@ -222,6 +230,15 @@ class NeuroSegmentParcellationVisitor(ast.NodeVisitor):
       return
     self.penalties = distanceWeightingPenalties
 
+  def process__PathSearchMode(self, node):
+    """
+    Process the search mode used for pathfinding by NeuroSegmentParcellationPathSolver
+    """
+    if not isinstance(node, ast.Name) or node.id not in NeuroSegmentParcellationPathSolver.SEARCH_MODES:
+      logging.error("Invalid path search mode in line %d" % node.lineno)
+      return
+    self.searchMode = node.id
+
   def visit_Name(self, node):
     """
     Return the name of the current node in a list
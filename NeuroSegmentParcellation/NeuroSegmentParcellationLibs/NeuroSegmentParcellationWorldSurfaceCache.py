@@ -0,0 +1,222 @@
+import vtk, slicer
+import logging
+from vtk.util import numpy_support
+
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationPointLocator import NeuroSegmentParcellationPointLocator
+from NeuroSegmentParcellationLibs.NeuroSegmentParcellationSurfaceGraph import NeuroSegmentParcellationSurfaceGraph
+
+class NeuroSegmentParcellationWorldSurfaceCache(object):
+  """
+  Cache of the world space geometry of surface model nodes, shared by all modules that use the surfaces
+  (see getSharedCache).
+
+  The world space surface of each model node is computed once, and is reused until the surface points, polygons or scalars,
+  or any of the parent transforms of the model node are modified. The world space surface is discarded as soon as the
+  model node invokes TransformModifiedEvent, and the cache keys are checked when the surface is accessed. Items that are derived from the world space surface
+  (surface graph, pedigree ids, or items created by other modules using getItem) are created on demand, and are
+  discarded together with the world space surface.
+  The point locator of the model space surface (see getPointLocator) only depends on the model polydata, so it is kept
+  when only the transforms are modified. All nearest point queries against the surfaces (ex. by
+  NeuroSegmentParcellationSurfaceCorrespondence and CurveComparison) should use the locators of the cache.
+  """
+
+  # Name of the point data array containing the index of each world surface point in the model polydata
+  POINT_PEDIGREE_ARRAY_NAME = "pointPedigree"
+
+  _sharedCache = None
+
+  @classmethod
+  def getSharedCache(cls):
+    """
+    :return: Cache instance that is shared by all logic instances
+    """
+    if cls._sharedCache is None:
+      cls._sharedCache = cls()
+    return cls._sharedCache
+
+  def __init__(self):
+    # Model node ID -> dictionary containing the model node, the cache keys, and the cached items
+    self.entries = {}
+    self.numberOfWorldSurfaceUpdates = 0
+
+  @staticmethod
+  def getGeometryKey(surfaceNode):
+    """
+    Return the modified times of the model polydata that the cached surface depends on.
+    The point data is not included, since overlays (ex. ISO regions) are added to the surface point data.
+    """
+    polyData = surfaceNode.GetPolyData()
+    points = polyData.GetPoints()
+    key = [polyData, points.GetMTime() if points else None, polyData.GetPolys().GetMTime()]
+    for arrayName in ["curv", "sulc"]:
+      array = polyData.GetPointData().GetArray(arrayName)
+      key.append(array.GetMTime() if array else None)
+    return tuple(key)
+
+  @staticmethod
+  def getTransformKey(surfaceNode):
+    """
+    Return the IDs of all of the parent transforms of the model node, and the modified time of their composed transform.
+    The node MTime of the transform nodes is not used, since it is not updated when the transform matrix is modified.
+    """
+    parentTransformNode = surfaceNode.GetParentTransformNode()
+    if parentTransformNode is None:
+      return ()
+    key = [parentTransformNode.GetTransformToWorldMTime()]
+    transformNode = parentTransformNode
+    while transformNode:
+      key.append(transformNode.GetID())
+      transformNode = transformNode.GetParentTransformNode()
+    return tuple(key)
+
+  def getEntry(self, surfaceNode):
+    """
+    Return the cache entry of the model node, discarding any items that are no longer valid.
+    """
+    if surfaceNode is None or surfaceNode.GetPolyData() is None:
+      return None
+
+    geometryKey = self.getGeometryKey(surfaceNode)
+    transformKey = self.getTransformKey(surfaceNode)
+    entry = self.entries.get(surfaceNode.GetID())
+    if entry is None or entry["node"] is not surfaceNode:
+      self.removeUnusedEntries()
+      if surfaceNode.GetID() in self.entries:
+        self.removeEntry(surfaceNode.GetID())
+      entry = {
+        "node": surfaceNode,
+        "geometryKey": None,
+        "transformKey": None,
+        "pointLocator": None,
+        "worldSurface": None,
+        "items": {},
+        }
+      nodeID = surfaceNode.GetID()
+      entry["observerTag"] = surfaceNode.AddObserver(slicer.vtkMRMLTransformableNode.TransformModifiedEvent,
+        lambda caller, eventId: self.onTransformModified(nodeID))
+      self.entries[nodeID] = entry
+
+    if entry["geometryKey"] != geometryKey:
+      entry["pointLocator"] = None
+      entry["worldSurface"] = None
+      entry["items"] = {}
+    elif entry["transformKey"] != transformKey:
+      entry["worldSurface"] = None
+      entry["items"] = {}
+    entry["geometryKey"] = geometryKey
+    entry["transformKey"] = transformKey
+    return entry
+
+  def onTransformModified(self, nodeID):
+    """
+    Discard the world space surface of the model node when its parent transforms are modified.
+    """
+    entry = self.entries.get(nodeID)
+    if entry is None:
+      return
+    entry["worldSurface"] = None
+    entry["items"] = {}
+    entry["transformKey"] = None
+
+  def removeEntry(self, nodeID):
+    entry = self.entries.pop(nodeID)
+    entry["node"].RemoveObserver(entry["observerTag"])
+
+  def removeUnusedEntries(self):
+    """
+    Remove the entries of model nodes that are no longer in a scene.
+    """
+    for nodeID in list(self.entries.keys()):
+      if self.entries[nodeID]["node"].GetScene() is None:
+        self.removeEntry(nodeID)
+
+  def clear(self):
+    for nodeID in list(self.entries.keys()):
+      self.removeEntry(nodeID)
+
+  def getWorldPolyData(self, surfaceNode):
+    """
+    :return: vtkPolyData of the model node surface in world coordinates, with the same points and polygons as the model polydata.
+      The polydata is shared, and must not be modified.
+    """
+    entry = self.getEntry(surfaceNode)
+    if entry is None:
+      return None
+
+    if entry["worldSurface"] is None:
+      transformFilter = vtk.vtkTransformPolyDataFilter()
+      transformFilter.SetInputData(surfaceNode.GetPolyData())
+      modelToWorldTransform = vtk.vtkGeneralTransform()
+      slicer.vtkMRMLTransformNode.GetTransformBetweenNodes(surfaceNode.GetParentTransformNode(), None, modelToWorldTransform)
+      transformFilter.SetTransform(modelToWorldTransform)
+      transformFilter.Update()
+      entry["worldSurface"] = transformFilter.GetOutput()
+      self.numberOfWorldSurfaceUpdates += 1
+      logging.debug("NeuroSegmentParcellationWorldSurfaceCache: Updated world surface of " + surfaceNode.GetName())
+    return entry["worldSurface"]
+
+  def getWorldPoints(self, surfaceNode):
+    """
+    :return: (N, 3) NumPy view of the world space surface points
+    """
+    return self.getItem(surfaceNode, "points",
+      lambda polyData: numpy_support.vtk_to_numpy(polyData.GetPoints().GetData()).reshape(-1, 3))
+
+  def getSurfaceGraph(self, surfaceNode):
+    """
+    :return: NeuroSegmentParcellationSurfaceGraph of the world space surface, containing the cell adjacency of the surface
+    """
+    return self.getItem(surfaceNode, "surfaceGraph", NeuroSegmentParcellationSurfaceGraph.fromPolyData)
+
+  def getPointPedigreePolyData(self, surfaceNode):
+    """
+    :return: World space surface with the POINT_PEDIGREE_ARRAY_NAME point array, which contains the model polydata point id of each point
+    """
+    def createPointPedigreePolyData(polyData):
+      pedigreeIdFilter = vtk.vtkIdFilter()
+      pedigreeIdFilter.SetInputData(polyData)
+      pedigreeIdFilter.PointIdsOn()
+      pedigreeIdFilter.CellIdsOff()
+      pedigreeIdFilter.FieldDataOff()
+      pedigreeIdFilter.SetPointIdsArrayName(self.POINT_PEDIGREE_ARRAY_NAME)
+      pedigreeIdFilter.Update()
+      return pedigreeIdFilter.GetOutput()
+    return self.getItem(surfaceNode, "pointPedigreePolyData", createPointPedigreePolyData)
+
+  def getItem(self, surfaceNode, itemName, createFunction):
+    """
+    Return an item derived from the world space surface, creating it if it does not exist.
+    :param itemName: Name of the item. Should be unique between the modules using the cache.
+    :param createFunction: Function that creates the item from the world space vtkPolyData
+    :return: Cached item, or None if the model node does not have a surface
+    """
+    worldPolyData = self.getWorldPolyData(surfaceNode)
+    if worldPolyData is None:
+      return None
+    items = self.entries[surfaceNode.GetID()]["items"]
+    if itemName not in items:
+      items[itemName] = createFunction(worldPolyData)
+    return items[itemName]
+
+  def getPointLocator(self, surfaceNode):
+    """
+    :return: NeuroSegmentParcellationPointLocator of the model polydata points, in model coordinates
+    """
+    entry = self.getEntry(surfaceNode)
+    if entry is None:
+      return None
+    if entry["pointLocator"] is None:
+      points = surfaceNode.GetPolyData().GetPoints()
+      points = numpy_support.vtk_to_numpy(points.GetData()).reshape(-1, 3) if points else None
+      entry["pointLocator"] = NeuroSegmentParcellationPointLocator(points if points is not None else [])
+    return entry["pointLocator"]
+
+  def getWorldPointLocator(self, surfaceNode):
+    """
+    :return: NeuroSegmentParcellationPointLocator of the world space surface points.
+      If the model node is not transformed, this is the same locator as getPointLocator.
+    """
+    if surfaceNode is not None and surfaceNode.GetParentTransformNode() is None:
+      return self.getPointLocator(surfaceNode)
+    return self.getItem(surfaceNode, "pointLocator",
+      lambda polyData: NeuroSegmentParcellationPointLocator(self.getWorldPoints(surfaceNode)))